@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import collections
+import csv
+import json
+import multiprocessing
+import os
+import tonnetz
+"""
+Análisis de una colección de ficheros MIDI sobre el diagrama de Tonnetz, sin
+interfaz. Las notas de cada fichero se pasan a arrays de NumPy y se agrupan en
+ventanas de tiempo como en detect_chord, y los acordes se buscan entre los
+triángulos de la red. Para cada pieza se cuentan las visitas a cada
+triángulo, las transformaciones P, L y R entre acordes seguidos y la longitud
+del camino recorrido. Los ficheros se reparten
+entre todos los núcleos con un conjunto de procesos.
+'python analisis.py carpeta --json informe.json --csv informe.csv'
+"""
+
+MAX_CHORD_INTERVAL = 0.5  # El mismo intervalo que usa main.py para detectar acordes
+
+
+# Obtenemos (raíz, "M" o "m") de un acorde mayor o menor, o None si no lo es
+def triad(notes):
+    pitch_classes = {tonnetz.pitch_class(note) for note in notes}
+    for root in pitch_classes:
+        if pitch_classes == {root, (root + 4) % 12, (root + 7) % 12}:
+            return (root, "M")
+        if pitch_classes == {root, (root + 3) % 12, (root + 7) % 12}:
+            return (root, "m")
+    return None
+
+
+# Nombre de un acorde, por ejemplo "C" o "Am"
+def triad_name(chord):
+    root, quality = chord
+    if quality == "M":
+        return tonnetz.NOTE_NAMES[root]
+    return tonnetz.NOTE_NAMES[root] + "m"
+
+
+# Acordes vecinos en el diagrama, los que comparten un lado del triángulo
+def plr_neighbors(chord):
+    root, quality = chord
+    if quality == "M":
+        return {
+            "P": (root, "m"),
+            "R": ((root + 9) % 12, "m"),
+            "L": ((root + 4) % 12, "m"),
+        }
+    return {
+        "P": (root, "M"),
+        "R": ((root + 3) % 12, "M"),
+        "L": ((root + 8) % 12, "M"),
+    }
+
+
+# Transformación PLR más corta entre cada par de acordes, buscada en anchura
+def plr_words():
+    chords = [(root, quality) for quality in "Mm" for root in range(12)]
+    words = {}
+
+    for start in chords:
+        words[(start, start)] = ""
+        pending = collections.deque([start])
+        while pending:
+            current = pending.popleft()
+            for letter, neighbor in plr_neighbors(current).items():
+                if (start, neighbor) not in words:
+                    words[(start, neighbor)] = words[(start, current)] + letter
+                    pending.append(neighbor)
+
+    return words
+
+
+# Triadas de los triángulos de la red, en el orden de tonnetz.triangle_index
+def triangle_triads():
+    return [triad(notes) for notes in tonnetz.triangle_table()]
+
+
+# Analizamos un fichero MIDI y devolvemos sus estadísticas
+def analyze_file(path, max_interval=MAX_CHORD_INTERVAL):
+    import mido
+    import numpy as np
+
+    try:
+        midi_file = mido.MidiFile(path)
+    except (OSError, EOFError, KeyError, ValueError) as e:
+        return {"fichero": path, "error": str(e) or type(e).__name__}
+
+    onsets = array.array("d")
+    midi_notes = array.array("B")
+    current_time = 0.0
+    for msg in midi_file:
+        current_time += msg.time
+        if msg.type == "note_on" and msg.velocity > 0:
+            onsets.append(current_time)
+            midi_notes.append(msg.note)
+
+    # Igual que en el diagrama, solo cuenta si las notas de la ventana forman un triángulo
+    pitches = tonnetz.pitch_classes(midi_notes)
+    windows = tonnetz.chord_windows(onsets, max_interval)
+    ids = tonnetz.triangle_ids(tonnetz.chord_masks(pitches, windows))
+    ids = ids[ids >= 0]
+    # Un acorde que se mantiene en varias notas seguidas es una sola visita
+    if len(ids):
+        ids = ids[np.concatenate(([True], ids[1:] != ids[:-1]))]
+
+    triads = triangle_triads()
+    words = plr_words()
+    visits = {
+        triad_name(triads[index]): int(count)
+        for index, count in enumerate(np.bincount(ids, minlength=len(triads)))
+        if count
+    }
+
+    transitions = collections.Counter()
+    pairs, counts = np.unique(np.stack((ids[:-1], ids[1:])),
+                              axis=1,
+                              return_counts=True)
+    for (previous_id, current_id), count in zip(pairs.T, counts):
+        word = words[(triads[previous_id], triads[current_id])]
+        transitions[word] += int(count)
+
+    return {
+        "fichero": path,
+        "duracion": midi_file.length,
+        "notas": len(midi_notes),
+        "acordes": len(ids),
+        "longitud_camino": sum(
+            len(word) * count for word, count in transitions.items()),
+        "visitas": visits,
+        "transiciones": dict(transitions),
+    }
+
+
+# Buscamos todos los ficheros MIDI de una carpeta y sus subcarpetas
+def find_midi_files(directory):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.lower().endswith((".mid", ".midi")):
+                paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+# Analizamos todos los ficheros repartiéndolos entre varios procesos
+def analyze_corpus(paths, processes=None, max_interval=MAX_CHORD_INTERVAL):
+    pieces = []
+    totals = {
+        "piezas": 0,
+        "errores": 0,
+        "notas": 0,
+        "acordes": 0,
+        "longitud_camino": 0,
+        "visitas": collections.Counter(),
+        "transiciones": collections.Counter(),
+    }
+
+    # Los trozos grandes evitan que los procesos se pasen ficheros de uno en uno
+    chunksize = max(1, len(paths) // ((processes or os.cpu_count()) * 8))
+    with multiprocessing.Pool(processes) as pool:
+        results = pool.imap_unordered(analyze_file_with_interval,
+                                      [(path, max_interval) for path in paths],
+                                      chunksize)
+        for result in results:
+            pieces.append(result)
+            if "error" in result:
+                totals["errores"] += 1
+                continue
+            totals["piezas"] += 1
+            totals["notas"] += result["notas"]
+            totals["acordes"] += result["acordes"]
+            totals["longitud_camino"] += result["longitud_camino"]
+            totals["visitas"].update(result["visitas"])
+            totals["transiciones"].update(result["transiciones"])
+
+    pieces.sort(key=lambda piece: piece["fichero"])
+    totals["visitas"] = dict(totals["visitas"])
+    totals["transiciones"] = dict(totals["transiciones"])
+
+    return {"piezas": pieces, "total": totals}
+
+
+# Pool.imap solo pasa un argumento, así que desempaquetamos la tupla
+def analyze_file_with_interval(args):
+    return analyze_file(*args)
+
+
+# Guardamos el informe completo en JSON
+def write_json(report, path):
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2, ensure_ascii=False)
+
+
+# Guardamos una fila por pieza en CSV
+def write_csv(report, path):
+    chords = [
+        triad_name((root, quality)) for quality in "Mm" for root in range(12)
+    ]
+    columns = ["fichero", "duracion", "notas", "acordes", "longitud_camino"]
+
+    with open(path, "w", newline="") as report_file:
+        writer = csv.writer(report_file)
+        writer.writerow(columns + chords + ["P", "L", "R", "compuestas"])
+        for piece in report["piezas"]:
+            if "error" in piece:
+                continue
+            transitions = piece["transiciones"]
+            compound = sum(count for word, count in transitions.items()
+                           if len(word) > 1)
+            writer.writerow([piece[column] for column in columns] +
+                            [piece["visitas"].get(chord, 0)
+                             for chord in chords] +
+                            [transitions.get(letter, 0)
+                             for letter in "PLR"] + [compound])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Análisis de ficheros MIDI sobre el diagrama de Tonnetz")
+    parser.add_argument("carpeta", help="Carpeta con los ficheros MIDI")
+    parser.add_argument("--json",
+                        default="informe.json",
+                        help="Fichero JSON con el informe completo")
+    parser.add_argument("--csv", help="Fichero CSV con una fila por pieza")
+    parser.add_argument("--procesos",
+                        type=int,
+                        default=None,
+                        help="Número de procesos, por defecto uno por núcleo")
+    parser.add_argument("--ventana",
+                        type=float,
+                        default=MAX_CHORD_INTERVAL,
+                        help="Segundos entre notas para detectar un acorde")
+    args = parser.parse_args()
+
+    paths = find_midi_files(args.carpeta)
+    print("Analizando {} ficheros MIDI".format(len(paths)))
+
+    report = analyze_corpus(paths, args.procesos, args.ventana)
+    write_json(report, args.json)
+    if args.csv:
+        write_csv(report, args.csv)
+
+    print("Piezas analizadas: {}, con errores: {}".format(
+        report["total"]["piezas"], report["total"]["errores"]))
+
+
+if __name__ == "__main__":
+    main()
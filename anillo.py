@@ -0,0 +1,114 @@
+import struct
+import threading
+"""
+Anillo de memoria compartida entre el proceso del motor MIDI y el de la
+ventana. El motor escribe registros de tamaño fijo (instante, tipo, color,
+figura y valor) y la ventana los lee cuando puede, sin que ninguno de los dos
+espere al otro: si la ventana se queda parada el anillo se llena y los
+registros nuevos se cuentan como descartados, pero el motor sigue tocando.
+
+La cabecera guarda cuántos registros se han escrito, cuántos se han leído y
+cuántos se han descartado. Solo el motor cambia los escritos y solo la
+ventana los leídos, y cada uno se escribe después de los registros que
+cuenta, así que no hace falta un cerrojo entre procesos. Dentro del motor
+escriben varios hilos, que sí se turnan con un cerrojo.
+
+Los contadores están alineados y se leen y escriben de uno en uno como
+uint64 del procesador a través de una vista de memoria, igual que la
+secuencia de exportador.py. struct los escribiría byte a byte, y el otro
+proceso podría leer un contador a medias.
+"""
+
+HEADER = struct.Struct("<QQQ")  # Escritos, leídos y descartados
+RECORD = struct.Struct("<dBBHi")  # Instante, tipo, color, figura y valor
+RING_SIZE = 4096  # Registros que caben en el anillo
+WRITTEN = 0  # Índices de cada contador en la vista de la cabecera
+READ = 1
+DROPPED = 2
+
+
+# Creamos un anillo nuevo en memoria compartida
+def create_ring(capacity=RING_SIZE):
+    from multiprocessing import shared_memory
+
+    memory = shared_memory.SharedMemory(create=True,
+                                        size=HEADER.size +
+                                        capacity * RECORD.size)
+    HEADER.pack_into(memory.buf, 0, 0, 0, 0)
+    return {
+        "memory": memory,
+        "counters": counters_view(memory),
+        "capacity": capacity,
+        "lock": threading.Lock(),  # Turna a los hilos que escriben
+    }
+
+
+# Abrimos desde otro proceso un anillo ya creado
+def attach_ring(name, capacity=RING_SIZE):
+    from multiprocessing import shared_memory
+
+    memory = shared_memory.SharedMemory(name=name)
+    return {
+        "memory": memory,
+        "counters": counters_view(memory),
+        "capacity": capacity,
+        "lock": threading.Lock(),
+    }
+
+
+# Vista de los contadores de la cabecera como uint64, la memoria compartida empieza alineada
+def counters_view(memory):
+    return memory.buf[:HEADER.size].cast("Q")
+
+
+# Nombre con el que otro proceso puede abrir el anillo
+def ring_name(ring):
+    return ring["memory"].name
+
+
+# Añadimos un registro, o lo contamos como descartado si el anillo está lleno
+def push(ring, timestamp, kind, color=0, shape=0, value=0):
+    buffer = ring["memory"].buf
+    counters = ring["counters"]
+    with ring["lock"]:
+        written = counters[WRITTEN]
+        if written - counters[READ] >= ring["capacity"]:
+            counters[DROPPED] += 1
+            return False
+        RECORD.pack_into(
+            buffer,
+            HEADER.size + written % ring["capacity"] * RECORD.size,
+            timestamp, kind, color, shape, value)
+        # El contador se escribe al final, así el lector nunca ve un registro a medias
+        counters[WRITTEN] = written + 1
+    return True
+
+
+# Sacamos todos los registros que hay en el anillo
+def pop_all(ring):
+    buffer = ring["memory"].buf
+    counters = ring["counters"]
+    # Cada contador se lee una sola vez, así los registros y el nuevo leídos van con el mismo
+    written = counters[WRITTEN]
+    read = counters[READ]
+    records = [
+        RECORD.unpack_from(buffer,
+                           HEADER.size + index % ring["capacity"] * RECORD.size)
+        for index in range(read, written)
+    ]
+    counters[READ] = written
+    return records
+
+
+# Registros descartados porque el anillo estaba lleno
+def ring_dropped(ring):
+    return ring["counters"][DROPPED]
+
+
+# Cerramos el anillo, quien lo creó además lo borra
+def close_ring(ring, unlink=False):
+    # La memoria no se puede cerrar mientras haya vistas sobre ella
+    ring["counters"].release()
+    ring["memory"].close()
+    if unlink:
+        ring["memory"].unlink()
@@ -1,5 +1,11 @@
+import functools
+import math
 import random
 
+ARPEGGIO_MODES = ("up", "down", "random", "up_down", "down_up", "converge",
+                  "as_played", "strum", "euclidean", "user")
+RANDOM_CYCLES = 8  # Vueltas distintas que se precalculan en el modo random
+
 # Diccionario de notas con sus valores midi correspondientes
 dict_notes = {
     "C": 60,
@@ -42,52 +48,155 @@ def calculate_time_between_notes(tempo, compas):
     return time_between_notes
 
 
-# Extiende las notas la octava que se haya marcado
-def extend_octave(notes_to_play, octave):
-    extended_notes = []
-
-    for midi_note in notes_to_play:
-        for i in range(octave.get()):
-            extended_notes.append(midi_note + i * 12)
-
-    return sorted(list(extended_notes))
-
-
-# Ordena las notas según el modo en el que estemos
-def order_arpeggio_notes(midi_notes, type):
-    if type == "up":
-        # Ordenar de menor a mayor
-        midi_notes.sort()
-    elif type == "down":
-        # Ordenar de mayor a menor
-        midi_notes.sort(reverse=True)
-    elif type == "random":
-        # Orden aleatorio
-        random.shuffle(midi_notes)
-
-    return midi_notes
-
-
-# Obtiene las notas ordenadas que deben sonar
-def get_arpeggio_notes(selected_shapes, triangle_ids, compas, octave, mode):
+# Instantes del note_on y del note_off de un paso, el note_off es None si el paso está ligado
+def step_times(step, step_time, step_length, gate, swing, ties):
+    # Los pasos impares se retrasan con el swing, hasta tres cuartos del paso
+    on_time = step_time
+    if step % 2 == 1:
+        on_time += step_length * min(max(swing, 0.0), 0.75)
+
+    # Un paso ligado suena hasta que empieza la nota siguiente
+    if ties and ties[step % len(ties)]:
+        return on_time, None
+
+    # El gate es la parte del paso que suena la nota
+    return on_time, on_time + step_length * min(max(gate, 0.05), 1.0)
+
+
+# Compilamos un modo del arpegiador en los índices de las notas de cada paso
+@functools.lru_cache(maxsize=64)
+def compile_pattern(mode, count, seed=None, pulses=0, length=0,
+                    user_steps=()):
+    """Las notas van de grave a agudo (o en el orden en que se tocaron con
+    as_played), y cada paso es una tupla con los índices de las notas que
+    suenan: vacía es un silencio y con varias es un rasgueo. El resultado
+    solo depende de los parámetros, así que se guarda y al tocar solo se
+    recorre."""
+    if count == 0:
+        return ()
+
+    indices = list(range(count))
+    if mode in ("up", "as_played"):
+        order = indices
+    elif mode == "down":
+        order = indices[::-1]
+    elif mode == "up_down":
+        # Sin repetir la nota más aguda ni la más grave al dar la vuelta
+        order = indices + indices[-2:0:-1]
+    elif mode == "down_up":
+        order = indices[::-1] + indices[1:-1]
+    elif mode == "converge":
+        # De los extremos hacia el centro
+        order = []
+        for low in range(count // 2):
+            order += [low, count - 1 - low]
+        if count % 2:
+            order.append(count // 2)
+    elif mode == "random":
+        # Varias vueltas al azar con la semilla, así el arpegio se puede repetir
+        generator = random.Random(seed)
+        order = []
+        for _ in range(RANDOM_CYCLES):
+            generator.shuffle(indices)
+            order += indices
+    elif mode == "strum":
+        return (tuple(range(count)), )
+    elif mode == "euclidean":
+        return euclidean_pattern(count, pulses, length)
+    elif mode == "user":
+        return user_pattern(count, user_steps)
+    else:
+        print("Modo del arpegiador no válido:", mode)
+        order = indices
+
+    return tuple((index, ) for index in order)
+
+
+# Ritmo euclídeo: pulses notas repartidas lo más igual posible en length pasos
+def euclidean_pattern(count, pulses, length):
+    length = max(1, length)
+    pulses = min(max(1, pulses), length)
+    hits = [(step * pulses) % length < pulses for step in range(length)]
+
+    # Repetimos el ritmo hasta que las notas vuelven a empezar por la primera
+    repeats = count // math.gcd(count, pulses)
+    pattern = []
+    note = 0
+    for _ in range(repeats):
+        for hit in hits:
+            if hit:
+                pattern.append((note % count, ))
+                note += 1
+            else:
+                pattern.append(())
+    return tuple(pattern)
+
+
+# Patrón del usuario: cada paso es un grado (1 la nota más grave, 0 silencio) o una lista de grados
+def user_pattern(count, user_steps):
+    pattern = []
+    for step in user_steps:
+        degrees = step if isinstance(step, tuple) else (step, )
+        pattern.append(
+            tuple((degree - 1) % count for degree in degrees if degree > 0))
+    return tuple(pattern) or compile_pattern("up", count)
+
+
+# Obtiene las notas del acorde del arpegio en una octava, de grave a agudo o como se tocaron
+def get_arpeggio_notes(selected_shapes, shape_notes, compas, mode):
     compas_value = compas.get()
 
     notes_to_play = []
     for shape_id, shape_type in selected_shapes.items():
         if shape_type == "triangle":
-            notes = triangle_ids[shape_id]["notes"]
-            notes_to_play.extend(notes)
+            notes_to_play.extend(shape_notes[shape_id])
 
-    unique_notes = set(notes_to_play)
-    midi_notes = convert_note_to_midi(unique_notes)
+    # Sin repetidas pero en el orden en que se seleccionaron
+    midi_notes = list(dict.fromkeys(notes_to_play))
+    if mode != "as_played":
+        midi_notes.sort()
 
-    compas_value.split('/')
     # Si el compás necesita 4 notas por compás repetimos la primera
     if int(compas_value[0]) % 3 != 0:
-        if midi_notes:
+        if midi_notes and mode == "as_played":
             midi_notes.append(midi_notes[0])
-
-    extended_notes = extend_octave(midi_notes, octave)
-    ordered_notes = order_arpeggio_notes(extended_notes, mode)
-
-    return ordered_notes
\ No newline at end of file
+        elif midi_notes:
+            # Junto a la original, para que el acorde siga ordenado de grave a agudo
+            midi_notes.insert(0, midi_notes[0])
+
+    return tuple(midi_notes)
+
+
+# Generador infinito con las notas de cada paso del arpegio
+def arpeggio_steps(target):
+    """target es un diccionario con notes (las del acorde en una octava),
+    octaves, mode y params (los parámetros de compile_pattern). Se lee en
+    cada paso, así que al cambiarlo el arpegio sigue con el acorde nuevo
+    desde el paso siguiente, en el mismo punto de la vuelta. Las octavas
+    no se guardan en una lista: la nota i es la nota i % n del acorde
+    subida i // n octavas. Las notas del acorde, con la repetida, van
+    ordenadas y caben en una octava, así que la lista sigue ordenada de
+    grave a agudo: en 4/4 con dos octavas up toca 60, 60, 64, 67, 72, 72,
+    76, 79."""
+    key = None
+    pattern = ()
+    index = 0
+
+    while True:
+        notes = target["notes"]
+        new_key = (notes, target["octaves"], target["mode"], target["params"])
+        if new_key != key:
+            key = new_key
+            pattern = compile_pattern(target["mode"],
+                                      len(notes) * target["octaves"],
+                                      *target["params"])
+            index = index % len(pattern) if pattern else 0
+
+        if not pattern:
+            yield ()
+            continue
+
+        step = pattern[index]
+        index = (index + 1) % len(pattern)
+        yield tuple(notes[i % len(notes)] + 12 * (i // len(notes))
+                    for i in step)
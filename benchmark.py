@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+
+import anillo
+import contextlib
+import emisor
+import exportador
+import io
+import os
+import tempfile
+import threading
+import socket
+import subprocess
+import sys
+import time
+import types
+import enrutador
+import main
+import motor
+import reloj
+import temporizador
+import tiempo_real
+import tonnetz
+"""
+Pruebas de rendimiento del programa, no necesitan ventana ni puertos MIDI
+'python benchmark.py'
+"""
+
+
+# Valor con el método get, como las variables de Tk, pero sin necesitar ventana
+def fixed_value(value):
+    return types.SimpleNamespace(get=lambda: value)
+
+
+# Medimos cuánto se bloquea el hilo principal al cambiar de puerto
+def benchmark_port_swap(swaps=20):
+    triangle_ids = {1: {"cell": (0, 0), "notes": ["C", "E", "G"]}}
+    main.select_shape(1, "triangle", triangle_ids[1]["notes"])
+    main.global_config["arpeggiator_active"] = True
+
+    # A 30 bpm cada nota dura 2 segundos, el peor caso para detener el arpegiador
+    tempo = fixed_value(30)
+    compas = fixed_value("4/4")
+    octave = fixed_value(1)
+
+    stalls = []
+    # Los hilos escriben mensajes al abrir puertos, no los mostramos
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.start_midi_out_thread("no-midi", triangle_ids)
+        main.start_arpeggiator_thread("no-midi", triangle_ids, tempo, compas,
+                                      octave)
+        time.sleep(0.1)
+
+        for _ in range(swaps):
+            start = time.perf_counter()
+            main.start_midi_in_thread(None, None, "no-midi", "no-midi",
+                                      triangle_ids)
+            main.start_midi_out_thread("no-midi", triangle_ids)
+            main.start_arpeggiator_thread("no-midi", triangle_ids, tempo,
+                                          compas, octave)
+            stalls.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+        for stop_key in ("midi_in_stop_event", "stop_event",
+                         "arpeggiator_stop_event"):
+            main.threads_control[stop_key].set()
+
+    main.global_config["arpeggiator_active"] = False
+    main.clear_selected_shapes()
+
+    print("Cambio de puertos ({} cambios):".format(swaps))
+    print("  Bloqueo máximo de la ventana: {:.2f} ms".format(
+        max(stalls) * 1000))
+    print("  Bloqueo medio de la ventana: {:.2f} ms".format(
+        sum(stalls) / len(stalls) * 1000))
+
+
+# Comparamos pasar notas a triángulos nota a nota y con arrays de NumPy
+def benchmark_note_conversion(notes=1000000, loop_notes=100000):
+    import numpy as np
+
+    random = np.random.default_rng(0)
+    midi_notes = random.integers(36, 96, notes)
+    onsets = np.cumsum(random.exponential(0.15, notes))
+    table = tonnetz.triangle_table()
+
+    # Nota a nota, como detect_chord, con una parte de las notas
+    start = time.perf_counter()
+    note_times = {}
+    for midi_note, onset in zip(midi_notes[:loop_notes].tolist(),
+                                onsets[:loop_notes].tolist()):
+        note = main.convert_midi_to_note(midi_note)
+        chord = tonnetz.chord_window(note_times, note, onset,
+                                     main.MAX_CHORD_INTERVAL)
+        table.get(frozenset(chord))
+    loop_time = (time.perf_counter() - start) * notes / loop_notes
+
+    start = time.perf_counter()
+    windows = tonnetz.chord_windows(onsets, main.MAX_CHORD_INTERVAL)
+    masks = tonnetz.chord_masks(tonnetz.pitch_classes(midi_notes), windows)
+    ids = tonnetz.triangle_ids(masks)
+    vector_time = time.perf_counter() - start
+
+    print("Notas a triángulos ({} notas):".format(notes))
+    print("  Nota a nota: {:.2f} s".format(loop_time))
+    print("  Con arrays: {:.3f} s, {} acordes".format(
+        vector_time, int((ids >= 0).sum())))
+
+
+# Medimos las colas de salida durante una avalancha de mensajes MIDI
+def benchmark_output_storm(messages=3000, delay=0.001):
+    import mido
+
+    open_output = mido.open_output
+    mido.open_output = lambda port_name: contextlib.nullcontext(
+        types.SimpleNamespace(send=lambda message: time.sleep(delay)))
+
+    print("Avalancha de salida ({} notas a un puerto de {} ms):".format(
+        messages, delay * 1000))
+    try:
+        for overflow in enrutador.OVERFLOW_POLICIES:
+            port_name = "avalancha-" + overflow
+            destinations = [(port_name, 0, 64, overflow)]
+            start = time.perf_counter()
+            for index in range(messages):
+                note = 60 + index % 12
+                enrutador.send(
+                    mido.Message("note_on", note=note, velocity=100),
+                    destinations)
+                enrutador.send(
+                    mido.Message("control_change", control=1,
+                                 value=index % 128), destinations)
+                enrutador.send(mido.Message("note_off", note=note),
+                               destinations)
+            send_time = time.perf_counter() - start
+            enrutador.stop_router(timeout=10)
+
+            stats = enrutador.router_stats()[port_name]
+            print("  {}: envío {:.1f} us/mensaje, descartados {}, juntados {},"
+                  " cola máx. {}, espera máx. {:.1f} ms".format(
+                      overflow, send_time / (messages * 3) * 1000000,
+                      stats["dropped"], stats["coalesced"],
+                      stats["max_depth"], stats["max_wait"] * 1000))
+    finally:
+        mido.open_output = open_output
+
+
+# Retrasos ordenados con los que el temporizador ejecuta sus funciones
+def timer_lateness(timers, spacing, precise=True):
+    lateness = []
+    done = threading.Event()
+
+    def record(deadline):
+        lateness.append(time.perf_counter() - deadline)
+        if len(lateness) == timers:
+            done.set()
+
+    start = time.perf_counter() + 0.05
+    for index in range(timers):
+        deadline = start + index * spacing
+        temporizador.schedule_at(deadline,
+                                 lambda deadline=deadline: record(deadline),
+                                 precise=precise)
+    done.wait(timers * spacing + 5)
+
+    return sorted(lateness)
+
+
+# Mostramos la mediana, el p99 y el máximo de unos retrasos ordenados
+def print_lateness(lateness):
+    print("  Retraso mediano: {:.3f} ms, p99: {:.3f} ms, máximo: {:.3f} ms".
+          format(lateness[len(lateness) // 2] * 1000,
+                 lateness[int(len(lateness) * 0.99)] * 1000,
+                 lateness[-1] * 1000))
+
+
+# Medimos con cuánto retraso ejecuta el temporizador sus funciones
+def benchmark_timer_lateness(timers=400, spacing=0.005):
+    print("Temporizador ({} plazos cada {} ms):".format(
+        timers, spacing * 1000))
+    print(" Precisos, como las notas")
+    print_lateness(timer_lateness(timers, spacing))
+    print(" Normales, sin esperar el último momento")
+    print_lateness(timer_lateness(timers, spacing, precise=False))
+
+
+# Medimos el temporizador con la CPU ocupada por otros procesos, sin y con tiempo real
+def benchmark_realtime_jitter(timers=400, spacing=0.005, policy="fifo"):
+    # Un proceso que no para de calcular por cada núcleo
+    hogs = [
+        subprocess.Popen([sys.executable, "-c", "while True: pass"])
+        for _ in range(os.cpu_count() or 1)
+    ]
+    print("Temporizador con {} procesos ocupando la CPU:".format(len(hogs)))
+    try:
+        time.sleep(0.2)
+        print(" Planificación normal")
+        print_lateness(timer_lateness(timers, spacing))
+
+        # La planificación se aplica desde el propio hilo del temporizador
+        tiempo_real.configure({
+            "realtime_policy": policy,
+            "realtime_threads": ["temporizador"],
+        })
+        applied = []
+        temporizador.schedule(
+            0, lambda: applied.append(
+                tiempo_real.apply_to_thread("temporizador")))
+        time.sleep(0.1)
+        print(" Con {}: {}".format(policy, applied[0] if applied else "?"))
+        print_lateness(timer_lateness(timers, spacing))
+    finally:
+        for hog in hogs:
+            hog.kill()
+        # Devolvemos el hilo del temporizador a la planificación normal
+        if hasattr(os, "sched_setscheduler"):
+            temporizador.schedule(
+                0, lambda: os.sched_setscheduler(0, os.SCHED_OTHER,
+                                                 os.sched_param(0)))
+        tiempo_real.configure({})
+
+
+# Medimos el ritmo de los pasos con reloj externo y de los pulsos del reloj maestro
+def benchmark_clock_sync(tempo=120, beats=32, jitter=0.002):
+    import mido
+    import random
+
+    period = 60 / tempo / reloj.PPQN
+    random.seed(0)
+    steps = []
+    reloj.set_step_callback(lambda: steps.append(time.perf_counter()),
+                            lambda: reloj.ticks_per_step("1/4"), lambda: None)
+
+    # Los pulsos llegan con un retraso aleatorio, como por un puerto USB cargado
+    start = time.perf_counter() + 0.05
+    reloj.clock_message("start", start)
+    ticks = beats * reloj.PPQN
+    for tick in range(ticks):
+        arrival = start + tick * period + random.uniform(0, jitter)
+        while time.perf_counter() < arrival:
+            time.sleep(0.0002)
+        reloj.clock_message("clock", time.perf_counter())
+    reloj.clock_message("stop", time.perf_counter())
+
+    # Los primeros pasos son los que tarda el PLL en engancharse
+    ideal = [start + beat * 6 * period for beat in range(len(steps))]
+    errors = sorted(step - when for step, when in list(zip(steps,
+                                                           ideal))[8:])
+    # El retraso medio de los pulsos se mantiene como un desfase fijo, no cuenta
+    median = errors[len(errors) // 2]
+    deviations = sorted(abs(error - median) for error in errors)
+    print("Reloj externo ({} bpm, pulsos con hasta {} ms de retraso):".format(
+        tempo, jitter * 1000))
+    print("  Desviación de los pasos: mediana {:.3f} ms, p99 {:.3f} ms,"
+          " máxima {:.3f} ms".format(
+              deviations[len(deviations) // 2] * 1000,
+              deviations[int(len(deviations) * 0.99)] * 1000,
+              deviations[-1] * 1000))
+
+    # Reloj maestro: medimos cuándo llegan los pulsos al puerto
+    sent = []
+    open_output = mido.open_output
+    mido.open_output = lambda port_name: contextlib.nullcontext(
+        types.SimpleNamespace(send=lambda message: sent.append(
+            time.perf_counter()) if message.type == "clock" else None))
+    main.config["destinations"] = [{"port": "reloj-maestro"}]
+    try:
+        reloj.start_master(lambda: period,
+                           lambda kind: main.send_clock("no-midi", kind))
+        time.sleep(beats * reloj.PPQN * period)
+        reloj.stop_master()
+        enrutador.stop_router()
+    finally:
+        mido.open_output = open_output
+        main.config["destinations"] = []
+    reloj.clear_step_callback(reloj.clock["step"])
+
+    deviations = sorted(abs(later - earlier - period)
+                        for earlier, later in zip(sent, sent[1:]))
+    print("Reloj maestro ({} pulsos):".format(len(sent)))
+    print("  Desviación entre pulsos: mediana {:.3f} ms, p99 {:.3f} ms,"
+          " máxima {:.3f} ms".format(
+              deviations[len(deviations) // 2] * 1000,
+              deviations[int(len(deviations) * 0.99)] * 1000,
+              deviations[-1] * 1000))
+
+
+# Iteraciones de sum(range(n)) que tienen el GIL cogido unos segundos, como un redibujado largo de Tk
+def gil_block_size(seconds):
+    start = time.perf_counter()
+    sum(range(1000000))
+    return int(1000000 * seconds / (time.perf_counter() - start))
+
+
+# Desviaciones ordenadas entre pasos del arpegiador mientras el hilo principal se para a ratos
+def stalled_steps(read_steps, step_length, seconds, stall):
+    """read_steps devuelve los instantes de los pasos tocados desde la
+    llamada anterior. Cada 100 ms el hilo principal se queda stall segundos
+    sin soltar el GIL."""
+    block = gil_block_size(stall)
+    times = []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(block))
+        times.extend(read_steps())
+        time.sleep(0.1)
+    time.sleep(step_length)
+    times.extend(read_steps())
+
+    # El primer paso llega cuando arranca el arpegiador, no cuenta
+    return sorted(
+        abs(later - earlier - step_length)
+        for earlier, later in zip(times[1:], times[2:]))
+
+
+# Mostramos cuántos pasos se desvían más de 1 ms y cuánto
+def print_steps(deviations):
+    late = sum(1 for deviation in deviations if deviation > 0.001)
+    print("  {} pasos, {} desviados más de 1 ms, desviación máxima {:.3f} ms".
+          format(len(deviations), late, deviations[-1] * 1000))
+
+
+# Comparamos el arpegiador con la ventana parada a ratos, en el mismo proceso y en el motor aparte
+def benchmark_engine_process(tempo=120,
+                             seconds=4,
+                             stall=0.1,
+                             policies=("none", "fifo")):
+    tempo_value = fixed_value(tempo)
+    compas = fixed_value("1/4")
+    octave = fixed_value(1)
+    step_length = 60 / tempo / 4
+    notes = ["C", "E", "G"]
+    window = types.SimpleNamespace(cget=lambda option: "white")
+    canvas = types.SimpleNamespace(itemconfig=lambda shape_id, **options: None)
+
+    print("Arpegiador con la ventana parada {} ms cada 100 ms:".format(
+        stall * 1000))
+    # Mismo proceso: el temporizador espera a que el hilo principal suelte el GIL
+    steps = []
+
+    def listener(kind, *values):
+        steps.append(time.perf_counter())
+
+    main.midi_state["listeners"].append(listener)
+    main.select_shape(1, "triangle", notes)
+    main.global_config["arpeggiator_active"] = True
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.start_arpeggiator_thread("no-midi", {1: {"notes": notes}},
+                                      tempo_value, compas, octave)
+
+        def read_steps():
+            times = steps[:]
+            del steps[:len(times)]
+            return times
+
+        deviations = stalled_steps(read_steps, step_length, seconds, stall)
+        main.threads_control["arpeggiator_stop_event"].set()
+        main.threads_control["arpeggiator_thread"].join()
+    main.midi_state["listeners"].remove(listener)
+    main.clear_selected_shapes()
+    print(" Mismo proceso")
+    print_steps(deviations)
+
+    # Motor aparte: los pasos llegan por el anillo con el instante en que sonaron.
+    # Con un solo núcleo el motor compite por la CPU, por eso se prueba también con fifo
+    def read_engine_steps():
+        return [
+            record[0] for record in anillo.pop_all(main.engine_state["ring"])
+            if record[1] == motor.STEP_RECORD
+        ]
+
+    main.lattice_view["tuning"] = main.lattice_tuning()
+    for policy in policies:
+        main.config.update(engine_process=True, realtime_policy=policy)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.start_engine(window, canvas)
+                main.handle_triangle_click(window, canvas, notes, {})
+                main.start_arpeggiator_thread("no-midi", {}, tempo_value,
+                                              compas, octave)
+
+                # Esperamos al primer paso, el motor tarda en arrancar
+                start = time.perf_counter()
+                while not read_engine_steps(
+                ) and time.perf_counter() - start < 10:
+                    time.sleep(0.01)
+                deviations = stalled_steps(read_engine_steps, step_length,
+                                           seconds, stall)
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.stop_engine()
+            main.config.update(engine_process=False, realtime_policy="none")
+        print(" Motor en otro proceso, planificación {}".format(policy))
+        print_steps(deviations)
+    main.global_config["arpeggiator_active"] = False
+
+
+# Leemos sin parar el fichero del estado como un visualizador y contamos las copias malas
+def read_state_file(path, seconds):
+    import mmap
+
+    with open(path, "rb") as state_file:
+        memory = mmap.mmap(state_file.fileno(), 0, access=mmap.ACCESS_READ)
+    reads = failed = wrong = 0
+    sequence = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        state = exportador.read_state(memory)
+        reads += 1
+        if state is None:
+            failed += 1
+            continue
+        # Cada paso se escribe con su nota, y la secuencia nunca retrocede
+        if state["step_note"] and state["step_note"] != 60 + state[
+                "step"] % 12 or state["sequence"] < sequence:
+            wrong += 1
+        sequence = state["sequence"]
+    print(reads, failed, wrong)
+
+
+# Medimos cuánto cuesta publicar el estado y si otro proceso lo lee siempre entero
+def benchmark_state_export(seconds=2.0):
+    path = os.path.join(tempfile.gettempdir(), "tonnetz-benchmark")
+    with contextlib.redirect_stdout(io.StringIO()):
+        exportador.open_export(path)
+    reader = subprocess.Popen(
+        [
+            sys.executable, "-c",
+            "import sys, benchmark; "
+            "benchmark.read_state_file(sys.argv[1], float(sys.argv[2]))",
+            path, str(seconds)
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    # Seleccionamos y quitamos acordes sin parar mientras el otro proceso lee
+    events = 0
+    start = time.perf_counter()
+    while reader.poll() is None:
+        step = events // 9
+        root = 60 + step % 12
+        chord = [root, root + 4, root + 7]
+        for note in chord:
+            exportador.lattice_event("note", note, True)
+        exportador.lattice_event("triangle", chord, True)
+        exportador.lattice_event("step", step, root)
+        exportador.lattice_event("triangle", chord, False)
+        for note in chord:
+            exportador.lattice_event("note", note, False)
+        events += 9
+    elapsed = time.perf_counter() - start
+    reads, failed, wrong = reader.stdout.read().split()
+    exportador.close_export()
+    os.remove(path)
+
+    print("Estado para visualizadores ({:.0f} s escribiendo y leyendo):".format(
+        seconds))
+    print("  Escritura: {:.1f} us por cambio, {} cambios".format(
+        elapsed / events * 1000000, events))
+    print("  Lecturas: {}, sin copia entera {}, incoherentes {}".format(
+        reads, failed, wrong))
+
+
+# Receptor OSC local: guardamos los pasos que llegan en cada bundle
+def receive_osc(receiver, steps, timetags, stop_event):
+    while not stop_event.is_set():
+        try:
+            data = receiver.recv(65536)
+        except socket.timeout:
+            continue
+        timetag, messages = emisor.parse_packet(data)
+        timetags.append(timetag)
+        steps.extend(args[0] for address, args in messages
+                     if address == "/tonnetz/step")
+
+
+# Medimos cuántos eventos por segundo salen por OSC sin perder ninguno
+def benchmark_osc_output(rates=(1000, 10000, 100000, 200000), seconds=1.0):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(0.05)
+
+    print("Salida OSC por UDP (bundles cada {} ms):".format(
+        main.UI_QUEUE_INTERVAL))
+    with contextlib.redirect_stdout(io.StringIO()):
+        emisor.open_output(*receiver.getsockname())
+    try:
+        for rate in rates:
+            steps = []
+            timetags = []
+            stop_event = threading.Event()
+            thread = threading.Thread(target=receive_osc,
+                                      args=(receiver, steps, timetags,
+                                            stop_event))
+            thread.start()
+
+            # Como el bucle principal: los eventos de cada vuelta salen juntos al final
+            ticks = int(seconds * 1000 / main.UI_QUEUE_INTERVAL)
+            per_tick = rate * main.UI_QUEUE_INTERVAL // 1000
+            sent = 0
+            start = time.perf_counter()
+            for tick in range(ticks):
+                for _ in range(per_tick):
+                    emisor.lattice_event("step", sent, 60 + sent % 12)
+                    sent += 1
+                emisor.flush()
+                next_tick = start + (tick + 1) * main.UI_QUEUE_INTERVAL / 1000
+                time.sleep(max(0, next_tick - time.perf_counter()))
+            elapsed = time.perf_counter() - start
+            time.sleep(0.2)
+            stop_event.set()
+            thread.join()
+
+            # Sin pérdidas llegan todos los pasos en orden y los bundles en orden
+            in_order = steps == list(range(sent)) and timetags == sorted(
+                timetags)
+            print("  {} eventos/s pedidos, {:.0f} enviados: {} recibidos en"
+                  " {} bundles, {} perdidos{}".format(
+                      rate, sent / elapsed, len(steps), len(timetags),
+                      sent - len(steps), "" if in_order else ", desordenados"))
+    finally:
+        emisor.close_output()
+        receiver.close()
+
+
+if __name__ == "__main__":
+    benchmark_port_swap()
+    benchmark_note_conversion()
+    benchmark_output_storm()
+    benchmark_timer_lateness()
+    benchmark_clock_sync()
+    benchmark_realtime_jitter()
+    benchmark_engine_process()
+    benchmark_state_export()
+    benchmark_osc_output()
@@ -0,0 +1,203 @@
+import collections
+import socket
+import struct
+import time
+"""
+Emisor OSC de los eventos de la red por UDP (osc_output en config.yml), para
+luces, visuales u otros programas del mismo equipo. Cada evento se convierte
+en un mensaje OSC en el hilo donde ocurre y se deja en una cola; el bucle
+principal (la cola de Tk o el bucle del motor) llama a flush en cada vuelta
+y todo lo que ha llegado desde la anterior sale en un único bundle con el
+instante de esa vuelta, en un solo datagrama.
+
+Mensajes:
+- /tonnetz/note nota suena: una nota midi entra (1) o sale (0) de la selección
+- /tonnetz/triangle nota nota nota seleccionado: se selecciona o quita un triángulo
+- /tonnetz/chord nombre nombre nombre: se detecta un acorde en la entrada
+- /tonnetz/step paso nota: el arpegiador toca una nota
+"""
+
+OSC_HOST = "127.0.0.1"
+OSC_PORT = 9000
+MAX_DATAGRAM = 60000  # Bytes máximos de un bundle, por debajo del límite de UDP
+NTP_EPOCH = 2208988800  # Segundos entre 1900 (época de OSC) y 1970
+BUNDLE_HEADER = b"#bundle\0"
+
+# Socket de salida y mensajes pendientes del siguiente bundle
+emitter = {
+    "socket": None,  # Socket UDP, None si la salida OSC está apagada
+    "address": None,  # (host, puerto) de destino
+    "pending": collections.deque(),  # Mensajes ya codificados, se pueden añadir desde cualquier hilo
+    "messages": 0,  # Mensajes enviados
+    "bundles": 0,  # Datagramas enviados
+    "dropped": 0,  # Mensajes perdidos porque el socket no los aceptó
+}
+
+
+# Codificamos un texto OSC: terminado en cero y relleno hasta múltiplo de 4
+def osc_string(text):
+    data = text.encode() + b"\0"
+    return data + b"\0" * (-len(data) % 4)
+
+
+# Codificamos un mensaje OSC con argumentos enteros, decimales o textos
+def osc_message(address, *args):
+    tags = ","
+    data = b""
+    for arg in args:
+        if isinstance(arg, str):
+            tags += "s"
+            data += osc_string(arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            data += struct.pack(">f", arg)
+        else:
+            tags += "i"
+            data += struct.pack(">i", int(arg))
+    return osc_string(address) + osc_string(tags) + data
+
+
+# Pasamos un instante de time.time a la marca de tiempo NTP de OSC
+def osc_timetag(timestamp):
+    seconds = int(timestamp)
+    fraction = int((timestamp - seconds) * (1 << 32))
+    return struct.pack(">II", seconds + NTP_EPOCH, fraction)
+
+
+# Juntamos mensajes ya codificados en un bundle OSC
+def osc_bundle(timetag, messages):
+    return BUNDLE_HEADER + timetag + b"".join(
+        struct.pack(">i", len(message)) + message for message in messages)
+
+
+# Leemos un texto OSC y devolvemos también dónde acaba su relleno
+def parse_string(data, offset):
+    end = data.index(b"\0", offset)
+    return data[offset:end].decode(), end + 4 - (end - offset) % 4
+
+
+# Decodificamos un mensaje OSC en (dirección, argumentos)
+def parse_message(data):
+    address, offset = parse_string(data, 0)
+    tags, offset = parse_string(data, offset)
+    args = []
+    for tag in tags[1:]:
+        if tag == "s":
+            value, offset = parse_string(data, offset)
+        elif tag in ("i", "f"):
+            value = struct.unpack_from(">" + tag, data, offset)[0]
+            offset += 4
+        else:
+            raise ValueError("tipo OSC no soportado: " + tag)
+        args.append(value)
+    return address, args
+
+
+# Decodificamos un datagrama: devuelve (instante NTP en segundos o None, mensajes)
+def parse_packet(data):
+    """Sirve para probar la salida con un receptor local."""
+    if not data.startswith(BUNDLE_HEADER):
+        return None, [parse_message(data)]
+
+    seconds, fraction = struct.unpack_from(">II", data, 8)
+    messages = []
+    offset = 16
+    while offset < len(data):
+        size = struct.unpack_from(">i", data, offset)[0]
+        messages.append(parse_message(data[offset + 4:offset + 4 + size]))
+        offset += 4 + size
+    return seconds + fraction / (1 << 32), messages
+
+
+# Abrimos el socket UDP hacia el receptor
+def open_output(host=OSC_HOST, port=OSC_PORT):
+    global emitter
+
+    close_output()
+    try:
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # El bucle principal nunca espera a la red
+        udp_socket.setblocking(False)
+    except OSError as e:
+        print("Error al abrir la salida OSC:", e)
+        return False
+
+    emitter["pending"].clear()
+    emitter.update({"socket": udp_socket, "address": (host, int(port))})
+    print("Salida OSC a {}:{}".format(host, port))
+    return True
+
+
+# Cerramos el socket después de enviar lo pendiente
+def close_output():
+    global emitter
+
+    if emitter["socket"] is None:
+        return
+    flush()
+    emitter["socket"].close()
+    emitter["socket"] = None
+
+
+# Convertimos un aviso de main en un mensaje OSC para el siguiente bundle
+def lattice_event(kind, *values):
+    """Es una función de midi_state["listeners"], así que se ejecuta en los
+    hilos MIDI y el temporizador: solo codifica y deja el mensaje en la
+    cola."""
+    if emitter["socket"] is None:
+        return
+
+    if kind == "note":
+        note, on = values
+        message = osc_message("/tonnetz/note", note, on)
+    elif kind == "triangle":
+        notes, selected = values
+        message = osc_message("/tonnetz/triangle", *notes, selected)
+    elif kind == "chord":
+        message = osc_message("/tonnetz/chord", *values[0])
+    elif kind == "step":
+        message = osc_message("/tonnetz/step", *values)
+    else:
+        return
+    emitter["pending"].append(message)
+
+
+# Enviamos en un bundle todo lo que ha llegado desde la vuelta anterior del bucle
+def flush():
+    global emitter
+
+    pending = emitter["pending"]
+    if emitter["socket"] is None or not pending:
+        return
+
+    timetag = osc_timetag(time.time())
+    messages = []
+    size = len(BUNDLE_HEADER) + len(timetag)
+    # Solo sacamos lo que había al empezar, lo que llegue mientras va en el siguiente
+    for _ in range(len(pending)):
+        message = pending.popleft()
+        # Si no cabe en un datagrama lo partimos en varios bundles con el mismo instante
+        if messages and size + 4 + len(message) > MAX_DATAGRAM:
+            send_bundle(timetag, messages)
+            messages = []
+            size = len(BUNDLE_HEADER) + len(timetag)
+        messages.append(message)
+        size += 4 + len(message)
+    send_bundle(timetag, messages)
+
+
+# Enviamos un bundle, si el socket no lo acepta se pierde
+def send_bundle(timetag, messages):
+    global emitter
+
+    try:
+        emitter["socket"].sendto(osc_bundle(timetag, messages),
+                                 emitter["address"])
+        emitter["messages"] += len(messages)
+        emitter["bundles"] += 1
+    except BlockingIOError:
+        # El búfer del socket está lleno: el receptor no da abasto
+        emitter["dropped"] += len(messages)
+    except OSError as e:
+        emitter["dropped"] += len(messages)
+        print("Error al enviar OSC:", e)
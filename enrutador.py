@@ -0,0 +1,374 @@
+import collections
+import threading
+import time
+import tiempo_real
+"""
+Enrutador de la salida MIDI. Cada mensaje se copia a todos sus destinos
+(puerto y canal) y se deja en la cola del puerto, sin esperar. Cada puerto
+tiene su propio hilo que lo mantiene abierto y envía lo que llega a su cola,
+así un aparato lento no retrasa a los demás ni a los hilos que tocan las
+notas. Si un puerto deja de recibir mensajes durante un rato y no le queda
+ninguna nota sonando se cierra, y se vuelve a abrir con el siguiente mensaje
+cuando el hilo anterior ha terminado de cerrarlo. Si no se puede abrir, su
+hilo sigue ahí y lo vuelve a intentar cada vez más espaciado: mientras tanto
+los mensajes de ese puerto se descartan y el error solo se avisa una vez.
+
+Las colas tienen un tamaño máximo. Cuando una se llena se aplica su política:
+- drop_oldest: se descarta el mensaje más antiguo (para luces y efectos)
+- coalesce: el mensaje sustituye a otro igual que aún no se ha enviado
+  (misma nota o mismo control), y si no lo hay se descarta el nuevo
+- drop_new: se descarta el mensaje nuevo
+Los mensajes que sueltan notas (note_off, all notes off...) nunca se
+descartan, aunque la cola pase de su tamaño: es mejor perder una nota que
+dejar otra sonando para siempre. Solo se quitan cuando no sueltan nada: el
+note_off de una nota que no llegará a sonar porque su note_on se descartó, o
+uno repetido sin nada que vuelva a tocar la nota entre los dos.
+"""
+
+IDLE_TIMEOUT = 60.0  # Segundos sin mensajes ni notas sonando antes de cerrar un puerto
+RETRY_DELAY = 0.5  # Segundos antes de volver a intentar abrir un puerto que ha fallado
+RETRY_MAX_DELAY = 30.0  # El retraso se dobla en cada fallo hasta este máximo
+QUEUE_SIZE = 256  # Mensajes que caben por defecto en la cola de un puerto
+OVERFLOW_POLICIES = ("drop_oldest", "coalesce", "drop_new")
+RELEASE_CONTROLS = (64, 120, 123)  # Pedal, all sound off y all notes off
+
+# Hilos de salida abiertos, uno por puerto
+router = {
+    "workers": {},  # Nombre del puerto -> cola, hilo y política
+    "stats": {},  # Nombre del puerto -> contadores, se mantienen al cerrarlo
+    "closing": {},  # Nombre del puerto -> hilo quitado que aún puede estar cerrándolo
+    "lock": threading.Lock(),  # Protege las colas entre los hilos que envían
+}
+
+
+# Indicamos si un mensaje suelta notas y por tanto no se puede descartar
+def is_release(message):
+    if message.type == "note_off":
+        return True
+    if message.type == "note_on":
+        return message.velocity == 0
+    if message.type == "control_change" and message.control in RELEASE_CONTROLS:
+        # El pedal solo suelta notas al levantarlo
+        return message.control != 64 or message.value < 64
+    return False
+
+
+# Clave de los mensajes que se pueden juntar, o None si no se pueden juntar
+def coalesce_key(message):
+    if message.type == "note_on" and message.velocity > 0:
+        return ("note", message.channel, message.note)
+    if message.type == "control_change":
+        return ("control", message.channel, message.control)
+    if message.type in ("pitchwheel", "aftertouch"):
+        return (message.type, message.channel)
+    return None
+
+
+# Clave de un control que suelta notas, para reconocer los repetidos
+def release_key(message):
+    return ("control", message.channel, message.control)
+
+
+# Indicamos si un mensaje de la cola vuelve a tocar lo que suelta release
+def retriggers(queued, release):
+    if queued.type == "note_on" and queued.velocity > 0:
+        return queued.channel == release.channel and (
+            release.type == "control_change" or queued.note == release.note)
+    # Pisar el pedal después de levantarlo
+    return (queued.type == "control_change"
+            and release.type == "control_change"
+            and queued.channel == release.channel
+            and queued.control == release.control)
+
+
+# Indicamos si una nota sonará después de los mensajes de la cola anteriores a end
+def note_sounding(worker, channel, note, end):
+    messages = worker["messages"]
+    for index in range(end - 1, -1, -1):
+        queued = messages[index][1]
+        if queued is None or not queued.type.startswith("note_"):
+            continue
+        if queued.channel == channel and queued.note == note:
+            return not is_release(queued)
+    # Si la cola no dice nada es lo que ya se ha enviado al puerto
+    return (channel, note) in worker["sounding"]
+
+
+# Indicamos si un mensaje que suelta notas no tiene nada que soltar
+def useless_release(worker, message):
+    messages = worker["messages"]
+    if message.type != "control_change":
+        return not note_sounding(worker, message.channel, message.note,
+                                 len(messages))
+
+    # Con los controles solo quitamos los repetidos sin nada que vuelva a tocar entre los dos
+    key = release_key(message)
+    for index in range(len(messages) - 1, -1, -1):
+        queued = messages[index][1]
+        if queued is None:
+            return False
+        if is_release(queued) and release_key(queued) == key:
+            return True
+        if retriggers(queued, message):
+            return False
+    return False
+
+
+# Sustituimos un mensaje igual de la cola, si lo hay y no hay un note_off detrás
+def coalesce(messages, message):
+    key = coalesce_key(message)
+    if key is None:
+        return False
+
+    # Buscamos desde el final, si antes encontramos el note_off de la nota no se puede juntar
+    for index in range(len(messages) - 1, -1, -1):
+        queued = messages[index][1]
+        if queued is None:
+            return False
+        if coalesce_key(queued) == key:
+            messages[index] = (messages[index][0], message)
+            return True
+        if key[0] == "note" and is_release(queued) and getattr(
+                queued, "note", None) == key[2]:
+            return False
+
+    return False
+
+
+# Quitamos el mensaje más antiguo que se pueda descartar
+def drop_oldest(worker):
+    messages = worker["messages"]
+    for index, (_, queued) in enumerate(messages):
+        if queued is not None and not is_release(queued):
+            del messages[index]
+            if queued.type == "note_on":
+                drop_note_off(worker, queued, index)
+            return True
+    return False
+
+
+# Quitamos el note_off de un note_on descartado si la nota no estaba ya sonando
+def drop_note_off(worker, note_on, start):
+    messages = worker["messages"]
+    if note_sounding(worker, note_on.channel, note_on.note, start):
+        return
+
+    for index in range(start, len(messages)):
+        queued = messages[index][1]
+        if queued is None or not queued.type.startswith("note_"):
+            continue
+        if queued.channel == note_on.channel and queued.note == note_on.note:
+            if is_release(queued):
+                del messages[index]
+            return
+
+
+# Dejamos un mensaje en la cola de un puerto aplicando su política (con el cerrojo cogido)
+def enqueue(worker, message, enqueued_time):
+    messages = worker["messages"]
+    stats = worker["stats"]
+
+    # Si el puerto no se ha podido abrir no hay dónde enviar hasta el siguiente intento
+    if worker["retry_time"] is not None and enqueued_time < worker["retry_time"]:
+        stats["dropped"] += 1
+        return
+
+    if len(messages) >= worker["size"] and is_release(message):
+        if useless_release(worker, message):
+            stats["coalesced"] += 1
+            return
+    elif len(messages) >= worker["size"]:
+        if worker["overflow"] == "coalesce" and coalesce(messages, message):
+            stats["coalesced"] += 1
+            return
+        if worker["overflow"] != "drop_oldest" or not drop_oldest(worker):
+            stats["dropped"] += 1
+            return
+        stats["dropped"] += 1
+
+    messages.append((enqueued_time, message))
+    stats["max_depth"] = max(stats["max_depth"], len(messages))
+    worker["ready"].notify()
+
+
+# Enviamos un mensaje a una lista de destinos sin bloquear
+def send(message, destinations):
+    """destinations es una lista de (puerto, canal, tamaño de la cola,
+    política). El tamaño y la política se fijan al abrir el puerto."""
+    enqueued_time = time.perf_counter()
+
+    with router["lock"]:
+        for port_name, channel, size, overflow in destinations:
+            # Los mensajes de canal se copian al canal de cada destino
+            if hasattr(message, "channel"):
+                routed = message.copy(channel=channel)
+            else:
+                routed = message
+            enqueue(port_worker(port_name, size, overflow), routed,
+                    enqueued_time)
+
+
+# Obtenemos el hilo de un puerto, creándolo si aún no existe (con el cerrojo cogido)
+def port_worker(port_name, size=QUEUE_SIZE, overflow="coalesce"):
+    global router
+
+    worker = router["workers"].get(port_name)
+    if worker is None:
+        if overflow not in OVERFLOW_POLICIES:
+            print("Política de cola no válida:", overflow)
+            overflow = "coalesce"
+
+        stats = router["stats"].setdefault(port_name, {
+            "sent": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "max_depth": 0,
+            "max_wait": 0.0,
+        })
+        worker = {
+            "messages": collections.deque(),
+            "ready": threading.Condition(router["lock"]),
+            "size": max(1, int(size)),
+            "overflow": overflow,
+            "stats": stats,
+            "sounding": set(),  # Notas (canal, nota) que ya se han enviado y suenan
+            "retry_time": None,  # Si el puerto ha fallado, instante del siguiente intento
+        }
+        # El hilo nuevo no abre el puerto hasta que el anterior lo ha cerrado
+        worker["thread"] = threading.Thread(
+            target=output_loop,
+            args=(port_name, worker, router["closing"].pop(port_name, None)),
+            daemon=True)
+        router["workers"][port_name] = worker
+        worker["thread"].start()
+
+    return worker
+
+
+# Apuntamos qué notas quedan sonando en el puerto al enviar un mensaje
+def update_sounding(sounding, message):
+    if message.type == "note_on" and message.velocity > 0:
+        sounding.add((message.channel, message.note))
+    elif message.type.startswith("note_"):
+        sounding.discard((message.channel, message.note))
+    elif message.type == "control_change" and message.control in (120, 123):
+        for key in [key for key in sounding if key[0] == message.channel]:
+            sounding.discard(key)
+
+
+# Quitamos el hilo de un puerto (con el cerrojo cogido)
+def remove_worker(port_name, worker):
+    global router
+
+    if router["workers"].get(port_name) is worker:
+        del router["workers"][port_name]
+        router["closing"][port_name] = worker["thread"]
+
+
+# Bucle del hilo de un puerto de salida
+def output_loop(port_name, worker, previous=None):
+    import mido
+
+    # Dos hilos con el mismo puerto abierto a la vez pueden hacer fallar al segundo
+    if previous is not None:
+        previous.join()
+    tiempo_real.apply_to_thread("salida", port_name)
+    delay = RETRY_DELAY
+    while True:
+        try:
+            with mido.open_output(port_name) as port:
+                port_opened(port_name, worker)
+                delay = RETRY_DELAY
+                send_loop(port_name, worker, port)
+                return
+        except OSError as e:
+            if not wait_retry(port_name, worker, e, delay):
+                return
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+
+
+# Apuntamos que el puerto se ha abierto, avisando si antes había fallado
+def port_opened(port_name, worker):
+    with router["lock"]:
+        if worker["retry_time"] is not None:
+            print("Puerto MIDI disponible de nuevo:", port_name)
+        worker["retry_time"] = None
+
+
+# Enviamos al puerto lo que llega a su cola hasta que se cierra o deja de recibir
+def send_loop(port_name, worker, port):
+    messages = worker["messages"]
+    stats = worker["stats"]
+    while True:
+        with router["lock"]:
+            while not messages:
+                # Solo cerramos si no ha llegado nada mientras tanto y no
+                # queda ninguna nota sonando, así su note_off sale por el
+                # mismo puerto y sabiendo que la nota suena
+                if (not worker["ready"].wait(IDLE_TIMEOUT) and not messages
+                        and not worker["sounding"]):
+                    remove_worker(port_name, worker)
+                    return
+            enqueued_time, message = messages.popleft()
+
+            # None es la señal de cerrar el puerto
+            if message is None:
+                remove_worker(port_name, worker)
+                return
+            update_sounding(worker["sounding"], message)
+
+        port.send(message)
+        stats["sent"] += 1
+        stats["max_wait"] = max(stats["max_wait"],
+                                time.perf_counter() - enqueued_time)
+
+
+# Descartamos lo pendiente de un puerto que ha fallado y esperamos al siguiente intento
+def wait_retry(port_name, worker, error, delay):
+    messages = worker["messages"]
+    with router["lock"]:
+        # Solo avisamos del primer fallo, no de cada intento
+        if worker["retry_time"] is None:
+            print("Error al abrir el puerto MIDI:", error)
+
+        closing = any(message is None for _, message in messages)
+        worker["stats"]["dropped"] += len(messages) - closing
+        messages.clear()
+        worker["sounding"].clear()
+        # Hasta retry_time los mensajes se descartan al llegar, el primero que
+        # llegue después despierta al hilo para volver a intentarlo
+        worker["retry_time"] = time.perf_counter() + delay
+        while not closing and not messages:
+            worker["ready"].wait()
+            closing = any(message is None for _, message in messages)
+
+        if closing:
+            remove_worker(port_name, worker)
+            return False
+    return True
+
+
+# Contadores de cada puerto: enviados, descartados, juntados, cola actual y máxima, espera máxima
+def router_stats():
+    with router["lock"]:
+        stats = {}
+        for port_name, port_stats in router["stats"].items():
+            worker = router["workers"].get(port_name)
+            stats[port_name] = dict(port_stats,
+                                    depth=len(worker["messages"])
+                                    if worker is not None else 0)
+        return stats
+
+
+# Cerramos todos los puertos después de enviar lo que tengan pendiente
+def stop_router(timeout=1.0):
+    global router
+
+    with router["lock"]:
+        workers = list(router["workers"].values())
+        for worker in workers:
+            worker["messages"].append((time.perf_counter(), None))
+            worker["ready"].notify()
+
+    for worker in workers:
+        worker["thread"].join(timeout)
@@ -0,0 +1,187 @@
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+"""
+Estado de la red para visualizadores externos (state_export en config.yml).
+En cada cambio se escribe en un fichero proyectado en memoria (mmap), por
+defecto en /dev/shm, así que otro proceso del mismo equipo puede leerlo con
+su propio mmap a 60-240 Hz sin preguntar nada al programa.
+
+Formato (little endian, 112 bytes, cabecera HEADER y datos STATE):
+- 0   magic "TNZ1" y versión (uint32)
+- 8   secuencia (uint64), impar mientras se está escribiendo
+- 16  instante del último cambio (double, CLOCK_MONOTONIC como perf_counter)
+- 24  clases de altura activas (uint16, el bit n es la nota n, 0 = do)
+- 26  número de triángulos seleccionados (uint16)
+- 28  último paso del arpegiador (uint32), 32 su instante (double)
+- 40  nota midi de ese paso (uint8, 0 si aún no ha sonado)
+- 48  triángulos seleccionados, cada uno con las clases de altura de su
+  acorde como la máscara de arriba (32 uint16)
+
+Se protege con un seqlock: quien escribe sube la secuencia a impar, escribe
+y la sube a par. Quien lee copia la secuencia, los datos y otra vez la
+secuencia, y si es impar o ha cambiado vuelve a leer (ver read_state). La
+secuencia está alineada y se lee y escribe de una vez como uint64 del
+procesador (little endian en x86 y ARM): struct la escribiría byte a byte,
+y después de ponerla a cero.
+"""
+
+HEADER = struct.Struct("<4sIQ")  # Magic, versión y secuencia
+STATE = struct.Struct("<dHHIdB7x32H")  # Datos, detrás de la cabecera
+MAGIC = b"TNZ1"
+VERSION = 1
+SEQUENCE = 8  # Posición de la secuencia en el fichero
+SIZE = HEADER.size + STATE.size
+MAX_TRIANGLES = 32  # Triángulos que caben en el fichero
+STATE_PATH = os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+    "tonnetz-estado")
+
+# Estado que se publica y fichero donde se escribe
+export = {
+    "memory": None,  # mmap del fichero
+    "sequence": None,  # Vista de la secuencia como uint64 dentro del mmap
+    "pitch_counts": [0] * 12,  # Notas activas de cada clase de altura
+    "chords": {},  # Máscara de un acorde -> triángulos seleccionados con él
+    "step": (0, 0.0, 0),  # Número, instante y nota del último paso del arpegiador
+    "lock": threading.Lock(),  # Solo escribe un hilo a la vez
+}
+
+
+# Máscara con las clases de altura de unas notas midi
+def pitch_mask(midi_notes):
+    mask = 0
+    for note in midi_notes:
+        mask |= 1 << note % 12
+    return mask
+
+
+# Creamos el fichero del estado y lo proyectamos en memoria
+def open_export(path=None):
+    global export
+
+    path = path or STATE_PATH
+    close_export()
+    # Sin vaciar el fichero, así un visualizador que ya lo tenga abierto no se queda sin datos
+    try:
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(descriptor, SIZE)
+            memory = mmap.mmap(descriptor, SIZE)
+        finally:
+            os.close(descriptor)
+    except OSError as e:
+        print("Error al crear el fichero del estado:", e)
+        return False
+
+    with export["lock"]:
+        export.update({
+            "memory": memory,
+            "sequence": memoryview(memory)[SEQUENCE:SEQUENCE + 8].cast("Q"),
+            "pitch_counts": [0] * 12,
+            "chords": {},
+            "step": (0, 0.0, 0),
+        })
+        memory[:4] = MAGIC
+        struct.pack_into("<I", memory, 4, VERSION)
+        write_state()
+    print("Estado de la red en:", path)
+    return True
+
+
+# Cerramos el fichero, el último estado se queda escrito para quien lo lea
+def close_export():
+    global export
+
+    with export["lock"]:
+        if export["memory"] is not None:
+            # El mmap no se puede cerrar mientras haya vistas sobre él
+            export["sequence"].release()
+            export["memory"].close()
+        export["memory"] = None
+        export["sequence"] = None
+
+
+# Recibimos un aviso de main y publicamos el estado nuevo
+# Es una función de midi_state["listeners"]: ("note", nota, suena) cuando una
+# nota entra o sale de la selección, ("triangle", notas, seleccionado) cuando
+# se selecciona o quita un triángulo y ("step", paso, nota) cuando el
+# arpegiador toca una nota.
+def lattice_event(kind, *values):
+    global export
+    with export["lock"]:
+        if export["memory"] is None:
+            return
+        if kind == "note":
+            note, on = values
+            export["pitch_counts"][note % 12] += 1 if on else -1
+        elif kind == "triangle":
+            notes, selected = values
+            mask = pitch_mask(notes)
+            count = export["chords"].get(mask, 0) + (1 if selected else -1)
+            if count > 0:
+                export["chords"][mask] = count
+            else:
+                export["chords"].pop(mask, None)
+        elif kind == "step":
+            step, note = values
+            export["step"] = (step, time.perf_counter(), note)
+        else:
+            return
+        write_state()
+
+
+# Escribimos el estado en el fichero con el seqlock (con el cerrojo cogido)
+def write_state():
+    memory = export["memory"]
+    sequence = export["sequence"][0]
+    # Por si otro proceso dejó el fichero a medias, siempre empezamos en impar
+    sequence += 1 if sequence % 2 == 0 else 2
+    export["sequence"][0] = sequence
+
+    pitch_classes = 0
+    for pitch_class, count in enumerate(export["pitch_counts"]):
+        if count > 0:
+            pitch_classes |= 1 << pitch_class
+    triangles = sorted(export["chords"])[:MAX_TRIANGLES]
+    step, step_time, step_note = export["step"]
+    # La secuencia va aparte: pack_into pone a cero su zona antes de escribir
+    STATE.pack_into(memory, HEADER.size, time.perf_counter(), pitch_classes,
+                    len(triangles), step, step_time, step_note,
+                    *(triangles + [0] * (MAX_TRIANGLES - len(triangles))))
+
+    export["sequence"][0] = sequence + 1
+
+
+# Leemos el estado de un mmap como lo haría un visualizador
+def read_state(memory, retries=1000):
+    """Devuelve un diccionario con el estado, o None si no se ha podido
+    leer una copia entera en retries intentos."""
+    with memoryview(memory) as view:
+        if view[:4] != MAGIC:
+            return None
+        with view[SEQUENCE:SEQUENCE + 8].cast("Q") as sequence_view:
+            for _ in range(retries):
+                sequence = sequence_view[0]
+                if sequence % 2:
+                    # Dejamos la CPU a quien escribe, que puede estar esperándola
+                    time.sleep(0)
+                    continue
+                values = STATE.unpack_from(view, HEADER.size)
+                if sequence_view[0] == sequence:
+                    break
+            else:
+                return None
+
+    return {
+        "sequence": sequence,
+        "time": values[0],
+        "pitch_classes": values[1],
+        "triangles": list(values[6:6 + values[2]]),
+        "step": values[3],
+        "step_time": values[4],
+        "step_note": values[5],
+    }
@@ -0,0 +1,166 @@
+import collections
+import os
+import struct
+import threading
+import time
+"""
+Grabador de sesiones MIDI. Los hilos MIDI solo añaden cada mensaje con su
+instante a un búfer circular (collections.deque con maxlen, que se puede usar
+desde varios hilos sin cerrojos), y un hilo aparte lo vacía cada poco en un
+fichero .mid por cada origen (entrada y salida). Los ficheros se escriben a
+medida que llegan los mensajes, así que la memoria no crece aunque la sesión
+dure horas.
+"""
+
+RING_SIZE = 1 << 16  # Mensajes que caben en el búfer antes de perder los más antiguos
+FLUSH_INTERVAL = 0.5  # Segundos entre escrituras al fichero
+TICKS_PER_BEAT = 960  # Resolución del fichero MIDI
+TEMPO = 500000  # Microsegundos por negra (120 bpm)
+TICKS_PER_SECOND = TICKS_PER_BEAT * 1000000 / TEMPO
+RECORDINGS_PATH = "grabaciones"  # Carpeta donde se guardan las grabaciones
+
+# Estado de la grabación en curso
+recorder = {
+    "active": False,  # Indica si se están guardando los mensajes
+    "events": None,  # Búfer con (instante, origen, mensaje)
+    "start_time": None,  # Instante en el que empezó la grabación
+    "thread": None,  # Hilo que escribe los ficheros
+    "stop_event": None,  # Evento para terminar la grabación
+    "name": None,  # Ruta de los ficheros sin el origen ni la extensión
+}
+
+
+# Guardamos un mensaje MIDI, es lo único que se hace en los hilos MIDI
+def record(source, message):
+    if recorder["active"]:
+        recorder["events"].append((time.perf_counter(), source, message))
+
+
+# Codificamos un número como cantidad de longitud variable de MIDI
+def encode_varlen(value):
+    data = [value & 0x7F]
+    value >>= 7
+    while value:
+        data.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(data))
+
+
+# Abrimos un fichero MIDI de una pista, con la longitud de la pista por rellenar
+def open_track(path):
+    track_file = open(path, "wb")
+    track_file.write(b"MThd" + struct.pack(">IHHH", 6, 0, 1, TICKS_PER_BEAT))
+    track_file.write(b"MTrk" + struct.pack(">I", 0))
+
+    # Lo primero de la pista es el tempo, para que los ticks sean segundos reales
+    tempo_event = b"\x00\xff\x51\x03" + TEMPO.to_bytes(3, "big")
+    track_file.write(tempo_event)
+
+    return {"file": track_file, "last_tick": 0, "length": len(tempo_event)}
+
+
+# Escribimos la longitud de la pista, así el fichero es válido aunque se corte
+def update_track_length(track):
+    track["file"].seek(18)
+    track["file"].write(struct.pack(">I", track["length"]))
+    track["file"].seek(0, os.SEEK_END)
+    track["file"].flush()
+
+
+# Cerramos la pista con su evento de fin
+def close_track(track):
+    end_of_track = b"\x00\xff\x2f\x00"
+    track["file"].write(end_of_track)
+    track["length"] += len(end_of_track)
+    update_track_length(track)
+    track["file"].close()
+
+
+# Vaciamos el búfer en los ficheros de cada origen
+def flush_events(events, start_time, name, tracks):
+    while True:
+        try:
+            timestamp, source, message = events.popleft()
+        except IndexError:
+            break
+
+        data = bytes(message.bytes())
+        # Los mensajes de sistema (reloj, sysex...) no se guardan así en un fichero MIDI
+        if not data or data[0] >= 0xF0:
+            continue
+
+        if source not in tracks:
+            tracks[source] = open_track("{}-{}.mid".format(name, source))
+        track = tracks[source]
+
+        tick = max(track["last_tick"],
+                   round((timestamp - start_time) * TICKS_PER_SECOND))
+        event = encode_varlen(tick - track["last_tick"]) + data
+        track["file"].write(event)
+        track["last_tick"] = tick
+        track["length"] += len(event)
+
+    for track in tracks.values():
+        update_track_length(track)
+
+
+# Bucle del hilo que escribe la grabación
+def writer_loop(events, start_time, name, stop_event):
+    tracks = {}
+    try:
+        while not stop_event.wait(FLUSH_INTERVAL):
+            flush_events(events, start_time, name, tracks)
+        flush_events(events, start_time, name, tracks)
+    except OSError as e:
+        print("Error al guardar la grabación:", e)
+    finally:
+        for track in tracks.values():
+            close_track(track)
+
+
+# Empezamos a grabar la sesión
+def start_recording(directory=RECORDINGS_PATH):
+    global recorder
+
+    if recorder["active"]:
+        return recorder["name"]
+
+    os.makedirs(directory, exist_ok=True)
+    name = os.path.join(directory, time.strftime("sesion-%Y%m%d-%H%M%S"))
+
+    # Cada grabación tiene su propio búfer, por si la anterior aún se está cerrando
+    events = collections.deque(maxlen=RING_SIZE)
+    start_time = time.perf_counter()
+    stop_event = threading.Event()
+
+    writer_thread = threading.Thread(target=writer_loop,
+                                     args=(events, start_time, name,
+                                           stop_event),
+                                     daemon=True)
+    writer_thread.start()
+
+    recorder.update({
+        "events": events,
+        "start_time": start_time,
+        "thread": writer_thread,
+        "stop_event": stop_event,
+        "name": name,
+        "active": True,
+    })
+    print("Grabando sesión en:", name)
+
+    return name
+
+
+# Terminamos la grabación, si wait es True esperamos a que se cierren los ficheros
+def stop_recording(wait=False):
+    global recorder
+
+    if not recorder["active"]:
+        return
+
+    recorder["active"] = False
+    recorder["stop_event"].set()
+    if wait:
+        recorder["thread"].join()
+    print("Grabación terminada:", recorder["name"])
@@ -1,17 +1,30 @@
 #!/usr/bin/env python3
 
-import math
-import mido
 import threading
 from tkinter import *
 from tkinter import ttk
 import tkinter as tk
 import time
-import importlib
-import yaml
+import types
+import importlib.util
 import os
+import queue
+import anillo
 import arpegiador
+import emisor
+import enrutador
+import exportador
 import functools
+import grabador
+import motor
+import reloj
+import reproductor
+import temporizador
+import tiempo_real
+import tonnetz
+
+# Instante en el que arranca el programa, para medir el tiempo de arranque
+START_TIME = time.perf_counter()
 """
 Para que el programa funcione hay que instalar las librería mido y tkinter 
 'pip install mido'
@@ -20,16 +33,31 @@ Para que el programa funcione hay que instalar las librería mido y tkinter
 Además para algunas funciones de mido se necesita instalar en el terminal
 'pip install python-rtmidi'
 esto es para las funciones mido.get_input_names() y mido.open_input()
+El análisis de ficheros (analisis.py) necesita también NumPy
+'pip install numpy'
+mido y yaml se importan dentro de las funciones que los usan para que la
+ventana aparezca antes de cargarlos
 """
 
-ROWS = 5  # Número de filas en la matriz de triángulos
-COLUMNS = 14  # Número de columnas en la matriz de triángulos
 R_CIRCLE = 20  # Radio del círculo
 C_MIDI = 60  # Nota MIDI inicial
 MAX_CHORD_INTERVAL = 0.5  # Intervalo de tiempo entre notas para detectar un acorde
+MIN_CHORD_INTERVAL = 0.03  # Intervalo mínimo al que se puede adaptar la ventana de acorde
 TRIANGLE = 115  # Lado del triángulo
 CONFIG_PATH = "config.yml"  # Ruta del archivo de configuración
 DURATION = 1500  # Duración de un acorde tras mover las flechas
+CLOCK_DRIFT = 0.0001  # Deriva máxima por segundo entre el reloj de rtmidi y perf_counter
+MIDI_IN_WAIT = 0.05  # Segundos máximos de espera de mensajes antes de mirar si hay que parar
+UI_QUEUE_INTERVAL = 10  # Cada cuántos ms se atiende la cola del hilo principal
+FIRST_PAINT_TARGET = 300  # Tiempo máximo deseado hasta ver la ventana (ms)
+CONFIG_SAVE_DELAY = 0.5  # Segundos sin cambios antes de guardar la configuración
+CONFIG_MAX_DELAY = 2.0  # Segundos máximos que puede retrasarse el guardado
+VIEW_MARGIN = 1  # Celdas que se dibujan fuera de la pantalla al desplazarse
+MIN_ZOOM = 0.25  # Zoom mínimo del diagrama
+MAX_ZOOM = 4.0  # Zoom máximo del diagrama
+KEY_MOVES = {"Left": (0, -1), "Right": (0, 1), "Up": (-1, 0), "Down": (1, 0)}  # Celda vecina de cada flecha
+ENGINE_FLAGS = ("arpeggiator_mode", "arpeggiator_active", "hold_on")  # Estado de la ventana que necesita el motor
+ENGINE_EXIT_WAIT = 5.0  # Segundos que se espera a que el motor suelte las notas al salir
 
 # Diccionario de configuración inicial
 config = {
@@ -37,26 +65,65 @@ config = {
     "port_in": "no-midi",
     "port_out": "no-midi",
     "dark_mode": False,
+    "start_note": "Bb",  # Nota del primer vértice del diagrama
+    "fifth_axis": 7,  # Semitonos del eje horizontal (quintas)
+    "third_axis": 3,  # Semitonos del eje diagonal (terceras menores)
+    "port_scan_interval": 2.0,  # Segundos entre búsquedas de puertos MIDI
+    "extra_ports_in": [],  # Otros puertos MIDI in que se abren junto a port_in
+    "separate_sources": False,  # Detectar los acordes de cada puerto por separado
+    "destinations": [],  # Puertos y canales a los que se envían los acordes y el arpegiador
+    "output_queue_size": 256,  # Mensajes que caben en la cola de cada puerto de salida
+    "output_overflow": "coalesce",  # Qué hacer cuando se llena: drop_oldest, coalesce o drop_new
+    "adaptive_chord_window": True,  # Adaptar la ventana de acorde a cómo se toca en cada origen
+    "clock_mode": "internal",  # Reloj del arpegiador: internal, external o master
+    "arpeggiator_gate": 0.8,  # Parte del paso que suena cada nota del arpegiador
+    "arpeggiator_swing": 0.0,  # Parte del paso que se retrasan los pasos impares
+    "arpeggiator_ties": [],  # Pasos (1 o 0, se repiten) cuya nota se liga con la siguiente
+    "arpeggiator_seed": None,  # Semilla del modo random, con un número el arpegio se repite igual
+    "arpeggiator_euclid": [3, 8],  # Notas y pasos del ritmo euclídeo
+    "arpeggiator_pattern": [1, 2, 3, 2],  # Pasos del modo user: grado, 0 silencio o lista de grados
+    "arpeggiator_strum": 0.015,  # Segundos entre las notas de un rasgueo
+    "realtime_policy": "none",  # Planificación de los hilos MIDI en Linux: none, fifo o rr
+    "realtime_priority": 20,  # Prioridad de fifo o rr, de 1 a 99
+    "realtime_threads": ["midi_in", "temporizador", "salida"],  # Hilos con tiempo real
+    "cpu_affinity": [],  # Núcleos para esos hilos, vacío para todos
+    "lock_memory": False,  # Bloquear la memoria para que no vaya a swap
+    "engine_process": False,  # Ejecutar el MIDI y el arpegiador en otro proceso
+    "state_export": False,  # Publicar el estado de la red para visualizadores externos
+    "state_export_path": None,  # Fichero del estado, sin ruta /dev/shm/tonnetz-estado
+    "osc_output": False,  # Enviar los eventos de la red por OSC
+    "osc_host": "127.0.0.1",  # Equipo y puerto UDP que reciben los mensajes OSC
+    "osc_port": 9000,
 }
 
 # Configuración global del programa
 global_config = {
-    "arpeggiator_mode": "up",  # Modo del arpegiador (up, down, random)
+    "arpeggiator_mode": "up",  # Modo del arpegiador, uno de arpegiador.ARPEGGIO_MODES
+    "arpeggiator_mode_var": None,  # Variable del desplegable de modos, para que siga a los botones
     "arpeggiator_active": False,  # Estado del arpegiador, si está activo o no
     "last_velocity": 64,  # La velocidad (intensidad) de la última nota tocada
     "moving_triangle": False,  # Indica si el triángulo está en movimiento
     "hold_on": False,  # Indica si se debe mantener la última nota o no
     "dark_mode": False,  # Configuración del modo oscuro
     "screen_window": None,  # Referencia a la ventana de la pantalla
+    "port_in_menu": None,  # Desplegable de puertos de entrada abierto
+    "port_out_menu": None,  # Desplegable de puertos de salida abierto
+    "player_window": None,  # Ventana con los controles de reproducción
+    "stats_window": None,  # Ventana con el estado de las colas de salida
 }
 
 # Estado actual del MIDI, que almacena las notas activas y otras configuraciones
 midi_state = {
-    "active_notes": {},  # Diccionario de notas actualmente activas
-    "selected_shapes": {},  # Formas seleccionadas para representar visualmente
+    "active_notes": [],  # Notas midi que están sonando
+    "selected_shapes": {},  # ("triangle", celda) o ("circle", vértice) -> tipo de las formas seleccionadas
+    "shape_notes": {},  # Notas midi de cada forma seleccionada
+    "note_counts": {},  # Nota midi -> cuántas formas seleccionadas la tienen
+    "selection_changes": queue.Queue(),  # (nota, suena) cada vez que una nota entra o sale de la unión
+    "selection_lock": threading.Lock(),  # Protege la selección entre la ventana y los hilos MIDI
     "note_times": {},  # Tiempos asociados con las notas activas
     "circle_ids": {},  # IDs de los círculos
     "last_chord": {},  # El último acorde tocado
+    "listeners": [],  # Funciones que reciben los avisos de notify_listeners
 }
 
 # Control de los hilos (threads) en ejecución y eventos relacionados
@@ -69,60 +136,45 @@ threads_control = {
     "arpeggiator_stop_event": None,  # Evento para detener el arpegiador
     "nav_thread": None,  # Hilo para la navegación por flechas
     "nav_stop_event": None,  # Evento para detener la navegación
+    "ports_thread": None,  # Hilo que vigila los puertos MIDI disponibles
+    "ports_stop_event": None,  # Evento para detener la vigilancia de puertos
+    "midi_in_args": None,  # Argumentos con los que se abrió el puerto MIDI in
+    "midi_out_args": None,  # Argumentos con los que se abrió el puerto MIDI out
+    "ui_queue": queue.Queue(),  # Funciones que otros hilos mandan ejecutar en Tk
+    "config_thread": None,  # Hilo que guarda la configuración
+    "config_save_event": threading.Event(),  # Indica que hay cambios sin guardar
+    "config_lock": threading.Lock(),  # Evita escribir el fichero dos veces a la vez
+    "config_saved": None,  # Última configuración escrita en el fichero
 }
 
+# Motor MIDI en otro proceso, visto desde la ventana
+engine_state = {
+    "process": None,  # Proceso del motor si está en marcha
+    "connection": None,  # Extremo de la ventana del canal de control
+    "ring": None,  # Anillo por el que llegan los colores que pinta el motor
+    "window": None,  # Ventana y canvas donde se pintan
+    "canvas": None,
+    "triangles": {},  # id virtual del motor -> notas del triángulo
+    "fills": {},  # ("triangle", acorde) o ("circle", nota) -> color que le ha dado el motor
+    "synced": {},  # Últimos config, global_config y parámetros enviados al motor
+    "recording": False,  # Indica si el motor está grabando
+}
+
+# Tempo, compás y octava del arpegiador, copiados de la ventana en su hilo para que los lean los demás
+arpeggiator_params = {
+    "variables": None,  # Variables de Tk de tempo, compás y octava
+    "values": {  # Últimos valores válidos, se sustituye entero al cambiar
+        "tempo": 120,
+        "compas": "4/4",
+        "octave": 1,
+    },
+}
+
+# Tiempos de cada etapa del arranque en milisegundos
+startup_times = {}
+
 # Estructuras de datos relacionadas con las notas y su orden
 data_structures = {
-    "notes_in_order": [
-        "Bb",
-        "Db",
-        "Gb",
-        "F",
-        "Ab",
-        "C",
-        "Eb",
-        "G",
-        "Bb",
-        "D",
-        "F",
-        "A",
-        "C",
-        "E",
-        "G",
-        "B",
-        "A",
-        "E",
-        "B",
-        "Gb",
-        "Db",
-        "Ab",
-        "Eb",
-        "Bb",
-        "C",
-        "F",
-        "G",
-        "D",
-        "A",
-        "E",
-        "B",
-        "Gb",
-        "Ab",
-        "Eb",
-        "Bb",
-        "F",
-        "C",
-        "G",
-        "D",
-        "A",
-        "B",
-        "E",
-        "Gb",
-        "Db",
-        "Ab",
-        "Eb",
-        "Bb",
-        "F",
-    ],  # Lista de notas en el orden en que deben aparecer en el diagrama
     "dict_notes": {
         "C": 60,
         "Db": 61,
@@ -139,13 +191,32 @@ data_structures = {
     }  # Diccionario que asigna las notas a sus valores MIDI correspondientes
 }
 
+# Estado de la vista del diagrama, solo se dibujan las figuras que se ven en pantalla
+lattice_view = {
+    "origin_x": 100,  # Posición en pantalla del vértice (0, 0)
+    "origin_y": 200,
+    "size_factor": 1.0,  # Factor de tamaño elegido en la configuración
+    "zoom": 1.0,  # Zoom aplicado con la rueda del ratón
+    "tuning": {},  # Nota inicial y semitonos de cada eje de la red
+    "chord_table": {},  # Notas de cada triángulo de la red -> una celda donde aparece
+    "grid": None,  # Clases de altura de los vértices visibles y su primera fila y columna
+    "visible_range": None,  # Filas y columnas de triángulos dibujadas
+    "triangle_ids": {},  # Triángulos dibujados con sus coordenadas y notas
+    "cells": {},  # Celda (fila, columna) -> id del triángulo dibujado
+    "vertices": {},  # Vértice (fila, columna) -> id del círculo dibujado
+    "texts": {},  # id del texto -> id del círculo al que pertenece
+    "free_triangles": [],  # Triángulos ocultos que se pueden reutilizar
+    "free_circles": [],  # Círculos y textos ocultos que se pueden reutilizar
+    "rectangle": None,  # id del rectángulo que enmarca la vista del diagrama
+    "drag": None,  # Última posición del ratón al arrastrar el diagrama
+}
+
 
 def check_dependences(dependencies):
     missing_dependencies = []
     for dependency in dependencies:
-        try:
-            importlib.import_module(dependency)
-        except ImportError:
+        # find_spec solo busca el módulo, no lo importa, así que es inmediato
+        if importlib.util.find_spec(dependency) is None:
             missing_dependencies.append(dependency)
 
     if not missing_dependencies:
@@ -173,7 +244,9 @@ def simulated_notes(message):
 def simulated_note_on(message):
     global midi_state
 
-    midi_state["active_notes"].append(message.note)
+    # play_midi recorre active_notes mientras llama aquí, si añadiésemos notas repetidas no terminaría nunca
+    if message.note not in midi_state["active_notes"]:
+        midi_state["active_notes"].append(message.note)
 
 
 # Simula mensaje MIDI note_off
@@ -184,97 +257,164 @@ def simulated_note_off(message):
         midi_state["active_notes"].remove(message.note)
 
 
-# Si existe el fichero de configuración carga el puerto anteriormente seleccionado y no hace falta seleccionarlo
+# Obtenemos los puertos guardados en la configuración, que ya está cargada en memoria
 def load_config_port():
-    global config
-
-    if os.path.exists(CONFIG_PATH):
-        with open(CONFIG_PATH, "r") as config_file:
-            config = yaml.safe_load(config_file)
-            selected_port_in = config.get("port_in", "no-midi")
-            # Leemos el puerto de entrada
-            if selected_port_in == "no-midi":
-                selected_port_in = "No hay puertos MIDI"
-            # Leemos el puerto de salida
-            selected_port_out = config.get("port_out", "no-midi")
-            if selected_port_out == "no-midi":
-                selected_port_out = "No hay puertos MIDI"
-            return {"port_in": selected_port_in, "port_out": selected_port_out}
+    # Leemos el puerto de entrada
+    selected_port_in = config.get("port_in", "no-midi")
+    if selected_port_in == "no-midi":
+        selected_port_in = "No hay puertos MIDI"
+    # Leemos el puerto de salida
+    selected_port_out = config.get("port_out", "no-midi")
+    if selected_port_out == "no-midi":
+        selected_port_out = "No hay puertos MIDI"
 
-    return {"port_in": "No hay puertos MIDI", "port_out": "No hay puertos MIDI"}
+    return {"port_in": selected_port_in, "port_out": selected_port_out}
 
 
-# Cargamos el fichero de configuración
+# Cargamos el fichero de configuración, es la única vez que se lee
 def load_config_file():
-    global config
+    global config, threads_control
+    import yaml
+
     # Abrimos el fichero en modo lectura en caso de que exista
     try:
         with open(CONFIG_PATH, "r") as config_file:
-            config = yaml.safe_load(config_file)
+            loaded_config = yaml.safe_load(config_file) or {}
+        # Las claves que falten en el fichero mantienen su valor por defecto
+        config.update(loaded_config)
+        threads_control["config_saved"] = dict(config)
 
     # Si no existe el fichero llamamos a save_config_file para que lo cree
     except FileNotFoundError:
         save_config_file()
 
 
-# Guardamos el fichero de configuración
+# Pedimos guardar el fichero de configuración, se escribe en segundo plano
 def save_config_file():
-    with open(CONFIG_PATH, "w") as config_file:
-        # dump nos sirve para convertir un diccionario a yaml
-        yaml.dump(config, config_file)
+    global threads_control
+
+    if threads_control["config_thread"] is None:
+        config_thread = threading.Thread(target=config_writer, daemon=True)
+        config_thread.start()
+        threads_control["config_thread"] = config_thread
+
+    threads_control["config_save_event"].set()
+
+
+# Hilo que escribe la configuración cuando dejan de llegar cambios
+def config_writer():
+    save_event = threads_control["config_save_event"]
+
+    while True:
+        save_event.wait()
+        save_event.clear()
+        first_change = time.perf_counter()
+
+        # Si siguen llegando cambios esperamos, así una ráfaga se guarda una sola vez
+        while save_event.wait(CONFIG_SAVE_DELAY):
+            save_event.clear()
+            if time.perf_counter() - first_change > CONFIG_MAX_DELAY:
+                break
+
+        write_config_file()
+
+
+# Escribimos el fichero de configuración si ha cambiado desde la última vez
+def write_config_file():
+    global threads_control
+    import yaml
+
+    with threads_control["config_lock"]:
+        snapshot = dict(config)
+        if snapshot == threads_control["config_saved"]:
+            return
+
+        # Escribimos en un fichero temporal y lo cambiamos por el original de
+        # una vez, así si el programa se cierra a medias el fichero no se rompe
+        temp_path = CONFIG_PATH + ".tmp"
+        try:
+            with open(temp_path, "w") as config_file:
+                # dump nos sirve para convertir un diccionario a yaml
+                yaml.dump(snapshot, config_file)
+                config_file.flush()
+                os.fsync(config_file.fileno())
+            os.replace(temp_path, CONFIG_PATH)
+        except OSError as e:
+            print("Error al guardar la configuración:", e)
+            return
+
+        threads_control["config_saved"] = snapshot
+
+
+# Obtenemos el id del círculo que está bajo el ratón
+def current_circle(c):
+    items = c.find_withtag("current")
+    if not items:
+        return None
+    # Si se ha clicado el texto buscamos el círculo al que pertenece
+    return lattice_view["texts"].get(items[0], items[0])
+
+
+# Obtenemos la nota del círculo que está bajo el ratón
+def current_note(c):
+    info = midi_state["circle_ids"].get(current_circle(c))
+    if info is None:
+        return None
+    return info["note"]
+
+
+# Obtenemos las notas del triángulo que está bajo el ratón
+def current_triangle_notes(c, triangle_ids):
+    items = c.find_withtag("current")
+    if not items or items[0] not in triangle_ids:
+        return []
+    return triangle_ids[items[0]]["notes"]
 
 
 # Evento de click en un circulo
-def click_circle(c, circle, text, note):
+def click_circle(c):
     # Tocamos una nota con el ratón ya sea clicando el círculo o en el texto
-    c.tag_bind(circle,
-               "<Button-1>",
-               lambda event, note_value=note: mark_notes(c, note))
-    c.tag_bind(text,
-               "<Button-1>",
-               lambda event, note_value=note: mark_notes(c, note))
+    # Los círculos se reutilizan al desplazar el diagrama, así que la nota se lee al clicar
+    for tag in ("circle", "note_text"):
+        c.tag_bind(tag,
+                   "<Button-1>",
+                   lambda event: mark_notes(c, current_note(c)))
 
 
 # Evento de soltar el clic en un círculo
-def unclick_circle(window, c, circle, text, note):
+def unclick_circle(window, c):
     # Dejamos de tocar la nota con el ratón
-    c.tag_bind(circle,
-               "<ButtonRelease-1>",
-               lambda event, note_value=note: unmark_notes(window, c, note))
-    c.tag_bind(text,
-               "<ButtonRelease-1>",
-               lambda event, note_value=note: unmark_notes(window, c, note))
+    for tag in ("circle", "note_text"):
+        c.tag_bind(tag,
+                   "<ButtonRelease-1>",
+                   lambda event: unmark_notes(window, c, current_note(c)))
 
 
 # Función para manejar los eventos del ratón para los círculos
-def click_circle_events(window, c, circle, text, note):
+def click_circle_events(window, c):
     try:
-        click_circle(c, circle, text, note)
-        unclick_circle(window, c, circle, text, note)
+        click_circle(c)
+        unclick_circle(window, c)
     except OSError as e:
         print("Error al abrir el puerto MIDI:", e)
     return
 
 
 # Función para manejar los eventos del ratón para los triángulos
-def click_triangle_events(
-    window,
-    c,
-    notes,
-    triangle_ids,
-    triangle_id,
-):
+def click_triangle_events(window, c, triangle_ids):
     try:
         # Marca el triángulo al hacer clic con el ratón en este
-        c.tag_bind(triangle_id,
+        c.tag_bind("triangle",
                    "<Button-1>",
-                   lambda event, notes_value=notes, tid=triangle_id:
-                   handle_triangle_click(window, c, notes, triangle_ids))
+                   lambda event: handle_triangle_click(
+                       window, c, current_triangle_notes(c, triangle_ids),
+                       triangle_ids))
         # Desmarca el triángulo al dejar de hacer clic
-        c.tag_bind(triangle_id,
+        c.tag_bind("triangle",
                    "<ButtonRelease-1>",
-                   lambda event, notes_value=notes: handle_triangle_unclick(
-                       window, c, notes, triangle_ids))
+                   lambda event: handle_triangle_unclick(
+                       window, c, current_triangle_notes(c, triangle_ids),
+                       triangle_ids))
     except OSError as e:
         print("Error al abrir el puerto MIDI:", e)
     return
@@ -284,6 +424,15 @@ def click_triangle_events(
 def handle_triangle_click(window, canvas, notes, triangle_ids):
     global midi_state
 
+    # Si no se ha clicado ningún triángulo no hacemos nada
+    if not notes:
+        return
+    # Con el motor en otro proceso el clic lo procesa él
+    if engine_running():
+        midi_state["last_chord"] = notes
+        engine_send("triangle_click", notes)
+        return
+
     # Si hay un triángulo marcado y es distinto del actual desmarcamos
     if midi_state["last_chord"] and set(notes) != set(midi_state["last_chord"]):
         # Desmarcamos de la selección anterior
@@ -296,167 +445,483 @@ def handle_triangle_click(window, canvas, notes, triangle_ids):
 
 # Controlamos cuando el triángulo deja de estar clicado
 def handle_triangle_unclick(window, canvas, notes, triangle_ids):
+    if engine_running():
+        engine_send("triangle_unclick", notes)
+        return
     # Si no estamos en modo hold_on, desmarcamos al soltar el botón
     if not global_config["hold_on"]:
         unmark_triangles(window, canvas, notes, triangle_ids)
 
 
-# Comprobamos las notas asociadas a los triángulos
-def check_triangle_notes(painted_coords, triangle_ids):
-    for coord, coord_info in painted_coords.items():
-        note = coord_info["note"]  # Obtenemos la nota asociada a esa coordenada
-        for triangle_id, triangle_data in triangle_ids.items():
-            # Verificamos si alguna coordenada de painted_coords coincide con las coordenadas del triángulo
-            if any(
-                    round(coord[0], 2) == round(triangle_coord[0], 2)
-                    and round(coord[1], 2) == round(triangle_coord[1], 2)
-                    for triangle_coord in triangle_data["coords"]):
-                # Si la nota no está ya en las notas del triángulo, la añadimos
-                if note not in triangle_data["notes"]:
-                    triangle_data["notes"].append(note)
+# Lado del triángulo en píxeles con el tamaño y el zoom actuales
+def lattice_side():
+    return TRIANGLE * lattice_view["size_factor"] * lattice_view["zoom"]
+
+
+# Posición en pantalla de un vértice de la red
+def lattice_position(vertex):
+    return tonnetz.vertex_position(
+        vertex[0],
+        vertex[1],
+        lattice_view["origin_x"],
+        lattice_view["origin_y"],
+        lattice_side(),
+    )
+
+
+# Coordenadas de un círculo centrado en un vértice
+def circle_bbox(vertex):
+    x, y = lattice_position(vertex)
+    radius = R_CIRCLE * lattice_view["size_factor"] * lattice_view["zoom"]
+    return x - radius, y - radius, x + radius, y + radius
+
+
+# Coordenadas de los vértices de un triángulo en el formato de canvas.coords
+def triangle_points(cell):
+    points = []
+    for vertex in tonnetz.triangle_vertices(*cell):
+        points.extend(lattice_position(vertex))
+    return points
+
+
+# Nota de un vértice visible, leída de la red generada para la vista
+def grid_note(vertex):
+    first_row, first_col, grid = lattice_view["grid"]
+    return tonnetz.NOTE_NAMES[grid[vertex[0] - first_row][vertex[1] -
+                                                        first_col]]
+
+
+# Función que añade los triángulos que han entrado en la vista
+def draw_triangles(window, c, cells, selected_chords):
+    global global_config, lattice_view
+
+    triangle_ids = lattice_view["triangle_ids"]
+
+    for cell in cells:
+        if cell in lattice_view["cells"]:
+            continue
+
+        points = triangle_points(cell)
+        notes = [
+            grid_note(vertex) for vertex in tonnetz.triangle_vertices(*cell)
+        ]
+        if frozenset(notes) in selected_chords:
+            fill = "#7699d4"
+        else:
+            fill = window.cget("bg")
+
+        # Reutilizamos un triángulo oculto si lo hay
+        if lattice_view["free_triangles"]:
+            triangle_id = lattice_view["free_triangles"].pop()
+            c.coords(triangle_id, *points)
+            c.itemconfig(triangle_id, fill=fill, state="normal")
+        elif global_config["dark_mode"]:
+            # Dibujamos el triángulo
+            triangle_id = c.create_polygon(points,
+                                           fill=fill,
+                                           outline="white",
+                                           tags=("lattice", "triangle"))
+        else:
+            triangle_id = c.create_polygon(points,
+                                           fill=fill,
+                                           outline="black",
+                                           tags=("lattice", "triangle"))
+
+        lattice_view["cells"][cell] = triangle_id
+        triangle_ids[triangle_id] = {"cell": cell, "notes": notes}
 
 
 # Función que añade los círculos con su nota correspondiente
-def draw_circles(
-    window,
-    c,
-    circle_coords,
-    triangle_ids,
-    size_factor,
-):
-    global global_config, midi_state, data_structures
-    i = 0
-    # Guardamos las coordenadas donde se ha pintado una nota ya
-    painted_coords = {}
-    size_factor_value = float(size_factor.get())
-
-    # Guardamos una versión visual de las notas con "♭", pero sin modificar las originales
-    notes_visual = [
-        note.replace("b", "♭") for note in data_structures["notes_in_order"]
-    ]
+def draw_circles(window, c, vertices, selected_notes):
+    global global_config, midi_state, lattice_view
+
+    for vertex in vertices:
+        if vertex in lattice_view["vertices"]:
+            continue
+
+        x, y = lattice_position(vertex)
+        note = grid_note(vertex)
+        # Guardamos una versión visual de la nota con "♭", pero sin modificar la original
+        note_visual = note.replace("b", "♭")
+
+        # Reutilizamos un círculo oculto si lo hay
+        if lattice_view["free_circles"]:
+            circle, text = lattice_view["free_circles"].pop()
+            c.coords(circle, *circle_bbox(vertex))
+            c.coords(text, x, y)
+            c.itemconfig(circle, state="normal")
+            c.itemconfig(text, text=note_visual, state="normal")
+        elif global_config["dark_mode"]:
+            # Imprimimos el círculo
+            circle = c.create_oval(
+                *circle_bbox(vertex),
+                fill=window.cget("bg"),
+                outline="white",
+                tags=("lattice", "circle"),
+            )
+            # Imprimimos la nota
+            text = c.create_text(x,
+                                 y,
+                                 text=note_visual,
+                                 fill="white",
+                                 tags=("lattice", "note_text"))
+        else:
+            # Imprimimos el círculo
+            circle = c.create_oval(
+                *circle_bbox(vertex),
+                fill="white",
+                tags=("lattice", "circle"),
+            )
+            # Imprimimos la nota
+            text = c.create_text(x,
+                                 y,
+                                 text=note_visual,
+                                 fill="black",
+                                 tags=("lattice", "note_text"))
+
+        if note in selected_notes:
+            c.itemconfig(circle, fill="#fcc035")
+        else:
+            c.itemconfig(circle, fill=window.cget("bg"))
+
+        lattice_view["vertices"][vertex] = circle
+        lattice_view["texts"][text] = circle
+        midi_state["circle_ids"][circle] = {
+            "vertex": vertex,
+            "note": note,
+            "text_id": text,
+        }
+
+
+# Ocultamos las figuras que han salido de la vista para poder reutilizarlas
+# La selección va por posiciones de la red y no por ids, así que ocultar una
+# figura no la quita de la selección ni cambia lo que suena.
+def hide_shapes(c, cells, vertices):
+    global midi_state, lattice_view
+
+    for cell, triangle_id in list(lattice_view["cells"].items()):
+        if cell not in cells:
+            c.itemconfig(triangle_id, state="hidden")
+            del lattice_view["cells"][cell]
+            lattice_view["triangle_ids"].pop(triangle_id, None)
+            lattice_view["free_triangles"].append(triangle_id)
+
+    for vertex, circle in list(lattice_view["vertices"].items()):
+        if vertex not in vertices:
+            text = midi_state["circle_ids"][circle]["text_id"]
+            c.itemconfig(circle, state="hidden")
+            c.itemconfig(text, state="hidden")
+            del lattice_view["vertices"][vertex]
+            del lattice_view["texts"][text]
+            midi_state["circle_ids"].pop(circle, None)
+            lattice_view["free_circles"].append((circle, text))
+
+
+# Tamaño del canvas en pantalla
+def canvas_size(c):
+    width = c.winfo_width()
+    height = c.winfo_height()
+    # Antes de que se muestre la ventana el canvas todavía no tiene tamaño
+    if width <= 1 or height <= 1:
+        width = int(c.cget("width"))
+        height = int(c.cget("height"))
+    return width, height
+
+
+# Dibuja solo las figuras que se ven en pantalla más un margen
+def refresh_lattice(window, c):
+    global midi_state, lattice_view
+
+    width, height = canvas_size(c)
+    rows, cols = tonnetz.visible_cells(
+        width,
+        height,
+        lattice_view["origin_x"],
+        lattice_view["origin_y"],
+        lattice_side(),
+        VIEW_MARGIN,
+    )
+    # Si no ha entrado ni salido ninguna celda no hay nada que hacer
+    if lattice_view["visible_range"] == (rows, cols):
+        return
+    lattice_view["visible_range"] = (rows, cols)
+
+    cells = [(row, col) for row in rows for col in cols]
+    # Generamos de una vez las notas de todos los vértices de la vista
+    lattice_view["grid"] = (
+        rows.start,
+        cols.start,
+        tonnetz.generate_lattice(len(rows) + 1,
+                                 len(cols) + 2, rows.start, cols.start,
+                                 **lattice_view["tuning"]),
+    )
+    vertices = {
+        vertex
+        for cell in cells for vertex in tonnetz.triangle_vertices(*cell)
+    }
+
+    # Las figuras nuevas se pintan si su acorde o su nota está seleccionado, aunque sea en otra posición
+    selected_chords = {
+        frozenset(notes) for notes in selection_notes("triangle").values()
+    }
+    selected_notes = {
+        note
+        for notes in selection_notes("circle").values() for note in notes
+    }
+    # Con el motor en otro proceso lo seleccionado es lo que ha pintado él
+    for (shape_type, value), fill in list(engine_state["fills"].items()):
+        if shape_type == "triangle" and fill == "#7699d4":
+            selected_chords.add(value)
+        elif shape_type == "circle" and fill == "#fcc035":
+            selected_notes.add(value)
+
+    hide_shapes(c, set(cells), vertices)
+    draw_triangles(window, c, cells, selected_chords)
+    draw_circles(window, c, sorted(vertices), selected_notes)
+
+    # Los círculos y sus notas siempre por encima de los triángulos
+    c.tag_raise("circle")
+    c.tag_raise("note_text")
+
+
+# Recolocamos las figuras dibujadas después de cambiar el zoom
+def reposition_lattice(c):
+    for cell, triangle_id in lattice_view["cells"].items():
+        c.coords(triangle_id, *triangle_points(cell))
+
+    for vertex, circle in lattice_view["vertices"].items():
+        c.coords(circle, *circle_bbox(vertex))
+        c.coords(midi_state["circle_ids"][circle]["text_id"],
+                 *lattice_position(vertex))
+
+
+# Empezamos a arrastrar el diagrama
+def start_drag(event):
+    lattice_view["drag"] = (event.x, event.y)
+
+
+# Terminamos de arrastrar el diagrama
+def stop_drag(event):
+    lattice_view["drag"] = None
+
+
+# Desplazamos el diagrama con el ratón
+def drag_lattice(window, c, event):
+    global lattice_view
+
+    if lattice_view["drag"] is None:
+        return
+
+    last_x, last_y = lattice_view["drag"]
+    lattice_view["drag"] = (event.x, event.y)
+    pan_lattice(window, c, event.x - last_x, event.y - last_y)
+
+
+# Desplazamos el diagrama dx, dy píxeles
+def pan_lattice(window, c, dx, dy):
+    global lattice_view
+
+    lattice_view["origin_x"] += dx
+    lattice_view["origin_y"] += dy
+
+    # Movemos todas las figuras de una vez y dibujamos solo las que entran
+    c.move("lattice", dx, dy)
+    refresh_lattice(window, c)
+
+
+# Desplazamiento que hace falta para que se vea entera una celda
+def cell_offset(c, cell):
+    width, height = canvas_size(c)
+    points = triangle_points(cell)
+    xs = points[0::2]
+    ys = points[1::2]
+
+    dx = dy = 0
+    if min(xs) < 0:
+        dx = -min(xs)
+    elif max(xs) > width:
+        dx = width - max(xs)
+    if min(ys) < 0:
+        dy = -min(ys)
+    elif max(ys) > height:
+        dy = height - max(ys)
+    return dx, dy
+
+
+# Desplazamos el diagrama si ninguna de las celdas se ve entera en pantalla
+def scroll_to_cells(window, c, cells):
+    offsets = [cell_offset(c, cell) for cell in cells]
+    if not offsets or (0, 0) in offsets:
+        return
+    # Vamos a la que está más cerca
+    dx, dy = min(offsets, key=lambda offset: abs(offset[0]) + abs(offset[1]))
+    pan_lattice(window, c, dx, dy)
+
+
+# Cambiamos el zoom manteniendo fijo el punto que está bajo el ratón
+def zoom_lattice(window, c, event, factor):
+    global lattice_view
+
+    zoom = min(MAX_ZOOM, max(MIN_ZOOM, lattice_view["zoom"] * factor))
+    factor = zoom / lattice_view["zoom"]
+    if factor == 1:
+        return
+
+    lattice_view["origin_x"] = event.x - (event.x -
+                                          lattice_view["origin_x"]) * factor
+    lattice_view["origin_y"] = event.y - (event.y -
+                                          lattice_view["origin_y"]) * factor
+    lattice_view["zoom"] = zoom
+
+    reposition_lattice(c)
+    refresh_lattice(window, c)
 
-    for triangle_coord in circle_coords:
-        for coords in triangle_coord:
-            x, y = coords
-            # Redondeamos las coordenadas a dos decimales por si no son exactas
-            rounded_coords = (round(x, 2), round(y, 2))
-            # Vemos si las coordenadas redondeadas están o no en painted_coords
-            if rounded_coords not in painted_coords:
-                note = data_structures["notes_in_order"][i]
-                note_visual = notes_visual[i]
-                if global_config["dark_mode"]:
-                    # Imprimimos el círculo
-                    circle = c.create_oval(
-                        x - R_CIRCLE * size_factor_value,
-                        y - R_CIRCLE * size_factor_value,
-                        x + R_CIRCLE * size_factor_value,
-                        y + R_CIRCLE * size_factor_value,
-                        fill=window.cget("bg"),
-                        outline="white",
-                    )
-                    # Imprimimos la nota
-                    text = c.create_text(x, y, text=note_visual, fill="white")
-                else:
-                    # Imprimimos el círculo
-                    circle = c.create_oval(
-                        x - R_CIRCLE * size_factor_value,
-                        y - R_CIRCLE * size_factor_value,
-                        x + R_CIRCLE * size_factor_value,
-                        y + R_CIRCLE * size_factor_value,
-                        fill="white",
-                    )
-                    # Imprimimos la nota
-                    text = c.create_text(x, y, text=note_visual, fill="black")
-
-                # Añadimos esta coordenada al diccionario con la nota que le corresponde
-                painted_coords[rounded_coords] = {
-                    "note": note,
-                    "circle_id": circle,
-                    "text_id": text,
-                }
-                midi_state["circle_ids"][circle] = {
-                    "coords": (x, y),
-                    "note": note
-                }
-                click_circle_events(window, c, circle, text, note)
-
-                i += 1
-
-    # Comprobamos las notas asociadas
-    check_triangle_notes(painted_coords, triangle_ids)
-
-    return painted_coords, midi_state["circle_ids"], triangle_ids
+
+# Controlamos los eventos para desplazar el diagrama y hacer zoom
+def lattice_view_events(window, c):
+    # Arrastramos con el botón derecho, el izquierdo sirve para tocar notas
+    c.bind("<ButtonPress-3>", start_drag)
+    c.bind("<B3-Motion>", lambda event: drag_lattice(window, c, event))
+    c.bind("<ButtonRelease-3>", stop_drag)
+
+    # Zoom con control y la rueda del ratón (Windows y macOS usan delta, Linux los botones 4 y 5)
+    c.bind(
+        "<Control-MouseWheel>",
+        lambda event: zoom_lattice(window, c, event, 1.1
+                                   if event.delta > 0 else 1 / 1.1),
+    )
+    c.bind("<Control-Button-4>",
+           lambda event: zoom_lattice(window, c, event, 1.1))
+    c.bind("<Control-Button-5>",
+           lambda event: zoom_lattice(window, c, event, 1 / 1.1))
+
+    # Al cambiar el tamaño de la ventana puede verse más diagrama
+    c.bind("<Configure>", lambda event: resize_lattice(window, c))
+
+
+# Dibujamos lo que entra en la vista y ajustamos el marco al nuevo tamaño
+def resize_lattice(window, c):
+    refresh_lattice(window, c)
+    if lattice_view["rectangle"] is not None:
+        paint_rectangle(c)
+
+
+# Destinos (puerto, canal) de los mensajes de un origen, si source es None de todos
+def output_destinations(selected_port_out, source=None):
+    """Los destinos se configuran en destinations como una lista de
+    diccionarios con port, channel y sources (acordes, arpegiador, reloj), y
+    opcionalmente queue_size y overflow para la cola del puerto. Un destino
+    sin port usa el puerto seleccionado y uno sin sources recibe todo. Sin
+    destinos configurados se usa el puerto seleccionado en el canal 0, como
+    antes."""
+    destinations = config.get("destinations") or [{"channel": 0}]
+
+    routes = []
+    for destination in destinations:
+        if source is not None and source not in destination.get(
+                "sources", [source]):
+            continue
+        port = destination.get("port", selected_port_out)
+        if port in ("no-midi", "No hay puertos MIDI"):
+            continue
+        route = (
+            port,
+            int(destination.get("channel", 0)),
+            destination.get("queue_size", config.get("output_queue_size",
+                                                     256)),
+            destination.get("overflow", config.get("output_overflow",
+                                                   "coalesce")),
+        )
+        if route[:2] not in [existing[:2] for existing in routes]:
+            routes.append(route)
+
+    return routes
 
 
 # Genera la nota que hemos clicado
-def play_midi(selected_port_out):
+def play_midi(selected_port_out, source="acordes", notes=None):
     global global_config, midi_state
+    import mido
 
     if hasattr(selected_port_out, "get") and isinstance(selected_port_out,
                                                         tk.StringVar):
         selected_port_out = selected_port_out.get()
 
+    # Sin notas concretas se tocan las notas activas
+    if notes is None:
+        notes = midi_state["active_notes"]
+
     if selected_port_out == "no-midi" or selected_port_out == "No hay puertos MIDI":
-        for note in midi_state["active_notes"]:
+        for note in notes:
             simulated_notes(mido.Message("note_on", note=note))
-        return
-
-    try:
-        with mido.open_output(selected_port_out) as port:
-            if selected_port_out and midi_state["active_notes"]:
-                for note in midi_state["active_notes"]:
-                    msg = mido.Message('note_on',
-                                       note=note,
-                                       velocity=global_config["last_velocity"])
-                    port.send(msg)
 
-    except OSError as e:
-        print("Error al abrir el puerto MIDI:", e)
-    return
+    # El enrutador copia cada nota a sus destinos sin esperar a los puertos
+    destinations = output_destinations(selected_port_out, source)
+    for note in notes:
+        msg = mido.Message('note_on',
+                           note=note,
+                           velocity=global_config["last_velocity"])
+        grabador.record("salida", msg)
+        enrutador.send(msg, destinations)
 
 
 # Dejamos de generar la nota que habíamos generado
-def stop_midi(selected_port_out, control=False):
+def stop_midi(selected_port_out, control=False, source="acordes", notes=None):
     global midi_state
+    import mido
 
     if hasattr(selected_port_out, "get") and isinstance(selected_port_out,
                                                         tk.StringVar):
         selected_port_out = selected_port_out.get()
 
+    # Con el motor en otro proceso las notas suenan en él
+    if engine_running():
+        engine_send("stop_midi", selected_port_out, control, source,
+                    None if notes is None else list(notes))
+        return
+
+    # Con notas concretas solo se sueltan esas, si no todas las activas
+    active = notes is None
+    if active:
+        notes = midi_state["active_notes"]
+
     if selected_port_out == "no-midi" or selected_port_out == "No hay puertos MIDI":
-        for note in midi_state["active_notes"]:
+        for note in list(notes):
             simulated_notes(mido.Message("note_off", note=note))
-        midi_state["active_notes"].clear()
-        return
 
-    try:
-        with mido.open_output(selected_port_out) as port:
-            if selected_port_out and midi_state["active_notes"]:
-                for note in midi_state["active_notes"]:
-                    if control:
-                        msg = mido.Message('control_change',
-                                           channel=0,
-                                           control=123,
-                                           value=0)
-                    else:
-                        msg = mido.Message('note_off', note=note)
-                    port.send(msg)
+    # Al silenciarlo todo avisamos a todos los destinos, no solo a los del origen
+    if control:
+        destinations = output_destinations(selected_port_out)
+    else:
+        destinations = output_destinations(selected_port_out, source)
+
+    for note in notes:
+        if control:
+            msg = mido.Message('control_change',
+                               channel=0,
+                               control=123,
+                               value=0)
+        else:
+            msg = mido.Message('note_off', note=note)
+        grabador.record("salida", msg)
+        enrutador.send(msg, destinations)
 
+    if active:
         midi_state["active_notes"].clear()
-    except OSError as e:
-        print("Error al abrir el puerto MIDI:", e)
-    return
 
 
 # Marca la nota si ha sido detectada por MIDI
 def mark_notes(canvas, note):
     global midi_state
+
+    if engine_running():
+        engine_send("note_click", note)
+        return
     try:
-        # Iterar sobre circle_ids, que es más simple que painted_coords
-        for circle_id, info in midi_state["circle_ids"].items():
+        # Iterar sobre circle_ids, copiándolo porque la vista lo cambia al desplazarse
+        for circle_id, info in list(midi_state["circle_ids"].items()):
             if info["note"] == note:
-                if circle_id not in midi_state["selected_shapes"]:
-                    midi_state["selected_shapes"][circle_id] = "circle"
+                select_shape(("circle", info["vertex"]), "circle", [note])
                 # Cambiar el color del círculo seleccionado
                 canvas.itemconfig(circle_id, fill="#fcc035")
 
@@ -464,16 +929,112 @@ def mark_notes(canvas, note):
         pass
 
 
+# Añadimos una forma a la selección y contamos sus notas
+# Cada nota lleva la cuenta de cuántas formas seleccionadas la tienen. Solo
+# cuando una nota entra o sale de la unión se avisa al hilo de salida, así
+# seleccionar o quitar una forma cuesta lo que sus notas y el hilo recibe
+# exactamente las notas que cambian.
+def select_shape(shape_id, shape_type, notes):
+    global midi_state
+    with midi_state["selection_lock"]:
+        if shape_id in midi_state["selected_shapes"]:
+            return
+        # Sin repetidas pero en el orden de los vértices, el arpegio as_played lo usa
+        midi_notes = arpegiador.convert_note_to_midi(dict.fromkeys(notes))
+        midi_state["selected_shapes"][shape_id] = shape_type
+        midi_state["shape_notes"][shape_id] = midi_notes
+
+        counts = midi_state["note_counts"]
+        for note in midi_notes:
+            counts[note] = counts.get(note, 0) + 1
+            if counts[note] == 1:
+                midi_state["selection_changes"].put((note, True))
+                notify_listeners("note", note, True)
+        if shape_type == "triangle":
+            notify_listeners("triangle", midi_notes, True)
+
+
+# Quitamos una forma de la selección y descontamos sus notas
+def deselect_shape(shape_id):
+    global midi_state
+
+    with midi_state["selection_lock"]:
+        shape_type = midi_state["selected_shapes"].pop(shape_id, None)
+        if shape_type is None:
+            return
+
+        counts = midi_state["note_counts"]
+        midi_notes = midi_state["shape_notes"].pop(shape_id)
+        for note in midi_notes:
+            counts[note] -= 1
+            if counts[note] == 0:
+                del counts[note]
+                midi_state["selection_changes"].put((note, False))
+                notify_listeners("note", note, False)
+        if shape_type == "triangle":
+            notify_listeners("triangle", midi_notes, False)
+
+
+# Avisamos a las funciones registradas en listeners de algo que ha pasado
+def notify_listeners(kind, *values):
+    """kind dice qué ha pasado y values sus datos:
+    - ("note", nota, suena): una nota midi entra o sale de la selección
+    - ("triangle", notas, seleccionado): se selecciona o quita un triángulo
+    - ("chord", nombres): la entrada forma un acorde de la red
+    - ("step", paso, nota): el arpegiador toca una nota
+    Se llama desde los hilos MIDI y el temporizador, a veces con el cerrojo
+    de la selección cogido, así que las funciones deben ser rápidas."""
+    for listener in midi_state["listeners"]:
+        listener(kind, *values)
+
+
+# Quitamos todas las formas de la selección
+def clear_selected_shapes():
+    for shape_id in list(midi_state["selected_shapes"]):
+        deselect_shape(shape_id)
+
+
+# Nombres de las notas de cada forma seleccionada de un tipo, se vea o no
+def selection_notes(shape_type):
+    with midi_state["selection_lock"]:
+        return {
+            shape_id: [
+                convert_midi_to_note(note)
+                for note in midi_state["shape_notes"][shape_id]
+            ]
+            for shape_id, selected_type in midi_state["selected_shapes"].items()
+            if selected_type == shape_type
+        }
+
+
+# Pintamos los triángulos dibujados con alguno de esos acordes
+def paint_chords(canvas, triangle_ids, chords, fill):
+    for triangle_id, info in list(triangle_ids.items()):
+        if frozenset(info["notes"]) in chords:
+            canvas.itemconfig(triangle_id, fill=fill)
+
+
+# Pintamos los círculos dibujados con alguna de esas notas
+def paint_notes(canvas, notes, fill):
+    for circle_id, info in list(midi_state["circle_ids"].items()):
+        if info["note"] in notes:
+            canvas.itemconfig(circle_id, fill=fill)
+
+
 # Desmarca la nota cuando ya no es detectada
 def unmark_notes(window, canvas, note):
     global midi_state
+
+    if engine_running():
+        engine_send("note_unclick", note)
+        return
     try:
-        for circle_id, info in midi_state["circle_ids"].items():
-            if info["note"] == note:
-                if circle_id in midi_state["selected_shapes"]:
-                    midi_state["selected_shapes"].pop(circle_id, None)
-                # Restablece el color del círculo a blanco
-                canvas.itemconfig(circle_id, fill=window.cget("bg"))
+        # También los círculos seleccionados que se han quedado fuera de la vista
+        for shape_id, notes in selection_notes("circle").items():
+            if notes == [note]:
+                deselect_shape(shape_id)
+        # Restablece el color de los círculos a blanco
+        paint_notes(canvas, {note}, window.cget("bg"))
 
     except tk.TclError:
         pass
@@ -489,16 +1050,16 @@ def mark_triangles(
     global midi_state
     try:
         # Iterar sobre los triángulos y verificar si coincide con las coordenadas proporcionadas
-        for triangle_id, info in triangle_ids.items():
+        for triangle_id, info in list(triangle_ids.items()):
             # En caso de que exista last_chord ponemos sin color los triángulos antes de marcar los nuevos
             if set(midi_state["last_chord"]) == set(info["notes"]):
                 canvas.itemconfig(triangle_id, fill=window.cget("bg"))
             if set(notes).issubset(set(
                     info["notes"])):  # Ponemos set para que no importe el orden
-                if triangle_id not in midi_state["selected_shapes"]:
-                    midi_state["selected_shapes"][triangle_id] = "triangle"
-                    # Cambiar el color del triángulo para marcarlo como seleccionado
-                    canvas.itemconfig(triangle_id, fill="#7699d4")
+                select_shape(("triangle", info["cell"]), "triangle",
+                             info["notes"])
+                # Cambiar el color del triángulo para marcarlo como seleccionado
+                canvas.itemconfig(triangle_id, fill="#7699d4")
                 for note in notes:
                     mark_notes(canvas, note)
 
@@ -511,16 +1072,21 @@ def unmark_triangles(window, canvas, notes, triangle_ids):
     global global_config, midi_state
 
     try:
-        for triangle_id, info in triangle_ids.items():
-            if set(info["notes"]).issubset(set(notes)):
-                if triangle_id in midi_state["selected_shapes"]:
-                    # Cambiar el color del triángulo para marcarlo como seleccionado
-                    canvas.itemconfig(triangle_id, fill="grey")
-                    midi_state["selected_shapes"].pop(triangle_id, None)
-                    midi_state["last_chord"] = info["notes"]
-
-                for note in notes:
-                    unmark_notes(window, canvas, note)
+        # También los triángulos seleccionados que se han quedado fuera de la vista
+        chords = set()
+        for shape_id, shape_notes in selection_notes("triangle").items():
+            if set(shape_notes).issubset(set(notes)):
+                deselect_shape(shape_id)
+                chords.add(frozenset(shape_notes))
+                midi_state["last_chord"] = shape_notes
+        # Cambiar el color de los triángulos para marcarlos como soltados
+        paint_chords(canvas, triangle_ids, chords, "grey")
+
+        if chords or any(
+                set(info["notes"]).issubset(set(notes))
+                for info in list(triangle_ids.values())):
+            for note in notes:
+                unmark_notes(window, canvas, note)
 
     except tk.TclError:
         pass
@@ -530,136 +1096,108 @@ def unmark_triangles(window, canvas, notes, triangle_ids):
 def unmark_shapes(window, canvas, selected_port_out):
     global midi_state
 
-    shape_ids = list(midi_state["selected_shapes"].keys())
+    if engine_running():
+        engine_send("unmark", port_value(selected_port_out))
+        return
+
     # Verificar si hay alguna forma seleccionada
     if midi_state["selected_shapes"]:
-        # Iterar sobre todos los ID de las formas seleccionadas
-        for shape_id in shape_ids:
-            # Cambiar el color de todas las formas seleccionadas a blanco
-            canvas.itemconfig(shape_id, fill=window.cget("bg"))
-            midi_state["selected_shapes"].pop(shape_id, None)
+        # Cambiar el color de las figuras dibujadas de lo seleccionado a blanco
+        paint_chords(canvas, lattice_view["triangle_ids"], {
+            frozenset(notes) for notes in selection_notes("triangle").values()
+        }, window.cget("bg"))
+        paint_notes(canvas, {
+            note
+            for notes in selection_notes("circle").values() for note in notes
+        }, window.cget("bg"))
 
         # Limpiar la selección después de desmarcar todas las formas
+        clear_selected_shapes()
         stop_midi(selected_port_out, control=True)
-        midi_state["selected_shapes"].clear()
         midi_state["active_notes"].clear()
 
 
-# Crea los triángulos
-def triangles(window, c, size_factor):
-    global midi_state
-
-    size_factor_value = float(size_factor.get())
-    triangle_side = TRIANGLE * size_factor_value
-    triangle_height = triangle_side * math.sqrt(3) / 2
-
-    circle_coords = []
-    triangle_ids = {}
+# Nota inicial y semitonos de los ejes de la red según la configuración
+def lattice_tuning():
+    origin_note = tonnetz.pitch_class(config.get("start_note", "Bb"))
+    if origin_note is None:
+        print("Nota inicial no válida:", config.get("start_note"))
+        origin_note = tonnetz.ORIGIN_NOTE
 
-    for row in range(ROWS):
-        for col in range(COLUMNS):
-            # Definimos las coordenadas x e y
-            if row % 2 == 0:
-                x = (col * triangle_side / 2 +
-                     (1 - row % 2) * triangle_side / 2 + 100)
-            else:
-                x = (col * triangle_side / 2 +
-                     (1 - row % 2) * triangle_side / 2 + 100 +
-                     triangle_side * 0.5)
-            y = row * triangle_height + 200
-
-            # Fila par
-            if row % 2 == 0:
-                # Columna par
-                if col % 2 == 0:
-                    triangle_coords = [
-                        (x, y),
-                        (x + triangle_side / 2, y + triangle_height),
-                        (x - triangle_side / 2, y + triangle_height),
-                    ]
-                # Columna impar
-                else:
-                    triangle_coords = [
-                        (x, y + triangle_height),
-                        (x - triangle_side / 2, y),
-                        (x + triangle_side / 2, y),
-                    ]
-            # Fila impar
-            else:
-                # Columna par
-                if col % 2 == 0:
-                    triangle_coords = [
-                        (x, y + triangle_height),
-                        (x - triangle_side / 2, y),
-                        (x + triangle_side / 2, y),
-                    ]
-                # Columna impar
-                else:
-                    triangle_coords = [
-                        (x, y),
-                        (x + triangle_side / 2, y + triangle_height),
-                        (x - triangle_side / 2, y + triangle_height),
-                    ]
-
-            if global_config["dark_mode"]:
-                # Dibujamos el triángulo
-                triangle_id = c.create_polygon(triangle_coords,
-                                               fill=window.cget("bg"),
-                                               outline="white")
-            else:
-                triangle_id = c.create_polygon(triangle_coords,
-                                               fill=window.cget("bg"),
-                                               outline="black")
-
-            # Añadimos las coordenadas a nuestra lista
-            circle_coords.append(triangle_coords)
-            triangle_ids[triangle_id] = {"coords": triangle_coords, "notes": []}
-            notes = triangle_ids[triangle_id]["notes"]
-
-            click_triangle_events(
-                window,
-                c,
-                notes,
-                triangle_ids,
-                triangle_id,
-            )
+    return {
+        "origin_note": origin_note,
+        "fifth": int(config.get("fifth_axis", tonnetz.FIFTH)),
+        "third": int(config.get("third_axis", tonnetz.THIRD)),
+    }
 
-    # Mostramos los círculos con sus notas
-    painted_coords, _, triangle_ids = draw_circles(
-        window,
-        c,
-        circle_coords,
-        triangle_ids,
-        size_factor,
-    )
 
-    return (
-        painted_coords,
-        triangle_ids,
-        circle_coords,
-    )
+# Crea los triángulos
+def triangles(window, c, size_factor):
+    global midi_state, lattice_view
+
+    # El canvas es nuevo, así que empezamos con la vista vacía
+    clear_selected_shapes()
+    midi_state["circle_ids"].clear()
+    lattice_view.update({
+        "origin_x": 100,
+        "origin_y": 200,
+        "size_factor": float(size_factor.get()),
+        "zoom": 1.0,
+        "tuning": lattice_tuning(),
+        "grid": None,
+        "visible_range": None,
+        "triangle_ids": {},
+        "cells": {},
+        "vertices": {},
+        "texts": {},
+        "free_triangles": [],
+        "free_circles": [],
+        "rectangle": None,
+        "drag": None,
+    })
+    triangle_ids = lattice_view["triangle_ids"]
+    lattice_view["chord_table"] = tonnetz.triangle_table(
+        **lattice_view["tuning"])
+
+    click_triangle_events(window, c, triangle_ids)
+    click_circle_events(window, c)
+    lattice_view_events(window, c)
+
+    # Mostramos los triángulos y los círculos con sus notas que se ven en pantalla
+    refresh_lattice(window, c)
+
+    return triangle_ids
 
 
 # Función para ver si detectamos un acorde desde un puerto MIDI IN
-def detect_chord(window, canvas, note, triangle_ids):
-    current_time = time.time()
-
-    # Si la nota aún no está en las notas activas la añadimos con su tiempo de activación
-    if note not in midi_state['note_times']:
-        midi_state['note_times'][note] = current_time
-
-    chord_notes = []
-    # Recorremos las notas activas para filtrar las que superaron el tiempo
-    for note, activation_time in list(midi_state['note_times'].items()):
-        if current_time - activation_time <= MAX_CHORD_INTERVAL:
-            chord_notes.append(note)
-        else:
-            del midi_state['note_times'][note]
+def detect_chord(window,
+                 canvas,
+                 note,
+                 triangle_ids,
+                 note_times=None,
+                 current_time=None,
+                 max_interval=MAX_CHORD_INTERVAL):
+    # El instante es el de llegada de la nota al puerto, si no lo sabemos el actual
+    if current_time is None:
+        current_time = time.perf_counter()
+
+    # Cada origen puede llevar sus propios tiempos, si no se usan los compartidos
+    if note_times is None:
+        note_times = midi_state['note_times']
+
+    # Notas que han llegado dentro del intervalo de tiempo de un acorde
+    chord_notes = tonnetz.chord_window(note_times, note, current_time,
+                                       max_interval)
+
+    # Camino rápido: en cuanto las notas forman un triángulo de la red lo
+    # pintamos, y empezamos una ventana nueva para no mezclarlo con el siguiente
+    if frozenset(chord_notes) in lattice_view["chord_table"]:
+        mark_triangles(window, canvas, chord_notes, triangle_ids)
+        notify_listeners("chord", chord_notes)
+        note_times.clear()
 
-    # Si el número de notas activas es múltiplo de 3 y mayor que 0, consideramos que es un acorde
+    # Si hay 3 notas o más y hay triángulos pintados, consideramos que es un acorde
     if len(chord_notes) >= 3:
-        # Pintamos los triángulos asociados al acorde
-        mark_triangles(window, canvas, chord_notes, triangle_ids)
         if any(shape_type == "triangle"
                for shape_type in midi_state["selected_shapes"].values()):
             return True
@@ -681,107 +1219,281 @@ def convert_midi_to_note(message):
     return note_name
 
 
-def get_midi_in(window, canvas, selected_port_out, selected_port_in,
-                triangle_ids):
-    global global_config, midi_state, threads_control
+# Procesamos un mensaje de entrada, ya venga de un puerto MIDI o de un fichero
+def handle_midi_in_message(window,
+                           canvas,
+                           selected_port_out,
+                           triangle_ids,
+                           msg,
+                           input_state,
+                           timestamp=None):
+    global global_config, midi_state
 
-    notes = []
-    chord = False
-    # Si no hay un puerto MIDI in seleccionado, salimos
-    if selected_port_in == "no-midi":
-        print("No hay puerto MIDI in seleccionado.")
+    # Las notas de un fichero que suena en la ventana se procesan en el motor
+    if engine_running():
+        engine_send("message", port_value(selected_port_out), msg.bytes())
         return
 
+    # La función hasattr nos dice si el mensaje contiene 'note'
+    if hasattr(msg, "note"):
+        note_name = convert_midi_to_note(msg.note)
+    # Un note_on con velocidad 0 equivale a un note_off
+    if msg.type == "note_on" and msg.velocity > 0:
+        if global_config["moving_triangle"]:
+            unmark_shapes(window, canvas, selected_port_out)
+        global_config["last_velocity"] = msg.velocity
+        if global_config["hold_on"] and input_state["chord"]:
+            stop_midi(selected_port_out, control=True)
+            unmark_shapes(window, canvas, selected_port_out)
+            input_state["notes"] = []
+
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        # La ventana de acorde se adapta a los tiempos entre notas de este origen
+        max_interval = MAX_CHORD_INTERVAL
+        if config.get("adaptive_chord_window", True):
+            tonnetz.update_onset_stats(input_state["timing"], timestamp)
+            max_interval = tonnetz.chord_interval(input_state["timing"],
+                                                  MIN_CHORD_INTERVAL,
+                                                  MAX_CHORD_INTERVAL)
+
+        chord = detect_chord(window, canvas, note_name, triangle_ids,
+                             input_state["note_times"], timestamp,
+                             max_interval)
+        # El camino rápido vacía la ventana, así que una nota más sobre un
+        # acorde que sigue pulsado no lo deshace y al soltarlo se desmarca
+        input_state["chord"] = chord or (input_state["chord"]
+                                         and bool(input_state["notes"]))
+        input_state["notes"].append(note_name)
+        mark_notes(canvas, note_name)
+
+    elif msg.type in ("note_off", "note_on"):
+        notes = input_state["notes"]
+        if input_state["chord"]:
+            if len(set(notes)) >= 3:
+                if not global_config["hold_on"]:
+                    unmark_triangles(window, canvas, notes, triangle_ids)
+                else:
+                    midi_state["last_chord"] = notes.copy()
+                input_state["notes"] = []
+
+        else:
+            unmark_notes(window, canvas, note_name)
+            if note_name in notes:
+                notes.remove(note_name)
+
+
+# Estado de la entrada de un origen: notas tocadas, si forman un acorde, sus tiempos y cómo se toca
+def new_input_state(note_times=None):
+    if note_times is None:
+        note_times = {}
+    return {
+        "notes": [],
+        "chord": False,
+        "note_times": note_times,
+        "timing": tonnetz.onset_stats(MAX_CHORD_INTERVAL),
+    }
+
+
+# Puertos MIDI in que hay que abrir: el seleccionado y los de extra_ports_in
+def midi_in_ports(selected_port_in):
+    ports = []
+    for port in [selected_port_in] + list(config.get("extra_ports_in") or []):
+        if port not in ("no-midi", "No hay puertos MIDI") and port not in ports:
+            ports.append(port)
+    return ports
+
+
+# Callback de un puerto MIDI in de mido, se ejecuta en el hilo del propio puerto
+def queue_midi_in(messages, source, msg):
+    messages.put((time.perf_counter(), source, msg))
+
+
+# Callback de rtmidi, recibe el mensaje con los segundos desde el anterior del puerto
+def queue_rtmidi_in(event, port_clock):
+    import mido
+
+    data, delta_time = event
+    arrival_time = time.perf_counter()
+
+    # rtmidi mide el tiempo al recibir el mensaje, antes de que el callback
+    # consiga el GIL, así que sumando sus deltas tenemos el instante real de
+    # cada mensaje en el reloj del puerto. Lo pasamos a perf_counter con el
+    # menor desfase visto, el del mensaje que menos esperó, y dejamos que
+    # suba poco a poco por si los dos relojes no van a la misma velocidad
+    port_clock["port_time"] += delta_time
+    offset = arrival_time - port_clock["port_time"]
+    if port_clock["offset"] is None or offset < port_clock["offset"]:
+        port_clock["offset"] = offset
+    else:
+        port_clock["offset"] += min(offset - port_clock["offset"],
+                                    delta_time * CLOCK_DRIFT)
+
     try:
-        with mido.open_input(selected_port_in) as port:
-            print(f"Abierto puerto MIDI in: {selected_port_in}")
-            while not threads_control["midi_in_stop_event"].is_set():
-                # Procesamos todos los mensajes pendientes
-                for msg in port.iter_pending():
-                    # La función hasattr nos dice si el mensaje contiene 'note'
-                    if hasattr(msg, "note"):
-                        note_name = convert_midi_to_note(msg.note)
-                    if msg.type == "note_on":
-                        if global_config["moving_triangle"]:
-                            unmark_shapes(window, canvas, selected_port_out)
-                        global_config["last_velocity"] = msg.velocity
-                        if global_config["hold_on"] and chord:
-                            stop_midi(selected_port_out, control=True)
-                            unmark_shapes(window, canvas, selected_port_out)
-                            notes = []
-
-                        chord = detect_chord(window, canvas, note_name,
-                                             triangle_ids)
-                        notes.append(note_name)
-                        mark_notes(canvas, note_name)
-
-                    elif msg.type == "note_off":
-                        if chord:
-                            if len(set(notes)) >= 3:
-                                if not global_config["hold_on"]:
-                                    unmark_triangles(window, canvas, notes,
-                                                     triangle_ids)
-                                    notes = []
-                                else:
-                                    midi_state["last_chord"] = {notes: True}
-                                    notes = []
-
-                        else:
-                            unmark_notes(window, canvas, note_name)
-                            if note_name in notes:
-                                notes.remove(note_name)
-                    else:
-                        continue
-
-                time.sleep(0.001)
-    except OSError as e:
-        print("Error al abrir el puerto MIDI in:", e)
+        msg = mido.Message.from_bytes(data)
+    except ValueError:
+        return
+    port_clock["messages"].put((port_clock["offset"] + port_clock["port_time"],
+                                port_clock["source"], msg))
+
+
+# Abrimos un puerto MIDI in que deja sus mensajes en la cola con su instante de llegada
+# El puerto se abre con mido, así se respeta MIDO_BACKEND y los nombres son
+# los mismos que los de mido.get_input_names() en los desplegables y en
+# config.yml. Si el backend es el de rtmidi cambiamos el callback de su
+# MidiIn por uno que recibe también el tiempo que mide rtmidi.
+def open_midi_in(port_name, messages):
+    import mido
+
+    # Con otros backends no hay instantes del puerto y usamos el de llegada al callback
+    if mido.backend.name != "mido.backends.rtmidi":
+        return mido.open_input(port_name,
+                               callback=functools.partial(
+                                   queue_midi_in, messages, port_name))
+
+    port = mido.open_input(port_name)
+    midi_in = port._rt
+    midi_in.cancel_callback()
+    # Lo que haya llegado mientras abríamos el puerto se queda en la cola de mido
+    for msg in port.iter_pending():
+        queue_midi_in(messages, port_name, msg)
+    midi_in.set_callback(
+        queue_rtmidi_in, {
+            "messages": messages,
+            "source": port_name,
+            "port_time": 0.0,
+            "offset": None,
+        })
+    return port
+
+
+# Todos los puertos dejan sus mensajes en una sola cola con el instante de
+# llegada y el nombre del puerto, así un único hilo espera en la cola en vez
+# de tener un hilo consultando cada puerto. Los mensajes que llegan juntos se
+# ordenan por su instante antes de procesarlos.
+def get_midi_in(window, canvas, selected_port_out, selected_port_in,
+                triangle_ids, stop_event):
+    global threads_control
+    ports_in = midi_in_ports(selected_port_in)
+    tiempo_real.apply_to_thread("midi_in")
+    # Si no hay un puerto MIDI in seleccionado, salimos
+    if not ports_in:
+        print("No hay puerto MIDI in seleccionado.")
+        return
 
+    messages = queue.Queue()
+    # Un estado por puerto si se separan los orígenes, o uno compartido por todos
+    input_states = {}
+    ports = []
+    # Si un puerto no se puede abrir seguimos con los demás
+    for port_name in ports_in:
+        try:
+            ports.append(open_midi_in(port_name, messages))
+            print(f"Abierto puerto MIDI in: {port_name}")
+        except OSError as e:
+            print("Error al abrir el puerto MIDI in:", e)
 
-def get_midi_out(selected_port_out, triangle_ids):
+    try:
+        while ports and not stop_event.is_set():
+            try:
+                batch = [messages.get(timeout=MIDI_IN_WAIT)]
+            except queue.Empty:
+                continue
+            # Recogemos también los mensajes que han llegado mientras tanto
+            while True:
+                try:
+                    batch.append(messages.get_nowait())
+                except queue.Empty:
+                    break
+            batch.sort(key=lambda item: item[0])
+
+            for timestamp, source, msg in batch:
+                # El reloj MIDI va al PLL con el instante en que llegó al puerto
+                if msg.type in ("clock", "start", "continue", "stop"):
+                    reloj.clock_message(msg.type, timestamp)
+                    continue
+                grabador.record("entrada", msg)
+                if config.get("separate_sources"):
+                    input_state = input_states.setdefault(
+                        source, new_input_state())
+                else:
+                    input_state = input_states.setdefault(
+                        None, new_input_state(midi_state["note_times"]))
+                handle_midi_in_message(window, canvas, selected_port_out,
+                                       triangle_ids, msg, input_state,
+                                       timestamp)
+    finally:
+        for port in ports:
+            port.close()
+
+
+# Suena la unión de las notas de todas las formas seleccionadas. El hilo
+# parte de la unión actual y después solo recibe las notas que entran o salen
+# de ella, así no tiene que volver a mirar la selección.
+def get_midi_out(selected_port_out, triangle_ids, stop_event):
     global global_config, midi_state, threads_control
-
-    previous_active_notes = []
+    changes = midi_state["selection_changes"]
     print(f"Abierto puerto MIDI out: {selected_port_out}")
-    while not threads_control["stop_event"].is_set():
-        new_active_notes = []
-
-        # Si no hay figuras seleccionadas, y había notas sonando, mandamos note_off
-        if not midi_state["selected_shapes"]:
-            if previous_active_notes:
-                stop_midi(selected_port_out, control=True)
-                previous_active_notes = []
+
+    # Los cambios anteriores ya están en la unión actual
+    with midi_state["selection_lock"]:
+        while True:
+            try:
+                changes.get_nowait()
+            except queue.Empty:
+                break
+        selected = set(midi_state["note_counts"])
+    sounding = set()
+
+    while not stop_event.is_set():
+        # Con el arpegiador encendido las notas nuevas las toca él
+        if global_config["arpeggiator_active"]:
+            target = sounding & selected
         else:
-            # Si hay triángulos seleccionados, obtenemos el acorde de uno de ellos
-            if any(shape_type == "triangle"
-                   for shape_type in midi_state["selected_shapes"].values()):
-                for shape_id, shape_type in midi_state["selected_shapes"].items(
-                ):
-                    if shape_type == "triangle":
-                        notes = triangle_ids[shape_id]["notes"]
-                        new_active_notes = arpegiador.convert_note_to_midi(
-                            notes)
-                        break
+            target = set(selected)
+        if target != sounding:
+            update_midi_out(selected_port_out, sounding, target)
+            sounding = target
+
+        # La unión se sigue aunque el arpegiador esté encendido, así al
+        # apagarlo vuelve a sonar lo que está seleccionado
+        for note, on in selection_batch(changes):
+            if on:
+                selected.add(note)
             else:
-                # Si solo hay círculos, obtenemos la nota asociada
-                for shape_id, shape_type in midi_state["selected_shapes"].items(
-                ):
-                    if shape_type == "circle":
-                        note = midi_state["circle_ids"][shape_id]["note"]
-                        new_active_notes = arpegiador.convert_note_to_midi(
-                            [note])
-                        break
-
-            # Si el nuevo acorde es diferente del que ya estaba sonando
-            if set(new_active_notes) != set(previous_active_notes):
-                if previous_active_notes:
-                    stop_midi(selected_port_out)
-                midi_state["active_notes"] = new_active_notes
-                if not global_config["arpeggiator_active"]:
-                    play_midi(selected_port_out)
-                previous_active_notes = new_active_notes.copy()
-
-        time.sleep(0.001)
+                selected.discard(note)
+
+    # Antes de dejar el puerto soltamos las notas que siguen sonando en él
+    update_midi_out(selected_port_out, sounding, set())
+
+
+# Cambios de la unión que llegan antes de MIDI_IN_WAIT, juntos, o ninguno
+def selection_batch(changes):
+    try:
+        batch = [changes.get(timeout=MIDI_IN_WAIT)]
+    except queue.Empty:
+        return []
+    # Recogemos también los cambios que han llegado mientras tanto
+    while True:
+        try:
+            batch.append(changes.get_nowait())
+        except queue.Empty:
+            return batch
+
+
+# Soltamos y tocamos solo las notas que cambian entre dos uniones
+def update_midi_out(selected_port_out, sounding, target):
+    global midi_state
+
+    released = sorted(sounding - target)
+    started = sorted(target - sounding)
+    if released:
+        stop_midi(selected_port_out, notes=released)
+    if started:
+        play_midi(selected_port_out, notes=started)
+
+    # Las notas activas son las que suenan, para que stop_midi pueda silenciarlas
+    midi_state["active_notes"] = sorted(target)
 
 
 # Función que se ejecuta después de DURATION
@@ -796,6 +1508,15 @@ def handle_unmark_and_stop_moving(window, canvas, notes, triangle_ids):
 def move_triangles(window, canvas, triangle_ids, shapes_to_update):
     global global_config
 
+    # El motor no conoce los ids de la ventana, le pasamos las notas
+    if engine_running():
+        engine_send("move", [
+            (triangle_ids[old_id]["notes"], triangle_ids[new_id]["notes"])
+            for old_id, new_id in shapes_to_update["triangle"].items()
+        ])
+        return
+
+    moved_notes = []
     # Movemos los triángulos seleccionados
     for old_id, new_id in shapes_to_update["triangle"].items():
         old_notes = triangle_ids[old_id]["notes"]
@@ -806,12 +1527,22 @@ def move_triangles(window, canvas, triangle_ids, shapes_to_update):
 
         # Marcamos el nuevo triángulo y sus notas
         mark_triangles(window, canvas, new_notes, triangle_ids)
-
-        if not global_config["hold_on"]:
-            global_config["moving_triangle"] = True
-            window.after(
-                DURATION, lambda: handle_unmark_and_stop_moving(
-                    window, canvas, new_notes, triangle_ids))
+        moved_notes.append(new_notes)
+
+    if moved_notes and not global_config["hold_on"]:
+        global_config["moving_triangle"] = True
+        # Con la misma clave se cancela el desmarcado de la tecla anterior,
+        # que si no llegaría tarde y desmarcaría la selección nueva
+        temporizador.schedule(
+            DURATION / 1000,
+            lambda: [
+                handle_unmark_and_stop_moving(window, canvas, notes,
+                                              triangle_ids)
+                for notes in moved_notes
+            ],
+            key="navegacion",
+            dispatcher=threads_control["ui_queue"].put,
+        )
 
 
 # Manejamos el movimiento en modo navegación
@@ -827,45 +1558,22 @@ def handle_key(
     selected_triangle_ids = []
 
     # Obtenemos todos los triángulos seleccionados
-    for triangle_id, info in triangle_ids.items():
+    for triangle_id, info in list(triangle_ids.items()):
         if set(info["notes"]) == set(midi_state["last_chord"]):
             selected_triangle_ids.append(triangle_id)
 
     # Manejamos los triángulos
-    if midi_state["last_chord"]:
+    if midi_state["last_chord"] and event.keysym in KEY_MOVES:
         new_triangle_ids = []
         # Obtenemos todos los triángulos seleccionados
         for current_triangle_id in selected_triangle_ids:
+            # La red no tiene bordes, así que siempre hay una celda al lado
+            row, col = triangle_ids[current_triangle_id]["cell"]
+            row_step, col_step = KEY_MOVES[event.keysym]
 
-            # Calcula el nuevo id basándose en la dirección de la tecla
-            if event.keysym == "Left":
-                # Movernos a la izquierda
-                new_triangle_id = (
-                    current_triangle_id -
-                    1) if current_triangle_id > 1 else COLUMNS * ROWS
-
-            elif event.keysym == "Right":
-                # Movernos a la derecha
-                new_triangle_id = (
-                    current_triangle_id +
-                    1) if current_triangle_id < COLUMNS * ROWS else 1
-
-            elif event.keysym == "Up":
-                # Movernos hacia arriba
-                new_triangle_id = (current_triangle_id - COLUMNS if
-                                   (current_triangle_id -
-                                    COLUMNS) >= 1 else current_triangle_id +
-                                   (ROWS - 1) * COLUMNS)
-
-            elif event.keysym == "Down":
-                # Movernos hacia abajo
-                new_triangle_id = (current_triangle_id + COLUMNS if
-                                   (current_triangle_id +
-                                    COLUMNS) <= COLUMNS * ROWS else
-                                   (current_triangle_id - (ROWS - 1) * COLUMNS))
-
-            else:
-                continue
+            # Solo podemos movernos a triángulos dibujados, la vista tiene un margen fuera de la pantalla
+            new_triangle_id = lattice_view["cells"].get(
+                (row + row_step, col + col_step))
 
             if new_triangle_id in triangle_ids and len(
                     set(midi_state["last_chord"])
@@ -881,6 +1589,11 @@ def handle_key(
         if new_triangle_ids:
             midi_state["last_chord"] = triangle_ids[
                 new_triangle_ids[-1]]["notes"]
+            # Desplazamos el diagrama para que el triángulo siga en pantalla
+            scroll_to_cells(window, canvas, [
+                triangle_ids[triangle_id]["cell"]
+                for triangle_id in new_triangle_ids
+            ])
 
 
 # Controlamos los eventos de las flechas del teclado
@@ -900,47 +1613,226 @@ def nav_with_arrow_keys(
     window.bind("<Right>",
                 lambda event: handle_key(window, event, canvas, triangle_ids))
 
-    while not threads_control["nav_stop_event"].is_set():
-        time.sleep(0.001)
+    threads_control["nav_stop_event"].wait()
 
 
 # Función que ejecuta el bucle del arpegiador
-def arpeggiator_loop(selected_port_out, triangle_ids, tempo, compas, octave):
-    global global_config, midi_state, threads_control
-
-    next_note_time = time.perf_counter()
-
-    while not threads_control["arpeggiator_stop_event"].is_set():
-        # Calculamos el tiempo entre notas
-        time_between_notes = arpegiador.calculate_time_between_notes(
-            tempo, compas)
-        # Obtenemos las notas ordenadas del arpegiador
-        notes = arpegiador.get_arpeggio_notes(midi_state["selected_shapes"],
-                                              triangle_ids, compas, octave,
-                                              global_config["arpeggiator_mode"])
+# Las notas las toca el temporizador en su instante exacto, este hilo solo
+# espera a que le pidan parar. Así el arpegiador no gasta CPU esperando y
+# swap_thread sigue pudiendo esperar a que termine. Con el reloj externo o
+# maestro los pasos los programa el reloj en sus pulsos.
+def arpeggiator_loop(selected_port_out, triangle_ids, tempo, compas, octave,
+                     stop_event):
+    global threads_control
+    clock_mode = config.get("clock_mode", "internal")
+    arpeggio = {
+        "target": {  # Acorde y modo que sigue el generador de pasos
+            "notes": (),
+            "octaves": 1,
+            "mode": "up",
+            "params": (),
+        },
+        "step": 0,  # Número del siguiente paso, para el swing y las ligaduras
+        "next_time": time.perf_counter(),  # Instante de la siguiente nota
+        "step_length": 0.5,  # Segundos del último paso, el siguiente se programa con ellos
+        "timer": None,  # Temporizador del siguiente paso
+        "pending": [],  # Temporizadores de note_on y note_off pendientes
+        "sounding": {},  # Nota -> (paso que la tocó, temporizador del note_off o None si está ligada)
+        "lock": threading.RLock(),  # Evita tocar una nota mientras se para, soltar las notas lo vuelve a coger
+        "clocked": clock_mode in ("external", "master"),  # Los pasos los marca el reloj
+    }
+    arpeggio["steps"] = arpegiador.arpeggio_steps(arpeggio["target"])
+    args = (selected_port_out, triangle_ids, tempo, compas, octave, arpeggio,
+            stop_event)
+
+    if arpeggio["clocked"]:
+        step = reloj.set_step_callback(
+            lambda: arpeggiator_step(*args),
+            lambda: reloj.ticks_per_step(compas.get()),
+            lambda: release_arpeggio(selected_port_out, arpeggio),
+        )
+        if clock_mode == "master":
+            reloj.start_master(
+                lambda: 60 / tempo.get() / reloj.PPQN,
+                lambda kind: send_clock(selected_port_out, kind))
+    else:
+        arpeggio["timer"] = temporizador.schedule_at(
+            arpeggio["next_time"], lambda: arpeggiator_step(*args),
+            precise=True)
 
-        if not notes:
-            stop_midi(selected_port_out, control=True)
+    stop_event.wait()
 
-        for note in notes:
-            if threads_control["arpeggiator_stop_event"].is_set():
-                break
+    with arpeggio["lock"]:
+        if arpeggio["clocked"]:
+            reloj.clear_step_callback(step)
+            if clock_mode == "master":
+                reloj.stop_master()
+        else:
+            temporizador.cancel(arpeggio["timer"])
+    # Soltamos la nota que estuviera sonando
+    release_arpeggio(selected_port_out, arpeggio)
 
-            midi_state["active_notes"] = {note: True}
-            # Tocamos la nota
-            play_midi(selected_port_out)
 
-            # Controlamos de tiempo exacto para soltar la nota
-            while time.perf_counter() < next_note_time:
-                pass
+# Elegimos la nota de un paso y programamos su note_on y su note_off
+# El paso cae en la rejilla del tempo o del reloj. El note_on se retrasa
+# según el swing y el note_off se programa aparte según el gate, así cada
+# mensaje sale en su instante y no todos juntos al empezar el paso.
+def arpeggiator_step(selected_port_out, triangle_ids, tempo, compas, octave,
+                     arpeggio, stop_event):
+    global global_config, midi_state
+    with arpeggio["lock"]:
+        if stop_event.is_set():
+            return
 
-            # Soltamos la nota
-            stop_midi(selected_port_out)
+        step_time = time.perf_counter(
+        ) if arpeggio["clocked"] else arpeggio["next_time"]
+        # Si el paso falla el siguiente se programa igual, si no el arpegiador se pararía sin avisar
+        try:
+            arpeggio["step_length"] = arpegiador.calculate_time_between_notes(
+                tempo, compas)
+            play_arpeggio_step(selected_port_out, tempo, compas, octave,
+                               arpeggio, stop_event, step_time)
+        finally:
+            # Con reloj el siguiente paso lo programa el reloj
+            if not arpeggio["clocked"]:
+                # El siguiente instante se suma al anterior, así los retrasos no se acumulan
+                arpeggio["next_time"] = max(
+                    arpeggio["next_time"] + arpeggio["step_length"],
+                    time.perf_counter())
+                args = (selected_port_out, triangle_ids, tempo, compas,
+                        octave, arpeggio, stop_event)
+                arpeggio["timer"] = temporizador.schedule_at(
+                    arpeggio["next_time"],
+                    lambda: arpeggiator_step(*args),
+                    precise=True)
+
+
+# Elegimos las notas de un paso con el acorde actual y programamos sus note_on (con el cerrojo cogido)
+def play_arpeggio_step(selected_port_out, tempo, compas, octave, arpeggio,
+                       stop_event, step_time):
+    # Copiamos la selección con su cerrojo, la ventana y la entrada MIDI la cambian a la vez
+    with midi_state["selection_lock"]:
+        selected_shapes = dict(midi_state["selected_shapes"])
+        shape_notes = dict(midi_state["shape_notes"])
+
+    # En cada paso miramos el acorde, así un cambio se oye en el paso siguiente
+    mode = global_config["arpeggiator_mode"]
+    arpeggio["target"].update(
+        notes=arpegiador.get_arpeggio_notes(selected_shapes, shape_notes,
+                                            compas, mode),
+        octaves=octave.get(),
+        mode=mode,
+        params=pattern_params(),
+    )
+    notes = next(arpeggio["steps"])
 
-            # Actualizamos el tiempo de inicio para la siguiente nota
-            next_note_time += time_between_notes
+    if not arpeggio["target"]["notes"]:
+        release_arpeggio(selected_port_out, arpeggio)
+        return
 
-        time.sleep(0.0001)
+    step = arpeggio["step"]
+    arpeggio["step"] += 1
+    on_time, off_time = arpegiador.step_times(
+        step, step_time, arpeggio["step_length"],
+        config.get("arpeggiator_gate", 0.8),
+        config.get("arpeggiator_swing", 0.0),
+        config.get("arpeggiator_ties", []))
+    # En un rasgueo cada nota sale un poco después de la anterior
+    strum = config.get("arpeggiator_strum", 0.015)
+    for order, note in enumerate(notes):
+        schedule_arpeggio_event(
+            arpeggio, on_time + order * strum,
+            lambda note=note: arpeggio_note_on(selected_port_out, arpeggio,
+                                               note, step, off_time,
+                                               stop_event))
+
+
+# Parámetros de compile_pattern según la configuración: semilla, ritmo euclídeo y pasos del usuario
+def pattern_params():
+    pulses, length = config.get("arpeggiator_euclid", [3, 8])
+    # Los pasos del usuario pasan a tuplas para poder guardar el patrón compilado
+    user_steps = tuple(
+        tuple(step) if isinstance(step, list) else step
+        for step in config.get("arpeggiator_pattern", []))
+    return (config.get("arpeggiator_seed"), pulses, length, user_steps)
+
+
+# Programamos un note_on o note_off del arpegio para poder cancelarlo al parar (con el cerrojo cogido)
+def schedule_arpeggio_event(arpeggio, deadline, callback):
+    # Los temporizadores ya ejecutados quedan marcados como cancelados
+    arpeggio["pending"] = [
+        timer for timer in arpeggio["pending"] if not timer["cancelled"]
+    ]
+    timer = temporizador.schedule_at(deadline, callback, precise=True)
+    arpeggio["pending"].append(timer)
+    return timer
+
+
+# Tocamos una nota del arpegio y soltamos las que estaban ligadas a ella
+def arpeggio_note_on(selected_port_out, arpeggio, note, step, off_time,
+                     stop_event):
+    with arpeggio["lock"]:
+        if stop_event.is_set():
+            return
+
+        # Si la nota ya suena la soltamos antes, así su note_off viejo no corta la nueva
+        if note in arpeggio["sounding"]:
+            release_note(selected_port_out, arpeggio, note)
+        # Las notas del mismo paso (un rasgueo) no se sueltan entre ellas
+        tied = [
+            tied_note for tied_note, (tied_step,
+                                      off_timer) in arpeggio["sounding"].items()
+            if off_timer is None and tied_step != step
+        ]
+
+        play_midi(selected_port_out, source="arpegiador", notes=[note])
+        notify_listeners("step", step, note)
+
+        # Una nota ligada suena hasta que empieza la siguiente
+        for tied_note in tied:
+            release_note(selected_port_out, arpeggio, tied_note)
+
+        off_timer = None
+        if off_time is not None:
+            off_timer = schedule_arpeggio_event(
+                arpeggio, off_time, lambda: arpeggio_note_off(
+                    selected_port_out, arpeggio, note, step))
+        arpeggio["sounding"][note] = (step, off_timer)
+
+
+# Soltamos una nota del arpegio al acabar su gate si no se ha vuelto a tocar
+def arpeggio_note_off(selected_port_out, arpeggio, note, step):
+    with arpeggio["lock"]:
+        if arpeggio["sounding"].get(note, (None, None))[0] == step:
+            release_note(selected_port_out, arpeggio, note)
+
+
+# Enviamos el note_off de una nota del arpegio y cancelamos el programado (con el cerrojo cogido)
+def release_note(selected_port_out, arpeggio, note):
+    _, off_timer = arpeggio["sounding"].pop(note)
+    temporizador.cancel(off_timer)
+    stop_midi(selected_port_out, source="arpegiador", notes=[note])
+
+
+# Cancelamos los note_on pendientes del arpegio y soltamos las notas que suenan
+def release_arpeggio(selected_port_out, arpeggio):
+    with arpeggio["lock"]:
+        for timer in arpeggio["pending"]:
+            temporizador.cancel(timer)
+        arpeggio["pending"] = []
+        for note in list(arpeggio["sounding"]):
+            release_note(selected_port_out, arpeggio, note)
+
+
+# Enviamos un mensaje del reloj maestro una vez a cada puerto de salida
+def send_clock(selected_port_out, kind):
+    import mido
+
+    ports = []
+    for route in output_destinations(selected_port_out, "reloj"):
+        if route[0] not in [port[0] for port in ports]:
+            ports.append(route)
+    enrutador.send(mido.Message(kind), ports)
 
 
 # Función para encender o apagar el arpegiador y habilitar los botones up, sown y random
@@ -988,7 +1880,9 @@ def toggle_arpeggiator(
         global_config["arpeggiator_active"] = False
         global_config["hold_on"] = False
 
-        if threads_control["arpeggiator_stop_event"] is not None:
+        if engine_running():
+            engine_send("arpeggiator_stop")
+        elif threads_control["arpeggiator_stop_event"] is not None:
             threads_control["arpeggiator_stop_event"].set()
 
         # Desmarcar todas las notas al apagar el arpegiador
@@ -1000,8 +1894,12 @@ def toggle_arpeggiator(
         random_button.state(["disabled"])
         start_hold_button.state(["disabled"])
 
-        window.after(DURATION,
-                     lambda: unmark_shapes(window, canvas, selected_port_out))
+        temporizador.schedule(
+            DURATION / 1000,
+            lambda: unmark_shapes(window, canvas, selected_port_out),
+            key="desmarcar",
+            dispatcher=threads_control["ui_queue"].put,
+        )
 
 
 # Función para controlar el modo hold on
@@ -1014,14 +1912,20 @@ def toggle_hold_mode(window, canvas, start_hold_button, selected_port_out):
         start_hold_button.config(text="Hold off")
         # Desmarcar todas las notas al apagar el arpegiador
         stop_midi(selected_port_out, control=True)
-        window.after(DURATION,
-                     lambda: unmark_shapes(window, canvas, selected_port_out))
+        temporizador.schedule(
+            DURATION / 1000,
+            lambda: unmark_shapes(window, canvas, selected_port_out),
+            key="desmarcar",
+            dispatcher=threads_control["ui_queue"].put,
+        )
 
 
 # Función para definir el estado del arpegiador
 def set_arpeggiator_mode(mode):
     if global_config["arpeggiator_active"]:
         global_config["arpeggiator_mode"] = mode
+        if global_config["arpeggiator_mode_var"] is not None:
+            global_config["arpeggiator_mode_var"].set(mode)
         print(f"Modo del arpegiador cambiado a {mode}")
 
 
@@ -1049,35 +1953,61 @@ def start_nav_thread(
     threads_control["nav_thread"] = nav_thread
 
 
+# Sustituimos el hilo de un puerto por uno nuevo sin bloquear la ventana
+# El hilo anterior se detiene y cierra su puerto por su cuenta. El nuevo hilo
+# espera a que termine antes de empezar, así nunca hay dos hilos del mismo
+# tipo cambiando midi_state a la vez y el hilo principal de Tk no tiene que
+# esperar a ninguno. Si se cambia de puerto varias veces seguidas, los hilos
+# intermedios ya están detenidos y no llegan a abrir su puerto.
+def swap_thread(stop_key, thread_key, target, args):
+    global threads_control
+    # Si ya existe un hilo, se le pide detenerse
+    if threads_control[stop_key] is not None:
+        threads_control[stop_key].set()
+    old_thread = threads_control[thread_key]
+
+    # Cada hilo recibe su propio evento de parada
+    stop_event = threading.Event()
+    threads_control[stop_key] = stop_event
+
+    def run():
+        if old_thread is not None:
+            old_thread.join()
+        if not stop_event.is_set():
+            target(*args, stop_event)
+
+    new_thread = threading.Thread(target=run, daemon=True)
+    new_thread.start()
+
+    threads_control[thread_key] = new_thread
+
+
 # Hilo para iniciar el control de puertos MIDI in
 def start_midi_in_thread(window, canvas, selected_port_out, selected_port_in,
                          triangle_ids):
     global midi_state, threads_control
 
+    # Guardamos los argumentos para reabrir el puerto si se reconecta
+    threads_control["midi_in_args"] = (window, canvas, selected_port_out,
+                                       selected_port_in, triangle_ids)
+
     if isinstance(selected_port_in, tk.StringVar):
         selected_port_in = selected_port_in.get()
 
     if selected_port_in == "No hay puertos MIDI":
         selected_port_in = "no-midi"
 
-    # Si ya existe un hilo, se le pide detenerse
-    if threads_control["midi_in_stop_event"] is not None:
-        threads_control["midi_in_stop_event"].set()
-    if threads_control["midi_in_thread"] is not None:
-        # Esperamos un máximo de 2 segundos a que se detenga
-        threads_control["midi_in_thread"].join(timeout=2)
-
-    # Se crea un nuevo evento de parada
-    threads_control["midi_in_stop_event"] = threading.Event()
+    if engine_running():
+        engine_send("midi_in", port_value(selected_port_out), selected_port_in)
+        return
 
     # Se inicia el nuevo hilo con el puerto actualizado
-    midi_in_thread = threading.Thread(target=get_midi_in,
-                                      args=(window, canvas, selected_port_out,
-                                            selected_port_in, triangle_ids),
-                                      daemon=True)
-    midi_in_thread.start()
-
-    threads_control["midi_in_thread"] = midi_in_thread
+    swap_thread(
+        "midi_in_stop_event",
+        "midi_in_thread",
+        get_midi_in,
+        (window, canvas, selected_port_out, selected_port_in, triangle_ids),
+    )
 
 
 # Hilo de ejecución para la detección de notas de MIDI out
@@ -1091,6 +2021,9 @@ def start_midi_out_thread(
     termine la ejecución de la función al cerrar el programa En selected_port
     vamos a poner .get() debido a que se trata de un StringVar esto va a hacer
     que se nos devuelva el valor marcado en el menu de opciones."""
+    # Guardamos los argumentos para reabrir el puerto si se reconecta
+    threads_control["midi_out_args"] = (selected_port_out, triangle_ids)
+
     # Si tiene el método get lo obtenemos
     if isinstance(selected_port_out, tk.StringVar):
         selected_port_out = selected_port_out.get()
@@ -1099,26 +2032,16 @@ def start_midi_out_thread(
     if selected_port_out == "No hay puertos MIDI":
         selected_port_out = "no-midi"
 
-    if threads_control["stop_event"] is not None:
-        threads_control["stop_event"].set()
-    if threads_control["detect_note_thread"] is not None:
-        threads_control["detect_note_thread"].join(timeout=2)
-
-    # Se crea un nuevo evento de parada para el nuevo hilo.
-    threads_control["stop_event"] = threading.Event()
+    if engine_running():
+        engine_send("midi_out", selected_port_out)
+        return
 
-    detect_note_thread = threading.Thread(
-        target=get_midi_out,
-        args=(
-            selected_port_out,
-            triangle_ids,
-        ),
-        daemon=True,
+    swap_thread(
+        "stop_event",
+        "detect_note_thread",
+        get_midi_out,
+        (selected_port_out, triangle_ids),
     )
-    detect_note_thread.start()
-
-    # Guardamos el hilo en el diccionario de control
-    threads_control["detect_note_thread"] = detect_note_thread
 
 
 # Hilo para la ejecución del arpegiador
@@ -1133,23 +2056,48 @@ def start_arpeggiator_thread(selected_port_out, triangle_ids, tempo, compas,
     if selected_port_out == "No hay puertos MIDI":
         selected_port_out = "no-midi"
 
-    # Si ya existe un hilo, se le pide detenerse
-    if threads_control["arpeggiator_stop_event"] is not None:
-        threads_control["arpeggiator_stop_event"].set()
-    if threads_control["arpeggiator_thread"] is not None:
-        threads_control["arpeggiator_thread"].join(timeout=2)
+    # Los hilos no pueden leer las variables de Tk, leen la copia que hace la ventana
+    arpeggiator_params["variables"] = (tempo, compas, octave)
+    update_arpeggiator_params()
 
-    # Crear un nuevo evento de parada
-    threads_control["arpeggiator_stop_event"] = threading.Event()
+    # El motor recibe los valores en sync_engine
+    if engine_running():
+        engine_send("arpeggiator", selected_port_out)
+        return
 
     # Iniciar el nuevo hilo con el tempo actualizado
-    arpeggiator_thread = threading.Thread(target=arpeggiator_loop,
-                                          args=(selected_port_out, triangle_ids,
-                                                tempo, compas, octave),
-                                          daemon=True)
-    arpeggiator_thread.start()
+    swap_thread(
+        "arpeggiator_stop_event",
+        "arpeggiator_thread",
+        arpeggiator_loop,
+        (selected_port_out, triangle_ids) + arpeggiator_values(),
+    )
+
+
+# Copiamos el tempo, el compás y la octava de sus variables (en el hilo de Tk)
+def update_arpeggiator_params():
+    global arpeggiator_params
+
+    variables = arpeggiator_params["variables"]
+    if variables is None:
+        return
+    try:
+        values = dict(
+            zip(("tempo", "compas", "octave"),
+                (variable.get() for variable in variables)))
+    except (tk.TclError, ValueError):
+        # Un tempo a medio escribir no se copia
+        return
+    if values["tempo"] > 0 and values != arpeggiator_params["values"]:
+        arpeggiator_params["values"] = values
 
-    threads_control["arpeggiator_thread"] = arpeggiator_thread
+
+# Tempo, compás y octava con get, como las variables de Tk, pero leídos de la copia
+def arpeggiator_values():
+    return tuple(
+        types.SimpleNamespace(
+            get=lambda name=name: arpeggiator_params["values"][name])
+        for name in ("tempo", "compas", "octave"))
 
 
 # Actualiza en el fichero config el nuevo tamaño
@@ -1257,6 +2205,11 @@ def create_arpeggiator_frame(
 
     octave = choose_octave(arpeggiator_frame)
 
+    choose_clock_mode(arpeggiator_frame, selected_port_out, triangle_ids,
+                      tempo, compas, octave)
+
+    choose_arpeggiator_mode(arpeggiator_frame)
+
     button_arpeggiator(
         button_frame,
         c,
@@ -1507,6 +2460,96 @@ def choose_octave(window):
     return octave
 
 
+# Función para elegir el modo del arpegiador entre todos los patrones
+def choose_arpeggiator_mode(window):
+    mode_frame = tk.Frame(window, bg=window.cget("bg"))
+    mode_frame.pack(side=tk.LEFT, padx=10)
+
+    if global_config["dark_mode"]:
+        label = tk.Label(mode_frame,
+                         text="Patrón:",
+                         bg=window.cget("bg"),
+                         fg="white")
+    else:
+        label = tk.Label(mode_frame, text="Patrón:", bg=window.cget("bg"))
+
+    label.pack(side=tk.LEFT)
+
+    mode = tk.StringVar(window)
+    mode.set(global_config["arpeggiator_mode"])
+    global_config["arpeggiator_mode_var"] = mode
+
+    mode_menu = ttk.Combobox(
+        mode_frame,
+        textvariable=mode,
+        values=arpegiador.ARPEGGIO_MODES,
+        state="readonly",
+        width=9,
+    )
+    mode_menu.pack(side=tk.LEFT, padx=5)
+
+    # A diferencia de los botones, el modo se puede elegir con el arpegiador apagado
+    mode_menu.bind(
+        "<<ComboboxSelected>>",
+        lambda event: (close_combobox(event, window),
+                       global_config.update(arpeggiator_mode=mode.get())))
+
+    return mode
+
+
+# Función para elegir de dónde toma el ritmo el arpegiador
+def choose_clock_mode(window, selected_port_out, triangle_ids, tempo, compas,
+                      octave):
+    clock_frame = tk.Frame(window, bg=window.cget("bg"))
+    clock_frame.pack(side=tk.LEFT, padx=10)
+
+    if global_config["dark_mode"]:
+        label = tk.Label(clock_frame,
+                         text="Reloj:",
+                         bg=window.cget("bg"),
+                         fg="white")
+    else:
+        label = tk.Label(clock_frame, text="Reloj:", bg=window.cget("bg"))
+
+    label.pack(side=tk.LEFT)
+    clock_modes = dict(zip(["interno", "externo", "maestro"],
+                           reloj.CLOCK_MODES))
+
+    clock_mode = tk.StringVar(window)
+    for name, mode in clock_modes.items():
+        if mode == config.get("clock_mode", "internal"):
+            clock_mode.set(name)
+
+    clock_menu = ttk.Combobox(
+        clock_frame,
+        textvariable=clock_mode,
+        values=list(clock_modes),
+        state="readonly",
+        width=7,
+    )
+    clock_menu.pack(side=tk.LEFT, padx=5)
+
+    clock_menu.bind(
+        "<<ComboboxSelected>>",
+        lambda event: (close_combobox(event, window),
+                       update_clock_mode(clock_modes[clock_mode.get()],
+                                         selected_port_out, triangle_ids,
+                                         tempo, compas, octave)))
+
+    return clock_mode
+
+
+# Guardamos el modo de reloj y reiniciamos el arpegiador si está en marcha
+def update_clock_mode(mode, selected_port_out, triangle_ids, tempo, compas,
+                      octave):
+    config["clock_mode"] = mode
+    save_config_file()
+
+    if global_config["arpeggiator_active"]:
+        start_arpeggiator_thread(selected_port_out, triangle_ids, tempo, compas,
+                                 octave)
+
+
 # Obtenemos el botón para la selección del puerto MIDI
 def button_select_midi_in(
     canvas,
@@ -1524,6 +2567,8 @@ def button_select_midi_in(
         state="readonly",
     )
     port_menu.pack(padx=5, pady=5)
+    # Lo guardamos para añadirle los puertos cuando se encuentren
+    global_config["port_in_menu"] = port_menu
     # Botón para seleccionar el puerto elegido
     # Ponemos lambda para que nos permita pasar la función con el argumento
     select_midi_button = ttk.Button(
@@ -1552,6 +2597,8 @@ def button_select_midi_out(
         state="readonly",
     )
     port_menu.pack(padx=5, pady=5)
+    # Lo guardamos para añadirle los puertos cuando se encuentren
+    global_config["port_out_menu"] = port_menu
     # Botón para seleccionar el puerto elegido
     # Ponemos lambda para que nos permita pasar la función con el argumento
     select_midi_button = ttk.Button(
@@ -1567,10 +2614,8 @@ def button_select_midi_out(
 
 # Menu de selección del puerto MIDI
 def midi_in_port_selection(window):
-    midi_in_ports = mido.get_input_names()
-
-    # Si no hay puertos midi mostramos la opción de que no hay puertos
-    midi_in_ports = ["No hay puertos MIDI"] + midi_in_ports
+    # Los puertos se añaden cuando termine de buscarlos enumerate_midi_ports
+    midi_in_ports = ["No hay puertos MIDI"]
 
     # Creamos el menu para las opciones de puertos midi
     selected_port_in = tk.StringVar(window)
@@ -1585,10 +2630,8 @@ def midi_in_port_selection(window):
 
 # Menu de selección del puerto MIDI
 def midi_out_port_selection(window):
-    midi_out_ports = mido.get_output_names()
-
-    # Si no hay puertos midi mostramos la opción de que no hay puertos
-    midi_out_ports = ["No hay puertos MIDI"] + midi_out_ports
+    # Los puertos se añaden cuando termine de buscarlos enumerate_midi_ports
+    midi_out_ports = ["No hay puertos MIDI"]
 
     # Creamos el menu para las opciones de puertos MIDI
     selected_port_out = tk.StringVar(window)
@@ -1615,6 +2658,331 @@ def get_midi_ports(window, selected_port_in_from_config,
     return selected_port_in, selected_port_out, midi_ports_in, midi_ports_out
 
 
+# Vigilamos en segundo plano los puertos MIDI para detectar cuándo se conectan o desconectan
+def monitor_midi_ports(midi_ports_in, midi_ports_out):
+    global threads_control
+
+    previous_inputs = None
+    previous_outputs = None
+    failed = False
+    stop_event = threads_control["ports_stop_event"]
+
+    while not stop_event.is_set():
+        try:
+            import mido
+
+            inputs = mido.get_input_names()
+            outputs = mido.get_output_names()
+        except (ImportError, OSError) as e:
+            # Un fallo al listar puede ser pasajero, lo volvemos a intentar en la siguiente búsqueda
+            if not failed:
+                print("Error al buscar los puertos MIDI:", e)
+            failed = True
+            stop_event.wait(port_scan_interval())
+            continue
+        failed = False
+
+        # La primera búsqueda forma parte del arranque
+        if previous_inputs is None:
+            mark_startup("Puertos MIDI")
+            print("Puertos MIDI encontrados en {:.0f} ms".format(
+                startup_times["Puertos MIDI"]))
+
+        # Solo molestamos al hilo principal si algo ha cambiado
+        if inputs != previous_inputs or outputs != previous_outputs:
+            # Tk solo se puede tocar desde el hilo principal
+            threads_control["ui_queue"].put(
+                lambda inputs=inputs, outputs=outputs: fill_midi_ports(
+                    midi_ports_in, midi_ports_out, inputs, outputs))
+
+            if previous_inputs is not None:
+                if any([
+                        port_reappeared(port, previous_inputs, inputs)
+                        for port in midi_in_ports(config["port_in"])
+                ]):
+                    threads_control["ui_queue"].put(reopen_midi_in)
+                if port_reappeared(config["port_out"], previous_outputs,
+                                   outputs):
+                    threads_control["ui_queue"].put(reopen_midi_out)
+
+            previous_inputs = inputs
+            previous_outputs = outputs
+
+        # Esperamos sin gastar CPU hasta la siguiente búsqueda
+        stop_event.wait(port_scan_interval())
+
+
+# Segundos entre dos búsquedas de puertos MIDI
+def port_scan_interval():
+    return float(config.get("port_scan_interval", 2.0))
+
+
+# Comprobamos si el puerto configurado acaba de volver a conectarse
+def port_reappeared(port, previous_ports, ports):
+    if port == "no-midi":
+        return False
+    if port in previous_ports and port not in ports:
+        print("Se ha desconectado el puerto MIDI:", port)
+    return port not in previous_ports and port in ports
+
+
+# Volvemos a abrir el puerto de entrada configurado
+def reopen_midi_in():
+    if threads_control["midi_in_args"] is not None:
+        print("Reabriendo los puertos MIDI in:",
+              ", ".join(midi_in_ports(config["port_in"])))
+        start_midi_in_thread(*threads_control["midi_in_args"])
+
+
+# Volvemos a abrir el puerto de salida configurado
+def reopen_midi_out():
+    if threads_control["midi_out_args"] is not None:
+        print("Reabriendo el puerto MIDI out:", config["port_out"])
+        start_midi_out_thread(*threads_control["midi_out_args"])
+
+
+# Rellenamos las listas de puertos y los desplegables que estén abiertos
+def fill_midi_ports(midi_ports_in, midi_ports_out, inputs, outputs):
+    global global_config
+
+    # Si no hay puertos midi mostramos la opción de que no hay puertos
+    midi_ports_in[:] = ["No hay puertos MIDI"] + inputs
+    midi_ports_out[:] = ["No hay puertos MIDI"] + outputs
+
+    for menu_key, ports in (("port_in_menu", midi_ports_in),
+                            ("port_out_menu", midi_ports_out)):
+        port_menu = global_config[menu_key]
+        if port_menu is not None and port_menu.winfo_exists():
+            port_menu.config(values=ports)
+
+
+# Hilo que vigila los puertos MIDI sin bloquear la ventana
+def start_ports_thread(midi_ports_in, midi_ports_out):
+    global threads_control
+
+    threads_control["ports_stop_event"] = threading.Event()
+
+    ports_thread = threading.Thread(target=monitor_midi_ports,
+                                    args=(midi_ports_in, midi_ports_out),
+                                    daemon=True)
+    ports_thread.start()
+
+    threads_control["ports_thread"] = ports_thread
+
+
+# Ejecutamos en el hilo principal las funciones que han mandado otros hilos
+def process_ui_queue(window):
+    try:
+        run_ui_callbacks()
+        # Lo que ha pasado en esta vuelta sale en un solo bundle OSC
+        emisor.flush()
+        update_arpeggiator_params()
+
+        # Pintamos lo que ha cambiado en el motor y le mandamos lo que ha cambiado aquí
+        if engine_running():
+            paint_engine_updates()
+            sync_engine()
+    except Exception as e:
+        print("Error al atender la cola de la ventana:", e)
+    finally:
+        # Aunque algo falle la cola se sigue atendiendo
+        window.after(UI_QUEUE_INTERVAL, lambda: process_ui_queue(window))
+
+
+# Ejecutamos las funciones que otros hilos han dejado en la cola del hilo principal
+def run_ui_callbacks():
+    while True:
+        try:
+            callback = threads_control["ui_queue"].get_nowait()
+        except queue.Empty:
+            break
+        # Un error en una función, como un TclError tras rehacer el canvas, no para las demás
+        try:
+            callback()
+        except Exception as e:
+            print("Error en una función de la cola de la ventana:", e)
+
+
+# Publicamos el estado de la red para visualizadores externos si state_export lo pide
+def start_state_export():
+    if not config.get("state_export", False):
+        return
+    if exportador.open_export(config.get("state_export_path")):
+        if exportador.lattice_event not in midi_state["listeners"]:
+            midi_state["listeners"].append(exportador.lattice_event)
+
+
+# Enviamos los eventos de la red por OSC si osc_output lo pide
+def start_osc_output():
+    if not config.get("osc_output", False):
+        return
+    if emisor.open_output(config.get("osc_host", emisor.OSC_HOST),
+                          config.get("osc_port", emisor.OSC_PORT)):
+        if emisor.lattice_event not in midi_state["listeners"]:
+            midi_state["listeners"].append(emisor.lattice_event)
+
+
+# Nombre del puerto, ya venga como texto o en la variable del desplegable
+def port_value(selected_port):
+    if isinstance(selected_port, tk.StringVar):
+        return selected_port.get()
+    return selected_port
+
+
+# Arrancamos el motor MIDI en otro proceso si la configuración lo pide
+# Se usa spawn y no fork para que el motor no herede Tk ni los hilos de la
+# ventana. Si el motor ya está en marcha solo le pasamos la red, que puede
+# haber cambiado con el canvas.
+def start_engine(window, canvas):
+    global engine_state
+    import multiprocessing
+
+    if not config.get("engine_process", False):
+        return
+
+    if not engine_running():
+        context = multiprocessing.get_context("spawn")
+        ring = anillo.create_ring()
+        connection, engine_connection = context.Pipe()
+        process = context.Process(target=motor.run_engine,
+                                  args=(anillo.ring_name(ring),
+                                        engine_connection, dict(config)),
+                                  daemon=True)
+        process.start()
+        engine_state.update({
+            "process": process,
+            "connection": connection,
+            "ring": ring,
+            "synced": {},
+        })
+
+    engine_state["window"] = window
+    engine_state["canvas"] = canvas
+    # Los dos procesos sacan la misma red virtual de la afinación
+    triangle_ids, _ = motor.virtual_lattice(lattice_view["tuning"])
+    engine_state["triangles"] = {
+        triangle_id: info["notes"]
+        for triangle_id, info in triangle_ids.items()
+    }
+    engine_state["fills"] = {}
+    engine_send("lattice", lattice_view["tuning"])
+
+
+# Indicamos si el MIDI se está ejecutando en el proceso del motor
+def engine_running():
+    return engine_state["process"] is not None
+
+
+# Mandamos una operación al motor, después de ponerle al día
+def engine_send(operation, *args):
+    sync_engine()
+    send_to_engine(operation, args)
+
+
+# Escribimos una operación en el canal de control del motor
+def send_to_engine(operation, args):
+    try:
+        engine_state["connection"].send((operation, args))
+    except OSError as e:
+        print("Error al comunicar con el motor MIDI:", e)
+
+
+# Mandamos al motor la configuración, el estado y los parámetros que han cambiado
+def sync_engine():
+    state = {
+        "config": dict(config),
+        "global": {key: global_config[key] for key in ENGINE_FLAGS},
+    }
+    if arpeggiator_params["variables"] is not None:
+        state["params"] = arpeggiator_params["values"]
+
+    for operation, values in state.items():
+        if engine_state["synced"].get(operation) != values:
+            engine_state["synced"][operation] = values
+            send_to_engine(operation, (values,))
+
+
+# Pintamos en el canvas los colores que ha dejado el motor en el anillo
+def paint_engine_updates():
+    global engine_state, midi_state
+
+    window = engine_state["window"]
+    canvas = engine_state["canvas"]
+    for _, kind, color, shape, _ in anillo.pop_all(engine_state["ring"]):
+        fill = motor.FILL_COLORS[color]
+        if kind == motor.TRIANGLE_RECORD:
+            notes = engine_state["triangles"].get(shape)
+            if notes is None:
+                continue
+            key = ("triangle", frozenset(notes))
+            # Todos los triángulos dibujados con ese acorde
+            shape_ids = [
+                triangle_id
+                for triangle_id, info in lattice_view["triangle_ids"].items()
+                if frozenset(info["notes"]) == key[1]
+            ]
+            # Las flechas mueven el último acorde marcado
+            if fill == "#7699d4":
+                midi_state["last_chord"] = notes
+        elif kind == motor.CIRCLE_RECORD:
+            key = ("circle", tonnetz.NOTE_NAMES[shape])
+            shape_ids = [
+                circle_id
+                for circle_id, info in midi_state["circle_ids"].items()
+                if info["note"] == key[1]
+            ]
+        else:
+            continue
+
+        # Guardamos el color para las figuras que aparezcan al desplazarse
+        if fill == "bg":
+            engine_state["fills"].pop(key, None)
+            fill = window.cget("bg")
+        else:
+            engine_state["fills"][key] = fill
+        try:
+            for shape_id in shape_ids:
+                canvas.itemconfig(shape_id, fill=fill)
+        except tk.TclError:
+            pass
+
+
+# Paramos el motor y esperamos a que suelte sus notas
+def stop_engine():
+    global engine_state
+
+    if not engine_running():
+        return
+
+    send_to_engine("exit", ())
+    engine_state["process"].join(ENGINE_EXIT_WAIT)
+    if engine_state["process"].is_alive():
+        print("El motor MIDI no ha terminado, lo paramos")
+        engine_state["process"].terminate()
+    anillo.close_ring(engine_state["ring"], unlink=True)
+    engine_state.update({"process": None, "connection": None, "ring": None})
+
+
+# Guardamos cuánto ha tardado en llegar el arranque a una etapa
+def mark_startup(stage):
+    startup_times[stage] = (time.perf_counter() - START_TIME) * 1000
+
+
+# Mostramos el informe de tiempos de arranque
+def report_startup(window):
+    # Forzamos el dibujado pendiente para medir cuándo se ve la ventana
+    window.update_idletasks()
+    mark_startup("Primer dibujado")
+
+    print("Tiempos de arranque:")
+    for stage, elapsed in startup_times.items():
+        print("  {}: {:.0f} ms".format(stage, elapsed))
+
+    if startup_times["Primer dibujado"] > FIRST_PAINT_TARGET:
+        print("El primer dibujado ha superado los {} ms".format(
+            FIRST_PAINT_TARGET))
+
+
 # Obtenemos el botón para seleccionar el tamaño de la ventana
 def button_size_factor(
     window,
@@ -1855,7 +3223,6 @@ def audio_settings(
     label_size_selection.pack(pady=5)
 
     # Botón para seleccionar el puerto de entrada
-    midi_in_port_selection(window)
     button_select_midi_in(
         c,
         window,
@@ -1885,7 +3252,6 @@ def audio_settings(
     label_size_selection.pack(pady=5)
 
     # Botón para seleccionar el puerto de salida
-    midi_out_port_selection(window)
     button_select_midi_out(scrollable_frame, selected_port_out, midi_ports_out,
                            triangle_ids)
 
@@ -1906,10 +3272,216 @@ def screen_position(window, screen_window, size_factor):
     screen_window.geometry(f"{config_width}x{config_height}+{x}+{y}")
 
 
+# Abrimos un fichero MIDI para reproducirlo sobre el diagrama
+def open_midi_file(window, canvas, selected_port_out, triangle_ids):
+    from tkinter import filedialog
+
+    path = filedialog.askopenfilename(
+        parent=window,
+        title="Abrir fichero MIDI",
+        filetypes=[("Ficheros MIDI", "*.mid *.midi")],
+    )
+    if not path:
+        return
+
+    try:
+        reproductor.load_midi_file(path)
+    except (OSError, EOFError, KeyError, ValueError) as e:
+        print("Error al abrir el fichero MIDI:", e)
+        return
+
+    # Las notas del fichero pasan por lo mismo que las del puerto MIDI in
+    input_state = new_input_state(midi_state["note_times"])
+    reproductor.start_player(lambda msg: handle_midi_in_message(
+        window, canvas, selected_port_out, triangle_ids, msg, input_state))
+
+    playback_controls(window, os.path.basename(path))
+
+
+# Ventana con los controles de reproducción
+def playback_controls(window, title):
+    global global_config
+
+    # Si ya existe una ventana de reproducción la cerramos
+    existing_window = global_config.get("player_window")
+    if existing_window is not None and existing_window.winfo_exists():
+        existing_window.destroy()
+
+    player_window = tk.Toplevel(window, bg=window.cget("bg"))
+    player_window.title("Reproducción: " + title)
+    global_config["player_window"] = player_window
+
+    # Al cerrar la ventana paramos la reproducción
+    player_window.protocol(
+        "WM_DELETE_WINDOW",
+        lambda: (reproductor.stop_player(), player_window.destroy()),
+    )
+
+    buttons_frame = tk.Frame(player_window, bg=window.cget("bg"))
+    buttons_frame.pack(padx=10, pady=5)
+
+    play_button = ttk.Button(buttons_frame,
+                             text="Reproducir",
+                             command=reproductor.play)
+    play_button.pack(side=tk.LEFT, padx=5)
+
+    pause_button = ttk.Button(buttons_frame,
+                              text="Pausa",
+                              command=reproductor.pause)
+    pause_button.pack(side=tk.LEFT, padx=5)
+
+    # Desplegable para la velocidad
+    speed = tk.StringVar(player_window)
+    speed.set(reproductor.player["speed"])
+    speed_menu = ttk.Combobox(
+        buttons_frame,
+        textvariable=speed,
+        values=reproductor.SPEEDS,
+        state="readonly",
+        width=5,
+    )
+    speed_menu.pack(side=tk.LEFT, padx=5)
+    speed_menu.bind(
+        "<<ComboboxSelected>>",
+        lambda event: (reproductor.set_speed(speed.get()),
+                       close_combobox(event, player_window)),
+    )
+
+    # Barra para saltar a un punto de la canción
+    position = tk.DoubleVar(player_window)
+    seeking = {"active": False}
+    position_scale = ttk.Scale(
+        player_window,
+        from_=0,
+        to=max(reproductor.player["length"], 0.001),
+        variable=position,
+        orient="horizontal",
+        length=400,
+    )
+    position_scale.pack(padx=10, pady=5)
+    position_scale.bind("<ButtonPress-1>",
+                        lambda event: seeking.update(active=True))
+    position_scale.bind(
+        "<ButtonRelease-1>",
+        lambda event: (reproductor.seek(position.get()),
+                       seeking.update(active=False)),
+    )
+
+    if global_config["dark_mode"]:
+        time_label = tk.Label(player_window, bg=window.cget("bg"), fg="white")
+    else:
+        time_label = tk.Label(player_window, bg=window.cget("bg"))
+    time_label.pack(pady=5)
+
+    update_playback_position(player_window, position, time_label, seeking)
+
+
+# Actualizamos la barra y el tiempo de la reproducción
+def update_playback_position(player_window, position, time_label, seeking):
+    if not player_window.winfo_exists():
+        return
+
+    song_time = reproductor.current_song_time()
+    # Mientras se arrastra la barra no la movemos
+    if not seeking["active"]:
+        position.set(song_time)
+    time_label.config(text="{:.1f} / {:.1f} s".format(
+        song_time, reproductor.player["length"]))
+
+    player_window.after(
+        200, lambda: update_playback_position(player_window, position,
+                                              time_label, seeking))
+
+
+# Ventana con los contadores de las colas de los puertos de salida
+def output_stats(window):
+    global global_config
+
+    # Si ya existe la ventana la traemos delante
+    existing_window = global_config.get("stats_window")
+    if existing_window is not None and existing_window.winfo_exists():
+        existing_window.lift()
+        return
+
+    stats_window = tk.Toplevel(window, bg=window.cget("bg"))
+    stats_window.title("Salida MIDI")
+    global_config["stats_window"] = stats_window
+
+    if global_config["dark_mode"]:
+        stats_label = tk.Label(stats_window,
+                               bg=window.cget("bg"),
+                               fg="white",
+                               justify=tk.LEFT,
+                               font=("Courier", 10))
+    else:
+        stats_label = tk.Label(stats_window,
+                               bg=window.cget("bg"),
+                               justify=tk.LEFT,
+                               font=("Courier", 10))
+    stats_label.pack(padx=10, pady=10)
+
+    update_output_stats(stats_window, stats_label)
+
+
+# Actualizamos los contadores de las colas de salida
+def update_output_stats(stats_window, stats_label):
+    if not stats_window.winfo_exists():
+        return
+
+    lines = []
+    for port_name, stats in enrutador.router_stats().items():
+        lines.append(port_name)
+        lines.append(
+            "  enviados {sent}  descartados {dropped}  juntados {coalesced}".
+            format(**stats))
+        lines.append(
+            "  cola {depth} (máx. {max_depth})  espera máx. {wait:.1f} ms".
+            format(wait=stats["max_wait"] * 1000, **stats))
+    # Planificación que tienen de verdad los hilos MIDI
+    applied, memory = tiempo_real.realtime_report()
+    if applied:
+        lines.append("")
+        for name, scheduling in applied.items():
+            lines.append("{}: {}".format(name, scheduling))
+        lines.append("Memoria: " + memory)
+    stats_label.config(text="\n".join(lines) or "No se ha enviado nada")
+
+    stats_window.after(500,
+                       lambda: update_output_stats(stats_window, stats_label))
+
+
+# Empezamos o terminamos la grabación de la sesión MIDI
+def toggle_recording(filemenu, recording_index):
+    # Con el motor en otro proceso los mensajes pasan por él y es él quien graba
+    if engine_running():
+        engine_state["recording"] = not engine_state["recording"]
+        engine_send("recording", engine_state["recording"])
+        filemenu.entryconfig(
+            recording_index,
+            label="Detener grabación"
+            if engine_state["recording"] else "Empezar grabación")
+    elif grabador.recorder["active"]:
+        grabador.stop_recording()
+        filemenu.entryconfig(recording_index, label="Empezar grabación")
+    else:
+        grabador.start_recording()
+        filemenu.entryconfig(recording_index, label="Detener grabación")
+
+
 # Función para cerrar el programa
 def exit_program(window, selected_port_out):
     # Paramos el MIDI
     stop_midi(selected_port_out)
+    # El motor suelta sus notas y cierra sus puertos antes de terminar
+    stop_engine()
+    # Esperamos a que los puertos de salida envíen lo que tengan pendiente
+    enrutador.stop_router()
+    # Cerramos los ficheros de la grabación si había una en curso
+    grabador.stop_recording(wait=True)
+    exportador.close_export()
+    emisor.close_output()
+    # Guardamos ya los cambios que estuvieran esperando
+    write_config_file()
     # Cerramos la ventana
     window.quit()
 
@@ -1952,31 +3524,41 @@ def menu(
             triangle_ids,
         ),
     )
+    filemenu.add_command(
+        label="Reproducir fichero MIDI",
+        command=lambda: open_midi_file(window, c, selected_port_out,
+                                       triangle_ids),
+    )
+    filemenu.add_command(
+        label="Estado de la salida MIDI",
+        command=lambda: output_stats(window),
+    )
+    filemenu.add_command(
+        label="Empezar grabación",
+        command=lambda: toggle_recording(filemenu, recording_index),
+    )
+    # Guardamos la posición de la opción para poder cambiarle el texto
+    recording_index = filemenu.index("end")
     filemenu.add_separator()
     filemenu.add_command(
         label="Salir", command=lambda: exit_program(window, selected_port_out))
     menubar.add_cascade(label="Opciones", menu=filemenu)
 
 
-# Función para pintar el rectángulo
-def paint_rectangle(circle_coords):
-    # Obtener las coordenadas extremas de los triángulos
-    min_x = float("inf")
-    max_x = float("-inf")
-    min_y = float("inf")
-    max_y = float("-inf")
+# Función para pintar el rectángulo que rodea el diagrama
+def paint_rectangle(c):
+    global lattice_view
 
-    # Obtenemos las coordenadas mínimas para representar el rectángulo
-    for triangle_coords in circle_coords:
-        for x, y in triangle_coords:
-            min_x = min(min_x, x)
-            max_x = max(max_x, x)
-            min_y = min(min_y, y)
-            max_y = max(max_y, y)
+    # La red no tiene bordes, así que el rectángulo enmarca la parte que se ve
+    width, height = canvas_size(c)
+    rectangle_coords = (2, 2, width - 2, height - 2)
 
-    # Pintamos el rectángulo
-    rectangle_coords = (min_x, min_y, max_x, max_y)
+    # Si ya existe solo lo movemos
+    if lattice_view["rectangle"] is not None:
+        c.coords(lattice_view["rectangle"], *rectangle_coords)
+        return
 
+    # Pintamos el rectángulo
     if global_config["dark_mode"]:
         rectangle = c.create_rectangle(rectangle_coords,
                                        width=4,
@@ -1987,6 +3569,7 @@ def paint_rectangle(circle_coords):
                                        outline="black")
 
     c.lower(rectangle)
+    lattice_view["rectangle"] = rectangle
 
 
 # Crea la ventana del programa
@@ -2027,11 +3610,9 @@ def create_canvas(
         c.pack(fill=tk.BOTH, expand=True)
 
         # Creamos los triángulos
-        (
-            painted_coords,
-            triangle_ids,
-            circle_coords,
-        ) = triangles(window, c, size_factor)
+        triangle_ids = triangles(window, c, size_factor)
+        # Con engine_process el MIDI va en otro proceso que pinta en este canvas
+        start_engine(window, c)
 
         start_nav_thread(
             window,
@@ -2056,7 +3637,7 @@ def create_canvas(
             triangle_ids,
         )
 
-        paint_rectangle(circle_coords)
+        paint_rectangle(c)
 
     except TclError:
         pass
@@ -2116,7 +3697,13 @@ def main():
 
     # Cargamos el fichero configuración y el puerto
     load_config_file()
+    tiempo_real.configure(config)
+    # Con el motor en otro proceso es él quien publica el estado y los eventos
+    if not config.get("engine_process", False):
+        start_state_export()
+        start_osc_output()
     selected_ports = load_config_port()
+    mark_startup("Configuración")
 
     selected_port_in_from_config = selected_ports["port_in"]
     selected_port_out_from_config = selected_ports["port_out"]
@@ -2126,6 +3713,7 @@ def main():
     # Creamos la ventana y le ponemos un título
     window = tk.Tk()
     window.title("Diagrama de Tonnetz")
+    mark_startup("Ventana")
 
     selected_port_in, selected_port_out, midi_ports_in, midi_ports_out = (
         get_midi_ports(window, selected_port_in_from_config,
@@ -2151,9 +3739,18 @@ def main():
         midi_ports_in,
         midi_ports_out,
     )
+    mark_startup("Diagrama")
+
+    # Atendemos la cola del hilo principal y buscamos los puertos en segundo plano
+    process_ui_queue(window)
+    start_ports_thread(midi_ports_in, midi_ports_out)
+
+    # Cuando empiece el bucle de Tk medimos el primer dibujado
+    window.after(0, lambda: report_startup(window))
 
     # Muestra la ventana
     window.mainloop()
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import time
+import types
+import anillo
+import emisor
+import exportador
+import grabador
+import tonnetz
+"""
+Motor MIDI en un proceso aparte de la ventana (engine_process en
+config.yml). La entrada y la salida MIDI, la detección de acordes y el
+arpegiador se ejecutan aquí con las mismas funciones de main, así que no
+compiten por el GIL con los redibujados de Tk: aunque la ventana se quede
+parada 100 ms al cambiar de tamaño, el temporizador del motor sigue tocando
+a tiempo.
+
+- La ventana manda lo que se hace en ella (clics, flechas, puertos, el
+  arpegiador y sus parámetros) por un canal de control (multiprocessing.Pipe)
+- El motor deja en un anillo de memoria compartida (anillo.py) los colores
+  de las figuras y los pasos del arpegiador, y la ventana los pinta al
+  atender su cola
+
+La ventana dibuja solo las figuras que se ven y las reutiliza al desplazarse,
+así que sus ids no sirven aquí. El motor trabaja con una red virtual con un
+triángulo por acorde y un círculo por nota, y la ventana pinta todas las
+figuras con ese acorde o esa nota.
+"""
+
+FILL_COLORS = ("bg", "#7699d4", "#fcc035", "grey")  # Colores que pide el motor, bg es el fondo de la ventana
+TRIANGLE_RECORD = 0  # Tipos de registro del anillo: color de un triángulo,
+CIRCLE_RECORD = 1  # color de un círculo
+STEP_RECORD = 2  # y nota de un paso del arpegiador
+CIRCLE_OFFSET = 1000  # Ids de los círculos virtuales, uno por clase de altura
+ENGINE_THREADS = (  # Hilos del motor que se paran al salir
+    ("arpeggiator_stop_event", "arpeggiator_thread"),
+    ("midi_in_stop_event", "midi_in_thread"),
+    ("stop_event", "detect_note_thread"),
+)
+THREAD_EXIT_WAIT = 2.0  # Segundos que se espera a que cada hilo suelte sus notas
+
+
+# Red virtual del motor: un triángulo por acorde de la red y un círculo por nota
+def virtual_lattice(tuning):
+    """Los dos procesos la sacan de la misma afinación, así que un id
+    virtual significa lo mismo en los dos. Las notas de cada triángulo van
+    en el orden de sus vértices, como en la ventana. Las notas que no salen
+    en la red no tienen círculo, como en la ventana."""
+    table = tonnetz.triangle_table(**tuning)
+    triangle_ids = {}
+    for index, cell in enumerate(sorted(table.values())):
+        triangle_ids[index + 1] = {
+            "cell": cell,
+            "notes": tonnetz.triangle_notes(*cell, **tuning),
+        }
+
+    # Cada círculo va en el primer vértice de su nota, que es su clave en la selección
+    grid = tonnetz.generate_lattice(12, 24, **tuning)
+    vertices = {}
+    for row in range(12):
+        for col in range(24):
+            if grid[row][col] is not None:
+                vertices.setdefault(grid[row][col], (row, col))
+
+    circle_ids = {
+        CIRCLE_OFFSET + pitch_class: {
+            "vertex": vertex,
+            "note": tonnetz.NOTE_NAMES[pitch_class],
+            "text_id": None,
+        }
+        for pitch_class, vertex in sorted(vertices.items())
+    }
+    return triangle_ids, circle_ids
+
+
+# Dejamos en el anillo el color que main quiere dar a una figura virtual
+def paint(ring, shape_id, fill):
+    if fill not in FILL_COLORS:
+        return
+    if shape_id >= CIRCLE_OFFSET:
+        anillo.push(ring, time.perf_counter(), CIRCLE_RECORD,
+                    FILL_COLORS.index(fill), shape_id - CIRCLE_OFFSET)
+    else:
+        anillo.push(ring, time.perf_counter(), TRIANGLE_RECORD,
+                    FILL_COLORS.index(fill), shape_id)
+
+
+# Dejamos en el anillo los avisos de main que interesan a la ventana
+def publish(ring, kind, values):
+    if kind == "step":
+        step, note = values
+        anillo.push(ring, time.perf_counter(), STEP_RECORD, 0, step % 65536,
+                    note)
+
+
+# Cambiamos la red virtual del motor a una afinación nueva
+def set_lattice(engine, tuning):
+    import main
+
+    # Los hilos guardan el diccionario de triángulos, así que se cambia sin sustituirlo
+    main.clear_selected_shapes()
+    triangle_ids, circle_ids = virtual_lattice(tuning)
+    engine["triangle_ids"].clear()
+    engine["triangle_ids"].update(triangle_ids)
+    main.midi_state["circle_ids"].clear()
+    main.midi_state["circle_ids"].update(circle_ids)
+    main.midi_state["last_chord"] = {}
+    main.lattice_view["tuning"] = tuning
+    main.lattice_view["chord_table"] = tonnetz.triangle_table(**tuning)
+
+
+# Procesamos en el motor un mensaje que llega de un fichero que suena en la ventana
+def play_message(engine, window, canvas, selected_port_out, data):
+    import main
+    import mido
+
+    try:
+        msg = mido.Message.from_bytes(data)
+    except ValueError:
+        return
+    main.handle_midi_in_message(window, canvas, selected_port_out,
+                                engine["triangle_ids"], msg,
+                                engine["input_state"])
+
+
+# Movemos en la red virtual los triángulos que la ventana ha movido con las flechas
+def move_chords(engine, window, canvas, moves):
+    import main
+
+    chord_ids = {
+        frozenset(info["notes"]): triangle_id
+        for triangle_id, info in engine["triangle_ids"].items()
+    }
+    shapes_to_update = {"triangle": {}, "circle": {}}
+    for old_notes, new_notes in moves:
+        old_id = chord_ids.get(frozenset(old_notes))
+        new_id = chord_ids.get(frozenset(new_notes))
+        if old_id is not None and new_id is not None:
+            shapes_to_update["triangle"][old_id] = new_id
+    main.move_triangles(window, canvas, engine["triangle_ids"],
+                        shapes_to_update)
+
+
+# Paramos un hilo del motor
+def stop_thread(stop_key):
+    import main
+
+    if main.threads_control[stop_key] is not None:
+        main.threads_control[stop_key].set()
+
+
+# Empezamos o terminamos la grabación en el motor, que es por donde pasan los mensajes
+def set_recording(active):
+    if active:
+        grabador.start_recording()
+    else:
+        grabador.stop_recording()
+
+
+# Operaciones que la ventana puede pedir al motor por el canal de control
+def engine_operations(engine, window, canvas):
+    import main
+
+    triangle_ids = engine["triangle_ids"]
+    return {
+        "config": main.config.update,
+        "global": main.global_config.update,
+        "params": lambda values: main.arpeggiator_params.update(
+            values=values),
+        "lattice": lambda tuning: set_lattice(engine, tuning),
+        "midi_in": lambda port_out, port_in: main.start_midi_in_thread(
+            window, canvas, port_out, port_in, triangle_ids),
+        "midi_out": lambda port_out: main.start_midi_out_thread(
+            port_out, triangle_ids),
+        "arpeggiator": lambda port_out: main.start_arpeggiator_thread(
+            port_out, triangle_ids, *main.arpeggiator_values()),
+        "arpeggiator_stop": lambda: stop_thread("arpeggiator_stop_event"),
+        "message": lambda port_out, data: play_message(
+            engine, window, canvas, port_out, data),
+        "triangle_click": lambda notes: main.handle_triangle_click(
+            window, canvas, notes, triangle_ids),
+        "triangle_unclick": lambda notes: main.handle_triangle_unclick(
+            window, canvas, notes, triangle_ids),
+        "note_click": lambda note: main.mark_notes(canvas, note),
+        "note_unclick": lambda note: main.unmark_notes(window, canvas, note),
+        "move": lambda moves: move_chords(engine, window, canvas, moves),
+        "unmark": lambda port_out: main.unmark_shapes(window, canvas,
+                                                      port_out),
+        "stop_midi":
+        lambda port_out, control, source, notes: main.stop_midi(
+            port_out, control=control, source=source, notes=notes),
+        "recording": set_recording,
+    }
+
+
+# Bucle del proceso del motor
+def run_engine(ring_name, connection, engine_config):
+    import enrutador
+    import main
+    import tiempo_real
+
+    main.config.update(engine_config)
+    tiempo_real.configure(main.config)
+    ring = anillo.attach_ring(ring_name)
+
+    # En vez de pintar, la ventana y el canvas de main dejan los colores en el anillo
+    window = types.SimpleNamespace(cget=lambda option: "bg")
+    canvas = types.SimpleNamespace(
+        itemconfig=lambda shape_id, **options: paint(ring, shape_id,
+                                                     options.get("fill")))
+
+    engine = {
+        # Red virtual, la comparten todos los hilos y unmark_shapes la pinta como la vista
+        "triangle_ids": main.lattice_view["triangle_ids"],
+        "input_state": main.new_input_state(main.midi_state["note_times"]),
+    }
+    set_lattice(engine, main.lattice_tuning())
+    main.midi_state["listeners"].append(
+        lambda kind, *values: publish(ring, kind, values))
+    main.start_state_export()
+    main.start_osc_output()
+    operations = engine_operations(engine, window, canvas)
+
+    try:
+        while True:
+            if connection.poll(main.UI_QUEUE_INTERVAL / 1000):
+                try:
+                    operation, args = connection.recv()
+                except EOFError:
+                    # La ventana se ha cerrado sin avisar
+                    break
+                if operation == "exit":
+                    break
+                if operation in operations:
+                    operations[operation](*args)
+                else:
+                    print("Operación del motor desconocida:", operation)
+
+            # Lo que los temporizadores mandan al hilo principal, como desmarcar tras mover
+            main.run_ui_callbacks()
+            # Lo que ha pasado en esta vuelta sale en un solo bundle OSC
+            emisor.flush()
+    finally:
+        # Cada hilo suelta sus notas al parar, así que esperamos antes de cerrar la salida
+        for stop_key, thread_key in ENGINE_THREADS:
+            stop_thread(stop_key)
+            if main.threads_control[thread_key] is not None:
+                main.threads_control[thread_key].join(THREAD_EXIT_WAIT)
+        enrutador.stop_router()
+        grabador.stop_recording(wait=True)
+        exportador.close_export()
+        emisor.close_output()
+        anillo.close_ring(ring)
@@ -0,0 +1,215 @@
+import threading
+import time
+import temporizador
+"""
+Reloj MIDI del arpegiador, a 24 pulsos por negra (PPQN) como el reloj MIDI.
+- interno: el arpegiador usa su propio tempo y no hay reloj
+- externo: los mensajes clock, start, continue y stop de un puerto de
+  entrada marcan el ritmo. Los pulsos llegan con retrasos irregulares, así
+  que un PLL estima el periodo y la fase del reloj y los pasos se programan
+  en el temporizador en el instante estimado del pulso, no al llegar
+- maestro: el temporizador genera los pulsos a partir del tempo y los envía
+  por la salida MIDI, y los pasos del arpegiador se tocan en esos pulsos
+"""
+
+PPQN = 24  # Pulsos de reloj por negra
+CLOCK_MODES = ("internal", "external", "master")
+PLL_PHASE_GAIN = 0.1  # Parte del error que corrige la fase en cada pulso
+PLL_PERIOD_GAIN = 0.0025  # Parte del error que corrige el periodo (PLL amortiguado)
+LOCK_TICKS = PPQN  # Pulsos que se promedian para el primer periodo antes de usar el PLL
+RELOCK_ERROR = 0.5  # Error, en periodos, a partir del cual se vuelve a enganchar
+
+# Estado del reloj
+clock = {
+    "period": None,  # Segundos estimados entre pulsos
+    "phase": None,  # Instante estimado del último pulso
+    "tick": 0,  # Número del último pulso desde el start
+    "lock": None,  # Instante y número de pulsos desde que nos enganchamos
+    "running": False,  # Indica si el reloj externo está en marcha (entre start y stop)
+    "step": None,  # Pasos del arpegiador: función, pulsos por paso y función de parada
+    "step_timer": None,  # Temporizador del siguiente paso
+    "master": None,  # Estado del reloj maestro si está en marcha
+    "mutex": threading.Lock(),  # Protege el estado entre el hilo MIDI y el temporizador
+}
+
+
+# Pulsos de reloj por cada paso del arpegiador según el compás
+def ticks_per_step(compas_value):
+    beats_per_measure = int(compas_value.split("/")[0])
+    note_value = int(compas_value.split("/")[1])
+    # Igual que calculate_time_between_notes: una negra por beats/note_value
+    return max(1, round(PPQN * beats_per_measure / note_value))
+
+
+# Tempo en bpm estimado a partir del reloj externo, o None si no hay reloj
+def estimated_tempo():
+    if clock["period"] is None:
+        return None
+    return 60 / (clock["period"] * PPQN)
+
+
+# Registramos la función que toca un paso del arpegiador en cada paso de reloj
+def set_step_callback(step, steps_getter, stop):
+    global clock
+
+    with clock["mutex"]:
+        clock["step"] = {
+            "callback": step,
+            "ticks": steps_getter,
+            "stop": stop,
+        }
+        return clock["step"]
+
+
+# Quitamos la función de los pasos si sigue siendo la registrada
+def clear_step_callback(step):
+    global clock
+
+    with clock["mutex"]:
+        if clock["step"] is step:
+            clock["step"] = None
+            temporizador.cancel(clock["step_timer"])
+
+
+# Indicamos si el pulso tick es el primero de un paso del arpegiador
+def step_on_tick(tick):
+    step = clock["step"]
+    return step is not None and tick % step["ticks"]() == 0
+
+
+# Procesamos un mensaje de reloj de la entrada con el instante en que llegó al puerto
+def clock_message(kind, timestamp):
+    global clock
+
+    with clock["mutex"]:
+        if kind in ("start", "continue"):
+            clock["running"] = True
+            # Después de start el siguiente pulso es el primero de la canción
+            if kind == "start":
+                clock["tick"] = -1
+        elif kind == "stop":
+            clock["running"] = False
+            temporizador.cancel(clock["step_timer"])
+            if clock["step"] is not None:
+                temporizador.schedule(0, clock["step"]["stop"])
+        elif kind == "clock":
+            clock_tick(timestamp)
+
+
+# Actualizamos el PLL con un pulso y programamos el paso que toque (con el cerrojo cogido)
+def clock_tick(timestamp):
+    global clock
+
+    clock["tick"] += 1
+    period = clock["period"]
+    phase = clock["phase"]
+
+    if clock["lock"] is None:
+        clock["lock"] = (timestamp, 0)
+        clock["phase"] = timestamp
+        clock["period"] = None
+        return schedule_step()
+
+    lock_time, lock_ticks = clock["lock"]
+    lock_ticks += 1
+    if lock_ticks <= LOCK_TICKS:
+        # Mientras nos enganchamos el periodo es la media desde el primer pulso,
+        # así el retraso de un pulso suelto apenas cuenta
+        clock["lock"] = (lock_time, lock_ticks)
+        clock["period"] = (timestamp - lock_time) / lock_ticks
+        predicted = phase + clock["period"]
+        clock["phase"] = predicted + PLL_PHASE_GAIN * (timestamp - predicted)
+        return schedule_step()
+
+    predicted = phase + period
+    error = timestamp - predicted
+    if abs(error) > RELOCK_ERROR * period:
+        # Un salto de tempo o pulsos perdidos: nos volvemos a enganchar
+        clock["lock"] = (timestamp, 0)
+        clock["phase"] = timestamp
+    else:
+        clock["phase"] = predicted + PLL_PHASE_GAIN * error
+        clock["period"] = period + PLL_PERIOD_GAIN * error
+    schedule_step()
+
+
+# Programamos el paso que toque después del último pulso (con el cerrojo cogido)
+def schedule_step():
+    if not clock["running"] or clock["step"] is None:
+        return
+
+    # El primer pulso tras start no se puede adelantar, se toca al llegar
+    if clock["tick"] == 0 or clock["period"] is None:
+        if step_on_tick(clock["tick"]):
+            run_step()
+        return
+
+    # Programamos el paso en el instante estimado del siguiente pulso
+    if step_on_tick(clock["tick"] + 1):
+        clock["step_timer"] = temporizador.schedule_at(
+            clock["phase"] + clock["period"],
+            clock["step"]["callback"],
+            precise=True)
+
+
+# Tocamos ya un paso del arpegiador en el temporizador
+def run_step():
+    clock["step_timer"] = temporizador.schedule(0, clock["step"]["callback"])
+
+
+# Arrancamos el reloj maestro, que envía los pulsos con send(tipo de mensaje)
+def start_master(period_getter, send):
+    global clock
+
+    stop_master()
+    master = {
+        "period": period_getter,  # Segundos entre pulsos según el tempo actual
+        "send": send,
+        "tick": 0,
+        "next_time": time.perf_counter(),
+        "timer": None,
+    }
+    with clock["mutex"]:
+        clock["master"] = master
+    send("start")
+    master["timer"] = temporizador.schedule_at(master["next_time"],
+                                               lambda: master_tick(master),
+                                               precise=True)
+
+
+# Enviamos un pulso del reloj maestro y programamos el siguiente
+def master_tick(master):
+    with clock["mutex"]:
+        if clock["master"] is not master:
+            return
+        step = step_on_tick(master["tick"])
+        callback = clock["step"]["callback"] if step else None
+
+    master["send"]("clock")
+    if callback is not None:
+        callback()
+
+    master["tick"] += 1
+    # Sumamos el periodo al instante anterior, así el reloj no deriva
+    master["next_time"] = max(master["next_time"] + master["period"](),
+                              time.perf_counter() - master["period"]())
+    with clock["mutex"]:
+        if clock["master"] is master:
+            master["timer"] = temporizador.schedule_at(
+                master["next_time"],
+                lambda: master_tick(master),
+                precise=True)
+
+
+# Paramos el reloj maestro
+def stop_master():
+    global clock
+
+    with clock["mutex"]:
+        master = clock["master"]
+        clock["master"] = None
+        if master is not None:
+            temporizador.cancel(master["timer"])
+
+    if master is not None:
+        master["send"]("stop")
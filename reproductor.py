@@ -0,0 +1,248 @@
+import array
+import bisect
+import threading
+import time
+"""
+Reproductor de ficheros MIDI. Al cargar el fichero se juntan todas las pistas
+y se guardan solo las notas en arrays compactos ordenados por tiempo, así
+avanzar es recorrer el array y saltar a un punto es una búsqueda binaria.
+Los mensajes se entregan a la función callback desde el hilo del reproductor,
+igual que los del puerto MIDI in.
+"""
+
+SPEEDS = [0.5, 0.75, 1.0, 1.25, 1.5, 2.0]  # Velocidades de reproducción
+
+# Estado del reproductor
+player = {
+    "times": array.array("d"),  # Segundo de la canción de cada nota
+    "notes": array.array("B"),  # Número MIDI de cada nota
+    "velocities": array.array("B"),  # Velocidad de cada nota, 0 si es note_off
+    "channels": array.array("B"),  # Canal de cada nota
+    "length": 0.0,  # Duración de la canción en segundos
+    "position": 0,  # Índice de la siguiente nota a tocar
+    "song_time": 0.0,  # Segundo de la canción desde el que se cuenta
+    "clock_time": 0.0,  # Instante de perf_counter que corresponde a song_time
+    "speed": 1.0,  # Velocidad de reproducción
+    "playing": False,  # Indica si la canción está sonando
+    "sounding": set(),  # Notas (canal, nota) que están sonando
+    "callback": None,  # Función que recibe cada mensaje MIDI
+    "lock": threading.Lock(),  # Protege el estado entre la ventana y el hilo
+    "wake_event": None,  # Despierta al hilo en marcha tras cambiar el estado, cada hilo tiene el suyo
+    "stop_event": None,  # Evento para detener el hilo
+    "thread": None,  # Hilo que reproduce la canción
+}
+
+
+# Cargamos un fichero MIDI y guardamos sus notas ordenadas por tiempo
+def load_midi_file(path):
+    global player
+    import mido
+
+    midi_file = mido.MidiFile(path)
+    times = array.array("d")
+    notes = array.array("B")
+    velocities = array.array("B")
+    channels = array.array("B")
+
+    # Recorrer el fichero junta las pistas y convierte los ticks a segundos con sus tempos
+    current_time = 0.0
+    for msg in midi_file:
+        current_time += msg.time
+        if msg.type == "note_on" or msg.type == "note_off":
+            times.append(current_time)
+            notes.append(msg.note)
+            channels.append(msg.channel)
+            if msg.type == "note_on":
+                velocities.append(msg.velocity)
+            else:
+                velocities.append(0)
+
+    stop_player()
+    with player["lock"]:
+        player.update({
+            "times": times,
+            "notes": notes,
+            "velocities": velocities,
+            "channels": channels,
+            "length": current_time,
+            "position": 0,
+            "song_time": 0.0,
+            "playing": False,
+        })
+
+    return len(times), current_time
+
+
+# Segundo de la canción por el que va la reproducción
+def current_song_time():
+    if not player["playing"]:
+        return player["song_time"]
+    elapsed = time.perf_counter() - player["clock_time"]
+    return player["song_time"] + elapsed * player["speed"]
+
+
+# Construimos el mensaje MIDI de una nota guardada
+def build_message(index):
+    import mido
+
+    if player["velocities"][index]:
+        return mido.Message("note_on",
+                            channel=player["channels"][index],
+                            note=player["notes"][index],
+                            velocity=player["velocities"][index])
+    return mido.Message("note_off",
+                        channel=player["channels"][index],
+                        note=player["notes"][index])
+
+
+# Mensajes note_off de las notas que están sonando
+def release_sounding():
+    import mido
+
+    messages = [
+        mido.Message("note_off", channel=channel, note=note)
+        for channel, note in player["sounding"]
+    ]
+    player["sounding"].clear()
+    return messages
+
+
+# Bucle del hilo del reproductor
+def playback_loop(stop_event, wake_event):
+    global player
+
+    while not stop_event.is_set():
+        messages = []
+        timeout = None
+
+        with player["lock"]:
+            if player["playing"]:
+                song_time = current_song_time()
+                times = player["times"]
+                # Tocamos todas las notas a las que ya les ha llegado el momento
+                while (player["position"] < len(times)
+                       and times[player["position"]] <= song_time):
+                    message = build_message(player["position"])
+                    key = (message.channel, message.note)
+                    if message.type == "note_on":
+                        player["sounding"].add(key)
+                    else:
+                        player["sounding"].discard(key)
+                    messages.append(message)
+                    player["position"] += 1
+
+                if player["position"] < len(times):
+                    # Dormimos hasta la siguiente nota
+                    timeout = (times[player["position"]] -
+                               song_time) / player["speed"]
+                else:
+                    # Se ha terminado la canción
+                    player["song_time"] = player["length"]
+                    player["playing"] = False
+                    messages.extend(release_sounding())
+
+        # Entregamos los mensajes fuera del cerrojo para no bloquear los controles
+        for message in messages:
+            player["callback"](message)
+
+        if wake_event.wait(timeout):
+            wake_event.clear()
+
+
+# Arrancamos el hilo del reproductor
+def start_player(callback):
+    global player
+
+    stop_player()
+    player["callback"] = callback
+    player["stop_event"] = threading.Event()
+    # Un evento nuevo, así el hilo anterior no puede gastar los avisos de este
+    player["wake_event"] = threading.Event()
+
+    player_thread = threading.Thread(target=playback_loop,
+                                     args=(player["stop_event"],
+                                           player["wake_event"]),
+                                     daemon=True)
+    player_thread.start()
+
+    player["thread"] = player_thread
+
+
+# Detenemos el hilo del reproductor
+def stop_player():
+    global player
+
+    pause()
+    if player["stop_event"] is not None:
+        player["stop_event"].set()
+        player["wake_event"].set()
+        player["stop_event"] = None
+        player["wake_event"] = None
+
+
+# Empezamos o seguimos la reproducción
+def play():
+    global player
+
+    with player["lock"]:
+        if player["playing"]:
+            return
+        # Si había terminado volvemos al principio
+        if player["position"] >= len(player["times"]):
+            player["position"] = 0
+            player["song_time"] = 0.0
+        player["clock_time"] = time.perf_counter()
+        player["playing"] = True
+
+    wake_player()
+
+
+# Pausamos la reproducción y soltamos las notas que estaban sonando
+def pause():
+    global player
+
+    with player["lock"]:
+        player["song_time"] = current_song_time()
+        player["playing"] = False
+        messages = release_sounding()
+
+    if player["callback"] is not None:
+        for message in messages:
+            player["callback"](message)
+    wake_player()
+
+
+# Saltamos a un segundo de la canción con una búsqueda binaria
+def seek(seconds):
+    global player
+
+    seconds = min(max(0.0, seconds), player["length"])
+    with player["lock"]:
+        player["position"] = bisect.bisect_left(player["times"], seconds)
+        player["song_time"] = seconds
+        player["clock_time"] = time.perf_counter()
+        messages = release_sounding()
+
+    if player["callback"] is not None:
+        for message in messages:
+            player["callback"](message)
+    wake_player()
+
+
+# Cambiamos la velocidad sin saltar en la canción
+def set_speed(speed):
+    global player
+
+    with player["lock"]:
+        player["song_time"] = current_song_time()
+        player["clock_time"] = time.perf_counter()
+        player["speed"] = float(speed)
+
+    wake_player()
+
+
+# Despertamos al hilo del reproductor, si está en marcha
+def wake_player():
+    wake_event = player["wake_event"]
+    if wake_event is not None:
+        wake_event.set()
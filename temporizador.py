@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import threading
+import time
+import tiempo_real
+"""
+Temporizador del programa. Todas las esperas con plazo (soltar un triángulo
+tras moverlo con las flechas, las notas del arpegiador, desmarcar al apagar
+el hold...) se guardan en un montículo ordenado por su instante, y un único
+hilo duerme hasta el plazo más cercano. Los temporizadores se pueden
+cancelar, y si se programan con una clave sustituyen al anterior con la
+misma clave, así una ráfaga de teclas no deja callbacks viejos pendientes.
+Los temporizadores que tocan notas se programan con precise: el hilo se
+despierta un poco antes y espera el último momento cediendo el GIL, porque
+el sistema puede despertarlo tarde. El resto simplemente duerme hasta su
+plazo.
+"""
+
+SPIN_MARGIN = 0.001  # Segundos antes del plazo en que se despierta el hilo para un temporizador preciso
+
+# Estado del temporizador
+timers = {
+    "heap": [],  # (instante, orden, temporizador) ordenados por instante
+    "keys": {},  # Clave -> temporizador pendiente con esa clave
+    "condition": threading.Condition(),  # Despierta al hilo al programar algo antes
+    "counter": itertools.count(),  # Desempata temporizadores con el mismo instante
+    "thread": None,  # Hilo que ejecuta los temporizadores
+}
+
+
+# Programamos una función para dentro de delay segundos
+def schedule(delay, callback, key=None, dispatcher=None, precise=False):
+    return schedule_at(time.perf_counter() + delay, callback, key, dispatcher,
+                       precise)
+
+
+# Programamos una función para un instante de perf_counter
+def schedule_at(deadline, callback, key=None, dispatcher=None,
+                precise=False):
+    """Si se da key se cancela el temporizador pendiente con la misma clave.
+    Si se da dispatcher, al vencer el plazo se le pasa la función en vez de
+    ejecutarla en el hilo del temporizador (por ejemplo la cola del hilo de
+    Tk), y si se cancela antes de que se ejecute ya no se ejecuta. precise
+    es para los que tienen que ser puntuales, como las notas."""
+    global timers
+
+    timer = {
+        "deadline": deadline,
+        "callback": callback,
+        "key": key,
+        "dispatcher": dispatcher,
+        "precise": precise,
+        "cancelled": False,
+    }
+
+    with timers["condition"]:
+        if key is not None:
+            previous = timers["keys"].get(key)
+            if previous is not None:
+                previous["cancelled"] = True
+            timers["keys"][key] = timer
+
+        heapq.heappush(timers["heap"],
+                       (deadline, next(timers["counter"]), timer))
+        # Solo despertamos al hilo si este plazo es el más cercano
+        if timers["heap"][0][2] is timer:
+            timers["condition"].notify()
+
+        if timers["thread"] is None:
+            timers["thread"] = threading.Thread(target=timer_loop,
+                                                daemon=True)
+            timers["thread"].start()
+
+    return timer
+
+
+# Cancelamos un temporizador, si ya se ha ejecutado no hace nada
+def cancel(timer):
+    global timers
+
+    if timer is None:
+        return
+    with timers["condition"]:
+        timer["cancelled"] = True
+        if timer["key"] is not None and timers["keys"].get(
+                timer["key"]) is timer:
+            del timers["keys"][timer["key"]]
+
+
+# Cancelamos el temporizador pendiente con una clave
+def cancel_key(key):
+    with timers["condition"]:
+        timer = timers["keys"].get(key)
+    cancel(timer)
+
+
+# Ejecutamos la función de un temporizador si no se ha cancelado mientras tanto
+def run_timer(timer):
+    with timers["condition"]:
+        if timer["cancelled"]:
+            return
+        timer["cancelled"] = True
+        if timer["key"] is not None and timers["keys"].get(
+                timer["key"]) is timer:
+            del timers["keys"][timer["key"]]
+
+    timer["callback"]()
+
+
+# Bucle del hilo del temporizador
+def timer_loop():
+    heap = timers["heap"]
+    condition = timers["condition"]
+    tiempo_real.apply_to_thread("temporizador")
+
+    while True:
+        with condition:
+            # Quitamos los cancelados de la cabeza, el resto se quitan al llegar su turno
+            while heap and heap[0][2]["cancelled"]:
+                heapq.heappop(heap)
+
+            if not heap:
+                condition.wait()
+                continue
+
+            remaining = heap[0][0] - time.perf_counter()
+            margin = SPIN_MARGIN if heap[0][2]["precise"] else 0
+            if remaining > margin:
+                condition.wait(remaining - margin)
+                continue
+
+            deadline, _, timer = heapq.heappop(heap)
+
+        # Solo los precisos llegan aquí antes de tiempo: esperamos el último
+        # momento sin dormir, pero dejando el GIL a los demás hilos
+        while time.perf_counter() < deadline:
+            time.sleep(0)
+
+        # Las funciones se ejecutan sin el cerrojo, así pueden programar otras.
+        # Como hace Tk con after, el error de una función no para a las demás
+        try:
+            if timer["dispatcher"] is not None:
+                timer["dispatcher"](lambda timer=timer: run_timer(timer))
+            else:
+                run_timer(timer)
+        except Exception as e:
+            print("Error en un temporizador:", e)
@@ -0,0 +1,53 @@
+import multiprocessing
+import anillo
+"""
+Pruebas del anillo de memoria compartida entre el motor y la ventana. Se
+lanzan con pytest.
+"""
+
+RECORDS = 200000  # Registros que escribe el proceso de prueba
+
+
+# Proceso que escribe en el anillo como el motor, con el valor de cada registro en orden
+def push_records(name, count, capacity):
+    ring = anillo.attach_ring(name, capacity)
+    try:
+        for value in range(count):
+            anillo.push(ring, 0.0, 0, value=value)
+    finally:
+        anillo.close_ring(ring)
+
+
+# Lo que escribe un proceso lo lee otro en orden, sin repetir y contando lo descartado
+def test_push_and_pop_from_two_processes():
+    capacity = 64
+    ring = anillo.create_ring(capacity)
+    context = multiprocessing.get_context("spawn")
+    writer = context.Process(target=push_records,
+                             args=(anillo.ring_name(ring), RECORDS, capacity))
+    try:
+        writer.start()
+        values = []
+        while writer.is_alive():
+            values.extend(record[4] for record in anillo.pop_all(ring))
+        writer.join()
+        values.extend(record[4] for record in anillo.pop_all(ring))
+
+        assert writer.exitcode == 0
+        assert all(a < b for a, b in zip(values, values[1:]))
+        assert len(values) + anillo.ring_dropped(ring) == RECORDS
+    finally:
+        anillo.close_ring(ring, unlink=True)
+
+
+# Con el anillo lleno los registros nuevos se descartan y los que había se conservan
+def test_full_ring_drops_new_records():
+    ring = anillo.create_ring(4)
+    try:
+        results = [anillo.push(ring, 0.0, 0, value=value) for value in range(6)]
+        assert results == [True] * 4 + [False] * 2
+        assert anillo.ring_dropped(ring) == 2
+        assert [record[4] for record in anillo.pop_all(ring)] == [0, 1, 2, 3]
+        assert anillo.pop_all(ring) == []
+    finally:
+        anillo.close_ring(ring, unlink=True)
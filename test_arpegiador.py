@@ -0,0 +1,50 @@
+import itertools
+import types
+import arpegiador
+"""
+Pruebas del orden de las notas del arpegiador. Se lanzan con pytest.
+"""
+
+
+# Valor fijo con la misma forma que las variables de Tk que lee el arpegiador
+def variable(value):
+    return types.SimpleNamespace(get=lambda: value)
+
+
+# Primeras notas que toca el arpegiador con un acorde, un compás y un modo
+def play_steps(compas, mode, octaves, count):
+    selected_shapes = {1: "triangle"}
+    shape_notes = {1: [67, 60, 64]}
+    target = {
+        "notes": arpegiador.get_arpeggio_notes(selected_shapes, shape_notes,
+                                               variable(compas), mode),
+        "octaves": octaves,
+        "mode": mode,
+        "params": (),
+    }
+    steps = arpegiador.arpeggio_steps(target)
+    return [note for step in itertools.islice(steps, count) for note in step]
+
+
+# En 4/4 la nota repetida no rompe el orden de up al subir de octava
+def test_up_is_monotonic_with_repeated_note():
+    notes = play_steps("4/4", "up", 2, 8)
+    assert notes == [60, 60, 64, 67, 72, 72, 76, 79]
+    assert notes == sorted(notes)
+
+
+# En 4/4 la nota repetida no rompe el orden de down al bajar de octava
+def test_down_is_monotonic_with_repeated_note():
+    notes = play_steps("4/4", "down", 2, 8)
+    assert notes == [79, 76, 72, 72, 67, 64, 60, 60]
+    assert notes == sorted(notes, reverse=True)
+
+
+# En 3/4 no se repite ninguna nota
+def test_three_four_does_not_repeat():
+    assert play_steps("3/4", "up", 2, 6) == [60, 64, 67, 72, 76, 79]
+
+
+# as_played sigue el orden del acorde y repite la primera al final
+def test_as_played_keeps_order():
+    assert play_steps("4/4", "as_played", 1, 4) == [67, 60, 64, 67]
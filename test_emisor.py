@@ -0,0 +1,76 @@
+import socket
+import time
+import pytest
+import emisor
+"""
+Pruebas de la salida OSC con un receptor UDP local. Se lanzan con pytest.
+"""
+
+
+# Receptor UDP local y salida OSC apuntando a él
+@pytest.fixture
+def receiver():
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.bind(("127.0.0.1", 0))
+    udp_socket.settimeout(2.0)
+    assert emisor.open_output(*udp_socket.getsockname())
+    try:
+        yield udp_socket
+    finally:
+        emisor.close_output()
+        udp_socket.close()
+
+
+# Un mensaje con enteros, decimales y textos de cualquier largo se decodifica igual
+@pytest.mark.parametrize("text", ["", "C", "Db", "Gb7", "acorde"])
+def test_message_round_trip(text):
+    data = emisor.osc_message("/tonnetz/prueba", 60, -1, 0.5, text)
+    assert len(data) % 4 == 0
+    assert emisor.parse_message(data) == ("/tonnetz/prueba",
+                                          [60, -1, 0.5, text])
+
+
+# Un datagrama que no es un bundle es un mensaje suelto sin instante
+def test_parse_single_message():
+    data = emisor.osc_message("/tonnetz/step", 3, 64)
+    assert emisor.parse_packet(data) == (None, [("/tonnetz/step", [3, 64])])
+
+
+# Los avisos de una vuelta llegan al receptor en un solo bundle, en orden
+def test_events_arrive_in_one_bundle(receiver):
+    before = time.time()
+    emisor.lattice_event("note", 60, True)
+    emisor.lattice_event("triangle", [60, 64, 67], True)
+    emisor.lattice_event("chord", ["C", "E", "G"])
+    emisor.lattice_event("step", 5, 64)
+    emisor.lattice_event("otro", 1)
+    emisor.flush()
+
+    timetag, messages = emisor.parse_packet(receiver.recv(65536))
+    assert messages == [
+        ("/tonnetz/note", [60, 1]),
+        ("/tonnetz/triangle", [60, 64, 67, 1]),
+        ("/tonnetz/chord", ["C", "E", "G"]),
+        ("/tonnetz/step", [5, 64]),
+    ]
+    assert before - 1 <= timetag - emisor.NTP_EPOCH <= time.time() + 1
+    assert not emisor.emitter["pending"]
+
+
+# Si el bundle no cabe en un datagrama se parte en varios con el mismo instante
+def test_large_flush_is_split(receiver, monkeypatch):
+    monkeypatch.setattr(emisor, "MAX_DATAGRAM", 200)
+    for step in range(50):
+        emisor.lattice_event("step", step, 60)
+    emisor.flush()
+
+    steps = []
+    timetags = set()
+    while len(steps) < 50:
+        data = receiver.recv(65536)
+        assert len(data) <= 200
+        timetag, messages = emisor.parse_packet(data)
+        timetags.add(timetag)
+        steps.extend(args[0] for _, args in messages)
+    assert steps == list(range(50))
+    assert len(timetags) == 1
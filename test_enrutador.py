@@ -0,0 +1,173 @@
+import collections
+import contextlib
+import threading
+import time
+import types
+import mido
+import pytest
+import enrutador
+"""
+Pruebas de las políticas de las colas del enrutador de salida. Se lanzan con
+pytest.
+"""
+
+
+# Hilo de puerto sin hilo ni puerto, con la cola llena de note_on
+def full_worker(overflow, size=4, sounding=()):
+    worker = {
+        "messages": collections.deque(),
+        "ready": threading.Condition(threading.Lock()),
+        "size": size,
+        "overflow": overflow,
+        "stats": {
+            "sent": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "max_depth": 0,
+            "max_wait": 0.0,
+        },
+        "sounding": set(sounding),
+        "retry_time": None,
+    }
+    for note in range(size):
+        enqueue(worker, mido.Message("note_on", note=note, velocity=100))
+    return worker
+
+
+# Dejamos un mensaje en la cola con el cerrojo cogido, como send
+def enqueue(worker, message):
+    with worker["ready"]:
+        enrutador.enqueue(worker, message, time.perf_counter())
+
+
+# Mensajes que hay en la cola
+def queued(worker):
+    return [message for _, message in worker["messages"]]
+
+
+# drop_oldest quita el mensaje más antiguo y deja entrar el nuevo
+def test_drop_oldest_drops_oldest_message():
+    worker = full_worker("drop_oldest")
+    enqueue(worker, mido.Message("note_on", note=10, velocity=100))
+    assert [message.note for message in queued(worker)] == [1, 2, 3, 10]
+    assert worker["stats"]["dropped"] == 1
+
+
+# Al quitar un note_on que no llegó a sonar drop_oldest quita también su note_off
+def test_drop_oldest_drops_note_off_of_dropped_note():
+    worker = full_worker("drop_oldest", size=2)
+    enqueue(worker, mido.Message("note_off", note=0))
+    enqueue(worker, mido.Message("note_on", note=10, velocity=100))
+    assert [(message.type, message.note) for message in queued(worker)] == [
+        ("note_on", 1), ("note_on", 10)
+    ]
+
+
+# coalesce sustituye el note_on pendiente de la misma nota
+def test_coalesce_replaces_pending_message():
+    worker = full_worker("coalesce")
+    enqueue(worker, mido.Message("note_on", note=2, velocity=30))
+    assert [message.velocity
+            for message in queued(worker)] == [100, 100, 30, 100]
+    assert worker["stats"]["coalesced"] == 1
+    assert worker["stats"]["dropped"] == 0
+
+
+# coalesce descarta el nuevo si no hay ninguno igual
+def test_coalesce_drops_new_without_match():
+    worker = full_worker("coalesce")
+    enqueue(worker, mido.Message("note_on", note=10, velocity=100))
+    assert [message.note for message in queued(worker)] == [0, 1, 2, 3]
+    assert worker["stats"]["dropped"] == 1
+
+
+# drop_new descarta siempre el mensaje nuevo
+def test_drop_new_drops_new_message():
+    worker = full_worker("drop_new")
+    enqueue(worker, mido.Message("note_on", note=2, velocity=30))
+    assert [message.velocity for message in queued(worker)] == [100] * 4
+    assert worker["stats"]["dropped"] == 1
+
+
+# El note_off de una nota que suena entra aunque la cola esté llena, con cualquier política
+@pytest.mark.parametrize("overflow", enrutador.OVERFLOW_POLICIES)
+def test_note_off_of_sounding_note_is_never_dropped(overflow):
+    worker = full_worker(overflow, sounding=[(0, 60)])
+    enqueue(worker, mido.Message("note_off", note=60))
+    assert queued(worker)[-1] == mido.Message("note_off", note=60)
+    assert worker["stats"]["dropped"] == 0
+
+
+# El note_off de una nota que va a sonar por la cola tampoco se descarta
+@pytest.mark.parametrize("overflow", enrutador.OVERFLOW_POLICIES)
+def test_note_off_of_queued_note_is_never_dropped(overflow):
+    worker = full_worker(overflow)
+    enqueue(worker, mido.Message("note_off", note=3))
+    assert queued(worker)[-1] == mido.Message("note_off", note=3)
+
+
+# Con la cola llena el note_off de una nota que no suena no suelta nada y se quita
+@pytest.mark.parametrize("overflow", enrutador.OVERFLOW_POLICIES)
+def test_useless_note_off_is_coalesced(overflow):
+    worker = full_worker(overflow)
+    enqueue(worker, mido.Message("note_off", note=60))
+    assert len(queued(worker)) == 4
+    assert worker["stats"]["coalesced"] == 1
+
+
+# Puerto falso que apunta lo que se le envía y cuándo se abre y se cierra
+@contextlib.contextmanager
+def fake_port(name, events, close_time=0.0):
+    events.append(("open", name))
+    port = types.SimpleNamespace(sent=[])
+    port.send = port.sent.append
+    try:
+        yield port
+    finally:
+        time.sleep(close_time)
+        events.append(("close", name, port.sent))
+
+
+# Un puerto sin mensajes no se cierra mientras le queda una nota sonando
+def test_idle_port_stays_open_while_notes_sound(monkeypatch):
+    events = []
+    monkeypatch.setattr(enrutador, "IDLE_TIMEOUT", 0.05)
+    monkeypatch.setattr(mido, "open_output",
+                        lambda name: fake_port(name, events))
+    destinations = [("prueba", 0, 16, "coalesce")]
+    try:
+        enrutador.send(mido.Message("note_on", note=60, velocity=100),
+                       destinations)
+        time.sleep(0.3)
+        assert "prueba" in enrutador.router["workers"]
+
+        enrutador.send(mido.Message("note_off", note=60), destinations)
+        time.sleep(0.3)
+        assert "prueba" not in enrutador.router["workers"]
+        assert [event[0] for event in events] == ["open", "close"]
+        assert [message.type for message in events[1][2]] == [
+            "note_on", "note_off"
+        ]
+    finally:
+        enrutador.stop_router()
+
+
+# Un puerto que se vuelve a abrir espera a que el hilo anterior lo haya cerrado
+def test_reopen_waits_for_previous_close(monkeypatch):
+    events = []
+    monkeypatch.setattr(enrutador, "IDLE_TIMEOUT", 0.05)
+    monkeypatch.setattr(mido, "open_output",
+                        lambda name: fake_port(name, events, close_time=0.2))
+    destinations = [("prueba", 0, 16, "coalesce")]
+    try:
+        enrutador.send(mido.Message("program_change", program=1),
+                       destinations)
+        # El hilo se quita al pasar IDLE_TIMEOUT pero tarda en cerrar el puerto
+        while "prueba" in enrutador.router["workers"]:
+            time.sleep(0.01)
+        enrutador.send(mido.Message("program_change", program=2),
+                       destinations)
+        time.sleep(0.5)
+        assert [event[0] for event in events[:3]] == ["open", "close", "open"]
+    finally:
+        enrutador.stop_router(timeout=2.0)
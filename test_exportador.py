@@ -0,0 +1,92 @@
+import mmap
+import multiprocessing
+import os
+import exportador
+"""
+Pruebas del estado publicado para visualizadores. Se lanzan con pytest.
+"""
+
+STEPS = 20000  # Pasos del arpegiador que publica el proceso de prueba
+
+
+# Proyectamos el fichero del estado como lo haría un visualizador
+def map_state(path):
+    with open(path, "rb") as state_file:
+        return mmap.mmap(state_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Proceso que publica pasos y acordes sin parar, como el motor
+def publish_steps(path, count):
+    exportador.open_export(path)
+    try:
+        for step in range(1, count + 1):
+            root = 60 + step % 12
+            chord = [root, root + 4, root + 7]
+            for note in chord:
+                exportador.lattice_event("note", note, True)
+            exportador.lattice_event("triangle", chord, True)
+            exportador.lattice_event("step", step, root)
+            exportador.lattice_event("triangle", chord, False)
+            for note in chord:
+                exportador.lattice_event("note", note, False)
+    finally:
+        exportador.close_export()
+
+
+# Lo que se publica es lo que lee un visualizador con su propio mmap
+def test_state_round_trip(tmp_path):
+    path = str(tmp_path / "estado")
+    assert exportador.open_export(path)
+    try:
+        for note in (60, 64, 67):
+            exportador.lattice_event("note", note, True)
+        exportador.lattice_event("triangle", [60, 64, 67], True)
+        exportador.lattice_event("step", 7, 64)
+
+        memory = map_state(path)
+        state = exportador.read_state(memory)
+        memory.close()
+    finally:
+        exportador.close_export()
+
+    assert state["sequence"] % 2 == 0
+    assert state["pitch_classes"] == exportador.pitch_mask([60, 64, 67])
+    assert state["triangles"] == [exportador.pitch_mask([60, 64, 67])]
+    assert state["step"] == 7
+    assert state["step_note"] == 64
+
+
+# Un lector en otro proceso nunca ve un estado a medias mientras se escribe
+def test_reader_never_sees_torn_state(tmp_path):
+    path = str(tmp_path / "estado")
+    # El fichero existe antes de arrancar, así el lector puede proyectarlo ya
+    exportador.open_export(path)
+    exportador.close_export()
+    context = multiprocessing.get_context("spawn")
+    writer = context.Process(target=publish_steps, args=(path, STEPS))
+    memory = map_state(path)
+    try:
+        writer.start()
+        sequence = 0
+        while writer.is_alive():
+            state = exportador.read_state(memory)
+            if state is None:
+                continue
+            # Cada paso se escribe con su nota, y la secuencia nunca retrocede
+            if state["step_note"]:
+                assert state["step_note"] == 60 + state["step"] % 12
+            assert state["sequence"] % 2 == 0
+            assert state["sequence"] >= sequence
+            sequence = state["sequence"]
+        writer.join()
+        assert writer.exitcode == 0
+
+        # Al terminar queda publicado el último paso, sin nada seleccionado
+        state = exportador.read_state(memory)
+        assert state["step"] == STEPS
+        assert state["pitch_classes"] == 0
+        assert state["triangles"] == []
+    finally:
+        memory.close()
+
+    assert os.path.getsize(path) == exportador.SIZE
@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+import temporizador
+"""
+Pruebas del servicio de temporizadores. Se lanzan con pytest.
+"""
+
+WAIT = 2.0  # Segundos máximos que se espera a que se ejecute un temporizador
+
+
+# Temporizador que apunta su nombre y avisa al ejecutarse
+def recorder(calls, name, done=None):
+
+    def callback():
+        calls.append(name)
+        if done is not None:
+            done.set()
+
+    return callback
+
+
+# Los temporizadores se ejecutan por orden de plazo, no de programación
+def test_timers_run_in_deadline_order():
+    calls = []
+    done = threading.Event()
+    start = time.perf_counter() + 0.05
+    temporizador.schedule_at(start + 0.03, recorder(calls, "c", done))
+    temporizador.schedule_at(start + 0.01, recorder(calls, "a"))
+    temporizador.schedule_at(start + 0.02, recorder(calls, "b"),
+                             precise=True)
+    assert done.wait(WAIT)
+    assert calls == ["a", "b", "c"]
+
+
+# Un temporizador cancelado no se ejecuta
+def test_cancelled_timer_does_not_run():
+    calls = []
+    done = threading.Event()
+    timer = temporizador.schedule(0.02, recorder(calls, "cancelado"))
+    temporizador.schedule(0.04, recorder(calls, "siguiente", done))
+    temporizador.cancel(timer)
+    assert done.wait(WAIT)
+    assert calls == ["siguiente"]
+
+
+# Programar con la misma clave sustituye al pendiente
+def test_key_replaces_pending_timer():
+    calls = []
+    done = threading.Event()
+    temporizador.schedule(0.02, recorder(calls, "viejo"), key="prueba")
+    temporizador.schedule(0.03, recorder(calls, "nuevo", done), key="prueba")
+    assert done.wait(WAIT)
+    time.sleep(0.02)
+    assert calls == ["nuevo"]
+    assert "prueba" not in temporizador.timers["keys"]
+
+
+# Un temporizador que falla no para a los demás
+def test_failing_timer_does_not_stop_others(capsys):
+    calls = []
+    done = threading.Event()
+    temporizador.schedule(0.01, lambda: 1 / 0)
+    temporizador.schedule(0.03, recorder(calls, "después", done))
+    assert done.wait(WAIT)
+    assert calls == ["después"]
+    assert "Error en un temporizador" in capsys.readouterr().out
+
+
+# Con dispatcher la función se entrega a otro hilo y se puede cancelar hasta que la ejecute
+def test_dispatched_timer_can_be_cancelled_until_run():
+    calls = []
+    dispatched = queue.Queue()
+    timer = temporizador.schedule(0.01, recorder(calls, "entregado"),
+                                  dispatcher=dispatched.put)
+    callback = dispatched.get(timeout=WAIT)
+    temporizador.cancel(timer)
+    callback()
+    assert calls == []
+
+
+# Un temporizador preciso no se ejecuta antes de su plazo
+def test_precise_timer_never_runs_early():
+    ran = []
+    done = threading.Event()
+    deadline = time.perf_counter() + 0.02
+    temporizador.schedule_at(
+        deadline, lambda: (ran.append(time.perf_counter()), done.set()),
+        precise=True)
+    assert done.wait(WAIT)
+    assert ran[0] >= deadline
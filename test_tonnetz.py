@@ -0,0 +1,116 @@
+import random
+import numpy as np
+import pytest
+import tonnetz
+"""
+Pruebas de las funciones de tonnetz que trabajan con arrays de notas,
+comparadas con las que trabajan nota a nota. Se lanzan con pytest.
+"""
+
+WINDOW = 1 / 16  # Ventana de acorde; los instantes son múltiplos de 1/64 y se restan sin redondeo
+TUNINGS = (
+    {},
+    {"origin_note": 0, "fifth": 7, "third": 4},
+    {"origin_note": 3, "fifth": 5, "third": 3},
+)
+
+
+# Notas midi e instantes ordenados de una interpretación inventada
+def random_notes(count=300, seed=1):
+    generator = random.Random(seed)
+    notes = [generator.randrange(36, 96) for _ in range(count)]
+    onsets = []
+    current = 0.0
+    for _ in range(count):
+        current += generator.choice((0, 1, 2, 4, 16, 40)) / 64
+        onsets.append(current)
+    return notes, onsets
+
+
+# Las clases de altura son las de cada nota por separado
+def test_pitch_classes_match_each_note():
+    notes, _ = random_notes()
+    assert list(tonnetz.pitch_classes(notes)) == [note % 12 for note in notes]
+
+
+# Cada nota cae en un vértice de la red con su misma clase de altura
+@pytest.mark.parametrize("tuning", TUNINGS)
+def test_lattice_coordinates_match_pitch_class_at(tuning):
+    notes = list(range(60, 72))
+    for note, (row, col) in zip(notes,
+                                tonnetz.lattice_coordinates(notes, **tuning)):
+        if row < 0:
+            # Con esta afinación la nota no sale en la red
+            assert all(pitch is None or pitch != note % 12
+                       for grid_row in tonnetz.generate_lattice(12, 24, **tuning)
+                       for pitch in grid_row)
+            continue
+        assert (row + col) % 2 == 1
+        assert tonnetz.pitch_class_at(row, col, **tuning) == note % 12
+
+
+# La ventana de cada nota empieza en la primera nota dentro de max_interval, incluida la del borde
+def test_chord_windows_match_loop():
+    _, onsets = random_notes()
+    windows = tonnetz.chord_windows(onsets, WINDOW)
+    for index, onset in enumerate(onsets):
+        first = next(other for other in range(index + 1)
+                     if onset - onsets[other] <= WINDOW)
+        assert windows[index] == first
+
+
+# La máscara de cada ventana junta las clases de altura de sus notas
+def test_chord_masks_match_loop():
+    notes, onsets = random_notes()
+    pitches = tonnetz.pitch_classes(notes)
+    windows = tonnetz.chord_windows(onsets, WINDOW)
+    masks = tonnetz.chord_masks(pitches, windows)
+    for index in range(len(notes)):
+        expected = 0
+        for other in range(windows[index], index + 1):
+            expected |= 1 << notes[other] % 12
+        assert masks[index] == expected
+
+
+# Una ventana forma un triángulo solo si sus notas son las de un triángulo de la red
+@pytest.mark.parametrize("tuning", TUNINGS)
+def test_triangle_ids_match_triangle_table(tuning):
+    cells, _ = tonnetz.triangle_index(**tuning)
+    table = tonnetz.triangle_table(**tuning)
+    chords = {
+        sum(1 << tonnetz.pitch_class(note) for note in notes): notes
+        for notes in table
+    }
+
+    masks = np.arange(1 << 12, dtype=np.uint16)
+    ids = tonnetz.triangle_ids(masks, **tuning)
+    for mask, triangle in zip(masks.tolist(), ids.tolist()):
+        if mask not in chords:
+            assert triangle == -1
+            continue
+        row, col = cells[triangle]
+        assert frozenset(tonnetz.triangle_notes(row, col,
+                                                **tuning)) == chords[mask]
+
+
+# Las notas de un acorde tocado juntas dan su triángulo, como con chord_window nota a nota
+def test_played_chord_gives_same_triangle_as_chord_window():
+    notes = [60, 64, 67, 62, 65, 69]
+    onsets = [0.0, 0.01, 0.02, 1.0, 1.01, 1.02]
+    masks = tonnetz.chord_masks(tonnetz.pitch_classes(notes),
+                                tonnetz.chord_windows(onsets, WINDOW))
+    ids = tonnetz.triangle_ids(masks)
+    cells, _ = tonnetz.triangle_index()
+    table = tonnetz.triangle_table()
+
+    note_times = {}
+    for index, (note, onset) in enumerate(zip(notes, onsets)):
+        names = tonnetz.chord_window(note_times,
+                                     tonnetz.NOTE_NAMES[note % 12], onset,
+                                     WINDOW)
+        if frozenset(names) in table:
+            assert tuple(cells[ids[index]]) == table[frozenset(names)]
+        else:
+            assert ids[index] == -1
+    # Los dos acordes se reconocen al llegar su tercera nota
+    assert [index for index, triangle in enumerate(ids) if triangle >= 0] == [2, 5]
@@ -0,0 +1,129 @@
+import os
+import threading
+"""
+Planificación en tiempo real de los hilos MIDI en Linux. Según config.yml:
+- realtime_policy: none, fifo o rr (SCHED_FIFO o SCHED_RR)
+- realtime_priority: prioridad de 1 a 99 de esas políticas
+- realtime_threads: hilos que la reciben (midi_in, temporizador, salida)
+- cpu_affinity: núcleos en los que pueden ejecutarse esos hilos
+- lock_memory: bloquear la memoria del programa para que no vaya a swap
+Sin permisos (CAP_SYS_NICE, CAP_IPC_LOCK o los límites de
+/etc/security/limits.conf) el hilo sigue con la planificación normal y se
+avisa. Lo que se ha aplicado de verdad se guarda en realtime["applied"].
+"""
+
+REALTIME_THREADS = ("midi_in", "temporizador", "salida")
+MCL_CURRENT = 1  # Constantes de mlockall en Linux
+MCL_FUTURE = 2
+
+# Configuración y planificación aplicada
+realtime = {
+    "settings": {},  # Claves de tiempo real de la configuración
+    "applied": {},  # Nombre del hilo -> planificación que tiene de verdad
+    "memory": "no bloqueada",  # Resultado de bloquear la memoria
+    "lock": threading.Lock(),  # Protege applied entre hilos
+}
+
+
+# Guardamos la configuración de tiempo real y bloqueamos la memoria si se pide
+def configure(config):
+    global realtime
+
+    realtime["settings"] = {
+        "policy": config.get("realtime_policy", "none"),
+        "priority": int(config.get("realtime_priority", 20)),
+        "threads": config.get("realtime_threads", list(REALTIME_THREADS)),
+        "cpus": config.get("cpu_affinity", []),
+    }
+    if config.get("lock_memory", False):
+        lock_memory()
+
+
+# Bloqueamos la memoria del programa con mlockall
+def lock_memory():
+    global realtime
+    import ctypes
+    import resource
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        flags = MCL_CURRENT
+        # Con MCL_FUTURE y un límite bajo fallarían las reservas de memoria futuras
+        limit = resource.getrlimit(resource.RLIMIT_MEMLOCK)[0]
+        if limit == resource.RLIM_INFINITY or os.geteuid() == 0:
+            flags |= MCL_FUTURE
+        if libc.mlockall(flags) != 0:
+            raise OSError(ctypes.get_errno(),
+                          os.strerror(ctypes.get_errno()))
+        realtime["memory"] = "bloqueada" if flags & MCL_FUTURE else (
+            "bloqueada la actual")
+    except (OSError, AttributeError) as e:
+        realtime["memory"] = "no bloqueada ({})".format(e)
+    print("Memoria:", realtime["memory"])
+
+
+# Damos al hilo que llama la planificación configurada para su tipo
+# Se llama desde el propio hilo al empezar. En Linux el 0 de
+# sched_setscheduler y sched_setaffinity es el hilo que llama, no todo el
+# proceso. label distingue hilos del mismo tipo, como los de cada puerto.
+def apply_to_thread(name, label=None):
+    global realtime
+    settings = realtime["settings"]
+    if name not in settings.get("threads", ()):
+        return None
+    # Sin nada que aplicar no tocamos el hilo ni llenamos la salida de avisos
+    if settings["policy"] not in ("fifo", "rr") and not settings["cpus"]:
+        return None
+
+    errors = []
+    if not hasattr(os, "sched_setscheduler"):
+        errors.append("no disponible en este sistema")
+    else:
+        policy = {
+            "fifo": getattr(os, "SCHED_FIFO", None),
+            "rr": getattr(os, "SCHED_RR", None),
+        }.get(settings["policy"])
+        if policy is not None:
+            priority = min(max(settings["priority"], 1), 99)
+            try:
+                os.sched_setscheduler(0, policy, os.sched_param(priority))
+            except OSError as e:
+                errors.append("sin tiempo real: {}".format(e))
+        if settings["cpus"]:
+            try:
+                os.sched_setaffinity(0, settings["cpus"])
+            except OSError as e:
+                errors.append("sin afinidad: {}".format(e))
+
+    applied = current_scheduling()
+    if errors:
+        applied += " (" + ", ".join(errors) + ")"
+    label = name if label is None else "{} {}".format(name, label)
+    with realtime["lock"]:
+        realtime["applied"][label] = applied
+    print("Planificación de {}: {}".format(label, applied))
+    return applied
+
+
+# Planificación que tiene de verdad el hilo que llama
+def current_scheduling():
+    if not hasattr(os, "sched_getscheduler"):
+        return "normal"
+
+    policy = os.sched_getscheduler(0)
+    names = {
+        getattr(os, "SCHED_FIFO", None): "SCHED_FIFO",
+        getattr(os, "SCHED_RR", None): "SCHED_RR",
+        getattr(os, "SCHED_OTHER", None): "SCHED_OTHER",
+    }
+    text = names.get(policy, str(policy))
+    if policy in (getattr(os, "SCHED_FIFO", None), getattr(os, "SCHED_RR",
+                                                           None)):
+        text += " prioridad {}".format(os.sched_getparam(0).sched_priority)
+    return text + ", núcleos {}".format(sorted(os.sched_getaffinity(0)))
+
+
+# Planificación aplicada a cada hilo y estado de la memoria, para mostrarlo
+def realtime_report():
+    with realtime["lock"]:
+        return dict(realtime["applied"]), realtime["memory"]
@@ -0,0 +1,277 @@
+import math
+
+# Nombres de las notas según su clase de altura (0 = C)
+NOTE_NAMES = [
+    "C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"
+]
+
+ORIGIN_NOTE = 10  # Clase de altura del vértice (0, 1), el primero del diagrama (Bb)
+FIFTH = 7  # Semitonos que se avanzan en horizontal (quintas)
+THIRD = 3  # Semitonos que se avanzan en diagonal hacia abajo a la derecha (terceras menores)
+"""
+Los vértices de la red se identifican con (fila, columna), donde la columna
+se mide en medios lados de triángulo. Así un vértice solo existe cuando
+fila + columna es impar, y la red es periódica: desplazarse dos columnas suma
+una quinta y bajar una fila hacia la derecha suma una tercera menor.
+Las funciones que trabajan con arrays de notas (vertex_table, chord_masks,
+triangle_ids...) usan NumPy, que es una dependencia del proyecto en
+requirements.txt. Se importa al llamarlas porque solo las usan analisis.py y
+benchmark.py: la red de la ventana se genera con listas.
+"""
+
+
+# Obtenemos la clase de altura (0-11) de un nombre de nota, o None si no existe
+def pitch_class(note_name):
+    if note_name in NOTE_NAMES:
+        return NOTE_NAMES.index(note_name)
+    return None
+
+
+# Calculamos la clase de altura (0-11) de un vértice de la red
+def pitch_class_at(row, col, origin_note=ORIGIN_NOTE, fifth=FIFTH,
+                   third=THIRD):
+    fifths = (col - 1 - row) // 2
+    return (origin_note + fifth * fifths + third * row) % 12
+
+
+# Obtenemos el nombre de la nota de un vértice de la red
+def note_at(row, col, origin_note=ORIGIN_NOTE, fifth=FIFTH, third=THIRD):
+    return NOTE_NAMES[pitch_class_at(row, col, origin_note, fifth, third)]
+
+
+# Generamos las clases de altura de un bloque de vértices de la red
+def generate_lattice(rows,
+                     columns,
+                     first_row=0,
+                     first_col=0,
+                     origin_note=ORIGIN_NOTE,
+                     fifth=FIFTH,
+                     third=THIRD):
+    """
+    Devuelve una lista de filas donde grid[i][j] es la clase de altura del
+    vértice (first_row + i, first_col + j), o None si en esa posición no hay
+    vértice. Como doce quintas vuelven a la misma nota, cada fila se repite
+    cada 24 columnas: calculamos un periodo y lo repetimos en vez de calcular
+    vértice a vértice.
+
+    No usamos NumPy aquí: la ventana llama a esta función al arrancar, y
+    cargar NumPy retrasaría unos 100 ms la primera vez que se pinta la red.
+    Además, quien la usa lee vértices sueltos de listas. Con la conversión
+    a listas, una versión con arrays tarda más que repetir el periodo (unos
+    1,4 ms frente a 1 ms para 200x200).
+    """
+    grid = []
+    repeats = columns // 24 + 1
+
+    for row in range(first_row, first_row + rows):
+        base = origin_note + third * row
+        period = [
+            (base + fifth * ((col - 1 - row) // 2)) % 12 if
+            (row + col) % 2 else None
+            for col in range(first_col, first_col + 24)
+        ]
+        grid.append((period * repeats)[:columns])
+
+    return grid
+
+
+# Vértices (fila, columna) del triángulo que ocupa la celda (row, col)
+def triangle_vertices(row, col):
+    # Triángulo con el vértice hacia arriba
+    if (row + col) % 2 == 0:
+        return [(row, col + 1), (row + 1, col + 2), (row + 1, col)]
+    # Triángulo con el vértice hacia abajo
+    return [(row + 1, col + 1), (row, col), (row, col + 2)]
+
+
+# Notas de un triángulo de la red
+def triangle_notes(row, col, origin_note=ORIGIN_NOTE, fifth=FIFTH,
+                   third=THIRD):
+    return [
+        note_at(vertex_row, vertex_col, origin_note, fifth, third)
+        for vertex_row, vertex_col in triangle_vertices(row, col)
+    ]
+
+
+# Tabla que asigna a cada acorde de la red una celda donde aparece
+def triangle_table(origin_note=ORIGIN_NOTE, fifth=FIFTH, third=THIRD):
+    """
+    La red se repite como mucho cada 12 filas y 24 columnas, así que basta
+    con recorrer ese bloque para encontrar todos sus triángulos. Las claves
+    son frozenset con los nombres de las notas del triángulo.
+    """
+    grid = generate_lattice(13, 26, 0, 0, origin_note, fifth, third)
+    table = {}
+
+    for row in range(12):
+        for col in range(24):
+            notes = frozenset(NOTE_NAMES[grid[vertex_row][vertex_col]]
+                              for vertex_row, vertex_col in triangle_vertices(
+                                  row, col))
+            table.setdefault(notes, (row, col))
+
+    return table
+
+
+# Añadimos una nota a las notas recientes y devolvemos las que forman el acorde
+def chord_window(note_times, note, current_time, max_interval):
+    # Si la nota aún no está en las notas activas la añadimos con su tiempo de activación
+    if note not in note_times:
+        note_times[note] = current_time
+
+    chord_notes = []
+    # Recorremos las notas activas para filtrar las que superaron el tiempo
+    for note, activation_time in list(note_times.items()):
+        if current_time - activation_time <= max_interval:
+            chord_notes.append(note)
+        else:
+            del note_times[note]
+
+    return chord_notes
+
+
+# Estadísticas de los tiempos entre notas de un origen, para adaptar la ventana de acorde
+def onset_stats(max_interval, chord_spread=0.02, gap_fraction=0.75):
+    """
+    Guardamos dos medias móviles exponenciales del logaritmo del tiempo entre
+    notas: una para las notas de un mismo acorde (cortas) y otra para el paso
+    de un acorde al siguiente (largas). Cada tiempo nuevo actualiza la media
+    que tiene más cerca, así que la memoria no crece. La ventana es una parte
+    del paso entre acordes, y al empezar vale max_interval.
+    """
+    return {
+        "last_onset": None,
+        "short": math.log(chord_spread),
+        "long": math.log(max_interval / gap_fraction),
+        "gap_fraction": gap_fraction,
+    }
+
+
+# Añadimos el instante de una nota a las estadísticas de su origen
+def update_onset_stats(stats, onset, alpha=0.1, longest=5.0):
+    last_onset = stats["last_onset"]
+    stats["last_onset"] = onset
+    # Las pausas largas no dicen nada de cómo se toca
+    if last_onset is None or not 0 < onset - last_onset <= longest:
+        return
+
+    interval = math.log(onset - last_onset)
+    if abs(interval - stats["short"]) <= abs(interval - stats["long"]):
+        stats["short"] += alpha * (interval - stats["short"])
+    else:
+        stats["long"] += alpha * (interval - stats["long"])
+
+
+# Ventana de acorde de un origen: cabe un acorde pero no llega al siguiente
+def chord_interval(stats, min_interval, max_interval):
+    interval = stats["gap_fraction"] * math.exp(stats["long"])
+    return min(max(interval, min_interval), max_interval)
+
+
+# Posición en pantalla de un vértice a partir del origen y el lado del triángulo
+def vertex_position(row, col, origin_x, origin_y, side):
+    return (origin_x + col * side / 2, origin_y + row * side * math.sqrt(3) / 2)
+
+
+# Filas y columnas de triángulos que se ven en pantalla, más un margen
+def visible_cells(width, height, origin_x, origin_y, side, margin):
+    # La red no tiene bordes: las celdas salen solo de la vista y pueden ser negativas
+    triangle_height = side * math.sqrt(3) / 2
+    half_side = side / 2
+
+    first_row = math.floor(-origin_y / triangle_height) - margin
+    last_row = math.ceil((height - origin_y) / triangle_height) + margin
+    # Un triángulo ocupa tres columnas de vértices, por eso restamos 2
+    first_col = math.floor(-origin_x / half_side) - 2 - margin
+    last_col = math.ceil((width - origin_x) / half_side) + margin
+
+    return range(first_row, max(first_row, last_row)), range(
+        first_col, max(first_col, last_col))
+
+
+# Vértice de la red donde aparece cada clase de altura por primera vez
+def vertex_table(origin_note=ORIGIN_NOTE, fifth=FIFTH, third=THIRD):
+    import numpy as np
+
+    vertices = np.full((12, 2), -1, dtype=np.int32)
+    grid = generate_lattice(12, 24, 0, 0, origin_note, fifth, third)
+
+    for row in range(12):
+        for col in range(24):
+            pitch = grid[row][col]
+            if pitch is not None and vertices[pitch, 0] < 0:
+                vertices[pitch] = (row, col)
+
+    return vertices
+
+
+# Índices de los triángulos de la red a partir de la máscara de sus notas
+def triangle_index(origin_note=ORIGIN_NOTE, fifth=FIFTH, third=THIRD):
+    """
+    Devuelve (cells, lookup): cells[i] es la celda (fila, columna) del
+    triángulo i y lookup es un array de 4096 posiciones donde lookup[mask] es
+    el índice del triángulo cuyas clases de altura forman la máscara de bits
+    mask, o -1 si esas notas no forman un triángulo.
+    """
+    import numpy as np
+
+    table = triangle_table(origin_note, fifth, third)
+    cells = np.array(list(table.values()), dtype=np.int32)
+    lookup = np.full(1 << 12, -1, dtype=np.int16)
+
+    for index, notes in enumerate(table):
+        mask = sum(1 << pitch_class(note) for note in notes)
+        lookup[mask] = index
+
+    return cells, lookup
+
+
+# Clases de altura de un array de notas MIDI
+def pitch_classes(midi_notes):
+    import numpy as np
+
+    return (np.asarray(midi_notes) % 12).astype(np.uint8)
+
+
+# Coordenadas (fila, columna) en la red de un array de notas MIDI
+def lattice_coordinates(midi_notes,
+                        origin_note=ORIGIN_NOTE,
+                        fifth=FIFTH,
+                        third=THIRD):
+    return vertex_table(origin_note, fifth, third)[pitch_classes(midi_notes)]
+
+
+# Primera nota de la ventana de acorde que termina en cada nota
+def chord_windows(onsets, max_interval):
+    """
+    onsets son los instantes de las notas en segundos, ordenados. La ventana
+    de la nota i son las notas desde windows[i] hasta i, las que empezaron
+    como mucho max_interval segundos antes que ella.
+    """
+    import numpy as np
+
+    onsets = np.asarray(onsets, dtype=np.float64)
+    return np.searchsorted(onsets, onsets - max_interval, side="left")
+
+
+# Máscara de bits con las clases de altura de la ventana de cada nota
+def chord_masks(pitches, windows):
+    import numpy as np
+
+    bits = np.left_shift(1, np.asarray(pitches, dtype=np.uint16))
+    masks = bits.copy()
+    indices = np.arange(len(bits))
+    # Añadimos las notas anteriores de una en una, tantas veces como notas tenga la ventana más larga
+    longest = int((indices - windows).max()) if len(bits) else 0
+
+    for offset in range(1, longest + 1):
+        inside = indices[offset:] - offset >= windows[offset:]
+        masks[offset:] |= np.where(inside, bits[:-offset], 0).astype(np.uint16)
+
+    return masks
+
+
+# Índice del triángulo que forma la ventana de cada nota, o -1 si no forma ninguno
+def triangle_ids(masks, origin_note=ORIGIN_NOTE, fifth=FIFTH, third=THIRD):
+    _, lookup = triangle_index(origin_note, fifth, third)
+    return lookup[masks]